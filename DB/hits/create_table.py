@@ -3,48 +3,60 @@
 import sys
 import pathlib
 import logging
+import argparse
 
 import pandas as pd
-from collections import defaultdict
 
 ROOT_PATH = pathlib.Path().joinpath('../../').resolve()
 sys.path.append(str(ROOT_PATH))
-from mylib.db import IDManager, get_connection, load_name2id
+from mylib.db import IDManager, NameIndex
 from mylib.df import read_mmseqs
+from mylib.profiler import Profiler, NULL_PROFILER
 
 LOGGER = logging.getLogger(__name__)
 HID = IDManager("hits")
 
 
-def main(mmseqs_fp, hits_fp, error_fp):
-    LOGGER.info("Start extracting name2id from DB. Be patient...")
-    con = get_connection()
-    cds2id = load_name2id("cdss", default=-1, con=con)
-    LOGGER.info("loaded {} cds names".format(len(cds2id)))
-    refseq2id = load_name2id("refseqs", default=-1, con=con)
-    LOGGER.info("loaded {} refseq names".format(len(refseq2id)))
+def main(mmseqs_fp, hits_fp, error_fp, profiler=NULL_PROFILER):
+    with profiler.stage("db_load"):
+        cds_index = NameIndex.load("cdss")
+        LOGGER.info("loaded {} cds names".format(len(cds_index)))
+        refseq_index = NameIndex.load("refseqs")
+        LOGGER.info("loaded {} refseq names".format(len(refseq_index)))
 
-    mmseqs_df = read_mmseqs(mmseqs_fp)
-    LOGGER.info("loaded {} mmseqs hits".format(len(mmseqs_df)))
-    mmseqs_df["hit_id"] = mmseqs_df.index.map(lambda x: HID.new())
-    mmseqs_df["cds_id"] = mmseqs_df["qname"].map(cds2id)
-    mmseqs_df["refseq_id"] = mmseqs_df["sname"].map(refseq2id)
-    mmseqs_df["coverage"] = mmseqs_df["length"] / mmseqs_df["qlength"]
+    with profiler.stage("parse"):
+        mmseqs_df = read_mmseqs(mmseqs_fp)
+        LOGGER.info("loaded {} mmseqs hits".format(len(mmseqs_df)))
+    with profiler.stage("join"):
+        mmseqs_df["hit_id"] = list(HID.reserve(len(mmseqs_df)))
+        mmseqs_df["cds_id"] = cds_index.lookup(mmseqs_df["qname"])
+        mmseqs_df["refseq_id"] = refseq_index.lookup(mmseqs_df["sname"])
+        mmseqs_df["coverage"] = mmseqs_df["length"] / mmseqs_df["qlength"]
 
-    msk = (mmseqs_df["cds_id"] != -1) & (mmseqs_df["refseq_id"] != -1)
-    hits_df = mmseqs_df[msk][["hit_id", "cds_id", "refseq_id", "length", "identity", "coverage"]]
-    hits_df.to_csv(hits_fp, index=False, sep='\t', header=None)
-    LOGGER.info("saved {} records to {}".format(len(hits_df), hits_fp))
+    with profiler.stage("output"):
+        msk = (mmseqs_df["cds_id"] != -1) & (mmseqs_df["refseq_id"] != -1)
+        hits_df = mmseqs_df[msk][["hit_id", "cds_id", "refseq_id", "length", "identity", "coverage"]]
+        hits_df.to_csv(hits_fp, index=False, sep='\t', header=None)
+        LOGGER.info("saved {} records to {}".format(len(hits_df), hits_fp))
 
-    error_df = mmseqs_df[~msk]
-    error_df.to_csv(error_fp, index=False, sep='\t', header=None)
-    LOGGER.info("saved {} records to {}".format(len(error_df), error_fp))
+        error_df = mmseqs_df[~msk]
+        error_df.to_csv(error_fp, index=False, sep='\t', header=None)
+        LOGGER.info("saved {} records to {}".format(len(error_df), error_fp))
+    profiler.count("hits", len(hits_df))
+    profiler.count("errors", len(error_df))
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, datefmt="%m/%d/%Y %I:%M:%S",
                         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    mmseqs_fp = "/nfs_share/mitsuki/MicrobialDarkMatter/search/result_3.m8.best"
-    hits_fp = "./data/hits.tsv"
-    error_fp = "./data/hits_error.tsv"  # also output failed records for debugging
-    main(mmseqs_fp, hits_fp, error_fp)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mmseqs_fp", default="/nfs_share/mitsuki/MicrobialDarkMatter/search/result_3.m8.best")
+    parser.add_argument("--hits_fp", default="./data/hits.tsv")
+    parser.add_argument("--error_fp", default="./data/hits_error.tsv",
+                        help="also output failed records for debugging")
+    parser.add_argument("--profile_out", help="JSON report of wall time, cpu time and peak rss per stage")
+    args = parser.parse_args()
+    profiler = Profiler(enabled=args.profile_out is not None)
+    main(args.mmseqs_fp, args.hits_fp, args.error_fp, profiler)
+    if args.profile_out:
+        profiler.save(args.profile_out, script="hits/create_table", args=vars(args))
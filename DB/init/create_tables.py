@@ -4,9 +4,10 @@ import re
 import sys
 import pathlib
 import logging
+import argparse
+import multiprocessing
 
 import pandas as pd
-from Bio import SeqIO
 from tqdm import tqdm
 
 ROOT_PATH = pathlib.Path().joinpath('../../').resolve()
@@ -14,23 +15,33 @@ sys.path.append(str(ROOT_PATH))
 from mylib.db import Project, Genome, Scaffold, Cds
 from mylib.db import IDManager
 from mylib.path import build_local_filepath
-from mylib.gff import parse_gff
+from mylib.gff import read_gff_columns
+from mylib.fasta import iter_fasta_lengths
 
 LOGGER = logging.getLogger(__name__)
 PID = IDManager("projects")
 GID = IDManager("genomes")
 SID = IDManager("scaffolds")
 CID = IDManager("cdss")
+CHUNKSIZE = 16  # number of genomes sent to a worker process at once
 
 
-def load_scaffolds(fna_fp):
+def parse_scaffolds(fna_fp):
+    """
+    :return: list of (scaffold_name, length)
+    """
+
+    return list(iter_fasta_lengths(fna_fp))
+
+
+def load_scaffolds(scaffold_records):
     scaffolds = []
-    for record in SeqIO.parse(fna_fp, 'fasta'):
+    for scaffold_id, (scaffold_name, length) in zip(SID.reserve(len(scaffold_records)), scaffold_records):
         scaffolds.append(Scaffold(
-            scaffold_id=SID.new(),
+            scaffold_id=scaffold_id,
             genome_id=GID.get(),
-            scaffold_name=record.id,
-            length=len(record)
+            scaffold_name=scaffold_name,
+            length=length
         ))
     return scaffolds
 
@@ -51,30 +62,73 @@ def load_scaffolds_faster(gff_fp):
     return scaffolds
 
 
-def load_cdss(gff_fp, scaffold2id):
+def parse_cdss(gff_fp):
+    """
+    :return: list of (seqid, cds_name, start, end, strand)
+    :raise KeyError: if any CDS does not have cds_name attribute
+    """
+
+    gff_df = read_gff_columns(gff_fp, types={"CDS"}, attributes=["cds_name"])
+    if gff_df["cds_name"].isna().any():
+        raise KeyError("cds_name attribute is missing in {}".format(gff_fp))
+    return list(zip(gff_df["seqid"].tolist(), gff_df["cds_name"].tolist(), gff_df["start"].tolist(),
+                    gff_df["end"].tolist(), gff_df["strand"].tolist()))
+
+
+def load_cdss(cds_records, scaffold2id):
+    """
+    cds_ids of a genome are reserved at once, so that they are contiguous within a scaffold
+    """
+
     cdss = []
-    for record in parse_gff(gff_fp):
-        if record.type == "CDS":
-            cdss.append(Cds(
-                cds_id=CID.new(),
-                genome_id=GID.get(),
-                scaffold_id=scaffold2id[record.seqid],
-                cds_name=record.attributes["cds_name"],
-                start=record.start,
-                end=record.end,
-                length=record.end - record.start + 1,
-                strand=record.strand
-            ))
+    for cds_id, (seqid, cds_name, start, end, strand) in zip(CID.reserve(len(cds_records)), cds_records):
+        cdss.append(Cds(
+            cds_id=cds_id,
+            genome_id=GID.get(),
+            scaffold_id=scaffold2id[seqid],
+            cds_name=cds_name,
+            start=start,
+            end=end,
+            length=end - start + 1,
+            strand=strand
+        ))
     return cdss
 
 
+def parse_genome(genome_name):
+    """
+    parse files of a genome into plain tuples without IDs, so that genomes can be parsed by worker processes
+    :return: (genome_name, scaffold_records, cds_records)
+    """
+
+    fna_fp = build_local_filepath(genome_name, "fna").replace(".fna", ".dnaseq")
+    gff_fp = build_local_filepath(genome_name, "gff")
+    scaffold_records = parse_scaffolds(fna_fp)
+    LOGGER.debug("loaded {} scaffolds from {}".format(len(scaffold_records), fna_fp))
+    cds_records = parse_cdss(gff_fp)
+    LOGGER.debug("loaded {} cdss from {}".format(len(cds_records), gff_fp))
+    return genome_name, scaffold_records, cds_records
+
+
+def iter_parsed_genomes(genome_names, workers=1, chunksize=CHUNKSIZE):
+    """
+    yield parse_genome() results in the order of genome_names, parsing ahead with a pool of worker processes
+    """
+
+    if workers <= 1:
+        yield from map(parse_genome, genome_names)
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            yield from pool.imap(parse_genome, genome_names, chunksize=chunksize)
+
+
 def append_records(records, out_fp):
     with open(out_fp, 'a') as f:
         for record in records:
             f.write('{}\n'.format(record))
 
 
-def main(arg_fp, projects_fp, genomes_fp, scaffolds_fp, cdss_fp):
+def main(arg_fp, projects_fp, genomes_fp, scaffolds_fp, cdss_fp, workers=1):
     arg_df = pd.read_csv(arg_fp, sep='\t', comment='#')
     LOGGER.info("found {} projects to load".format(len(arg_df)))
     for project_name, meta_fp in zip(arg_df["project_name"], arg_df["meta_fp"]):
@@ -82,19 +136,13 @@ def main(arg_fp, projects_fp, genomes_fp, scaffolds_fp, cdss_fp):
         meta_df = pd.read_csv(meta_fp, sep='\t')
         LOGGER.info("start {} with {} genomes".format(project_name, len(meta_df)))
 
-        for _, genome_name in enumerate(tqdm(meta_df["genome_name"])):
-            if _ >= 10:
-                break
+        parsed_iter = iter_parsed_genomes(meta_df["genome_name"], workers)
+        for genome_name, scaffold_records, cds_records in tqdm(parsed_iter, total=len(meta_df)):
             LOGGER.debug("genome_name: {}".format(genome_name))
             genome = Genome(genome_id=GID.new(), project_id=PID.get(), genome_name=genome_name)
-            fna_fp = build_local_filepath(genome_name, "fna").replace(".fna", ".dnaseq")
-            gff_fp = build_local_filepath(genome_name, "gff")
-
-            scaffolds = load_scaffolds(fna_fp)
-            LOGGER.debug("loaded {} scaffolds from {}".format(len(scaffolds), fna_fp))
+            scaffolds = load_scaffolds(scaffold_records)
             scaffold2id = dict([(scaffold.scaffold_name, scaffold.scaffold_id) for scaffold in scaffolds])
-            cdss = load_cdss(gff_fp, scaffold2id)
-            LOGGER.debug("loaded {} cdss from {}".format(len(cdss), gff_fp))
+            cdss = load_cdss(cds_records, scaffold2id)
 
             append_records(scaffolds, scaffolds_fp)
             append_records(cdss, cdss_fp)
@@ -105,9 +153,13 @@ def main(arg_fp, projects_fp, genomes_fp, scaffolds_fp, cdss_fp):
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, datefmt="%m/%d/%Y %I:%M:%S",
                         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    arg_fp = "./arg/create_tables.arg"
-    projects_fp = "./data/projects.tsv"
-    genomes_fp = "./data/genomes.tsv"
-    scaffolds_fp = "./data/scaffolds.tsv"
-    cdss_fp = "./data/cdss.tsv"
-    main(arg_fp, projects_fp, genomes_fp, scaffolds_fp, cdss_fp)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--arg_fp", default="./arg/create_tables.arg")
+    parser.add_argument("--projects_fp", default="./data/projects.tsv")
+    parser.add_argument("--genomes_fp", default="./data/genomes.tsv")
+    parser.add_argument("--scaffolds_fp", default="./data/scaffolds.tsv")
+    parser.add_argument("--cdss_fp", default="./data/cdss.tsv")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes to parse genomes. IDs are assigned in the order of meta_fp")
+    args = parser.parse_args()
+    main(args.arg_fp, args.projects_fp, args.genomes_fp, args.scaffolds_fp, args.cdss_fp, args.workers)
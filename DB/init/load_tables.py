@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+"""
+Load projects, genomes, scaffolds and cdss directly into genome.db, in place of create_tables.py + load.sql + index.sql.
+Projects and genomes already in DB are skipped, so that re-runs are idempotent and a new project only costs its rows.
+"""
+
+import sys
+import pathlib
+import sqlite3
+import itertools
+import logging
+import argparse
+
+import pandas as pd
+from tqdm import tqdm
+
+ROOT_PATH = pathlib.Path().joinpath('../../').resolve()
+sys.path.append(str(ROOT_PATH))
+from mylib.db import IDManager, PRAGMA_PROFILES
+from mylib.path import DB_PATH
+from create_tables import iter_parsed_genomes
+
+LOGGER = logging.getLogger(__name__)
+INIT_DIREC = pathlib.Path(__file__).resolve().parent
+BATCH_SIZE = 100000  # number of rows inserted by an executemany
+COMMIT_GENOMES = 1000  # number of genomes loaded in a transaction
+INSERT_QUERIES = {
+    "projects": "INSERT INTO projects VALUES (?, ?);",
+    "genomes": "INSERT INTO genomes VALUES (?, ?, ?);",
+    "scaffolds": "INSERT INTO scaffolds VALUES (?, ?, ?, ?);",
+    "cdss": "INSERT INTO cdss VALUES (?, ?, ?, ?, ?, ?, ?, ?);"
+}
+PID = IDManager("projects")
+GID = IDManager("genomes")
+SID = IDManager("scaffolds")
+CID = IDManager("cdss")
+
+
+class BulkLoader:
+    """
+    Buffer rows per table and insert them by batched executemany, within the transaction of the connection
+    """
+
+    def __init__(self, con, batch_size=BATCH_SIZE, queries=INSERT_QUERIES):
+        """
+        :param queries: dict of table_name -> INSERT query
+        """
+
+        self.con = con
+        self.batch_size = batch_size
+        self.queries = queries
+        self.buffers = dict((table_name, []) for table_name in queries)
+        self.counts = dict((table_name, 0) for table_name in queries)
+
+    def append(self, table_name, rows):
+        buffer = self.buffers[table_name]
+        buffer.extend(rows)
+        if len(buffer) >= self.batch_size:
+            self.flush(table_name)
+
+    def flush(self, table_name=None):
+        for table_name in [table_name] if table_name else self.queries:
+            buffer = self.buffers[table_name]
+            if len(buffer) > 0:
+                self.con.executemany(self.queries[table_name], buffer)
+                self.counts[table_name] += len(buffer)
+                buffer.clear()
+
+
+def connect(db_fp, profile=None):
+    """
+    connect in autocommit mode, so that transactions are controlled explicitly.
+    tables of schema.sql are created unless they exist, and indexes are deferred to create_indexes().
+    :param profile: pragmas of PRAGMA_PROFILES. By default, "write" (without journal) only for a new DB, which is
+                    simply rebuilt if interrupted, and "update" (rollback journal) for a DB which already holds data
+    """
+
+    con = sqlite3.connect(str(db_fp), timeout=IDManager.LOCK_TIMEOUT, isolation_level=None)
+    if profile is None:
+        profile = "update" if has_genomes(con) else "write"
+    for name, value in PRAGMA_PROFILES[profile].items():
+        con.execute("PRAGMA {}={};".format(name, value))
+    for statement in INIT_DIREC.joinpath("schema.sql").read_text().split(';'):
+        if len(statement.strip()) > 0:
+            con.execute(statement.replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS", 1) + ';')
+    return con
+
+
+def has_genomes(con):
+    query = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'genomes';"
+    if con.execute(query).fetchone()[0] == 0:
+        return False
+    return con.execute("SELECT 1 FROM genomes LIMIT 1;").fetchone() is not None
+
+
+def create_indexes(con):
+    """
+    indexes of index.sql, unless they already exist
+    """
+
+    for statement in INIT_DIREC.joinpath("index.sql").read_text().split(';'):
+        if len(statement.strip()) > 0:
+            con.execute(statement.replace("CREATE INDEX", "CREATE INDEX IF NOT EXISTS", 1) + ';')
+
+
+def get_project_id(loader, project_name):
+    """
+    project_id of project_name, which is newly reserved and inserted unless it exists
+    """
+
+    row = loader.con.execute("SELECT project_id FROM projects WHERE project_name = ?;", (project_name,)).fetchone()
+    if row is not None:
+        return row[0]
+    project_id = PID.reserve(1, loader.con)[0]
+    loader.append("projects", [(project_id, project_name)])
+    return project_id
+
+
+def append_genome(loader, genome_id, scaffold_records, cds_records):
+    """
+    reserve IDs and append scaffolds and cdss of a genome parsed by create_tables.parse_genome()
+    :return: range of cds_ids aligned to cds_records
+    """
+
+    con = loader.con
+    scaffold2id = dict()
+    scaffold_rows = []
+    for scaffold_id, (scaffold_name, length) in zip(SID.reserve(len(scaffold_records), con), scaffold_records):
+        scaffold2id[scaffold_name] = scaffold_id
+        scaffold_rows.append((scaffold_id, genome_id, scaffold_name, length))
+    loader.append("scaffolds", scaffold_rows)
+    cds_ids = CID.reserve(len(cds_records), con)
+    loader.append("cdss", [(cds_id, genome_id, scaffold2id[seqid], cds_name, start, end, end - start + 1, strand)
+                           for cds_id, (seqid, cds_name, start, end, strand) in zip(cds_ids, cds_records)])
+    return cds_ids
+
+
+def load_project(con, project_name, genome_names, workers=1, commit_genomes=COMMIT_GENOMES, batch_size=BATCH_SIZE):
+    """
+    load genomes of a project in transactions of commit_genomes genomes, skipping genomes already in DB.
+    Each batch of genomes is parsed before its transaction, so that the write lock is only held to reserve IDs and
+    insert rows, and IDs are reserved in the order of genome_names.
+    :return: dict of table_name -> number of inserted rows
+    """
+
+    loader = BulkLoader(con, batch_size)
+    con.execute("BEGIN IMMEDIATE;")
+    try:
+        project_id = get_project_id(loader, project_name)
+        loader.flush()
+        con.execute("COMMIT;")
+    finally:
+        if con.in_transaction:
+            con.execute("ROLLBACK;")
+
+    loaded_genome_names = set(name for (name,) in con.execute("SELECT genome_name FROM genomes;"))
+    todo_genome_names = []
+    for genome_name in genome_names:
+        if genome_name not in loaded_genome_names:
+            todo_genome_names.append(genome_name)
+            loaded_genome_names.add(genome_name)
+    LOGGER.info("found {} genomes to load ({} skipped)".format(
+        len(todo_genome_names), len(genome_names) - len(todo_genome_names)))
+
+    parsed_iter = iter_parsed_genomes(todo_genome_names, workers)
+    with tqdm(total=len(todo_genome_names)) as pbar:
+        while True:
+            parsed_lst = list(itertools.islice(parsed_iter, commit_genomes))
+            if len(parsed_lst) == 0:
+                break
+            con.execute("BEGIN IMMEDIATE;")
+            try:
+                # skip genomes loaded by another loader since the listing above
+                loaded_genome_names = set(name for (name,) in con.execute("SELECT genome_name FROM genomes;"))
+                for genome_name, scaffold_records, cds_records in parsed_lst:
+                    if genome_name in loaded_genome_names:
+                        continue
+                    genome_id = GID.reserve(1, con)[0]
+                    loader.append("genomes", [(genome_id, project_id, genome_name)])
+                    append_genome(loader, genome_id, scaffold_records, cds_records)
+                loader.flush()
+                con.execute("COMMIT;")
+            finally:
+                if con.in_transaction:
+                    con.execute("ROLLBACK;")
+            pbar.update(len(parsed_lst))
+    return loader.counts
+
+
+def main(arg_fp, db_fp, workers=1, commit_genomes=COMMIT_GENOMES):
+    arg_df = pd.read_csv(arg_fp, sep='\t', comment='#')
+    LOGGER.info("found {} projects to load".format(len(arg_df)))
+    con = connect(db_fp)
+    for project_name, meta_fp in zip(arg_df["project_name"], arg_df["meta_fp"]):
+        meta_df = pd.read_csv(meta_fp, sep='\t')
+        LOGGER.info("start {} with {} genomes".format(project_name, len(meta_df)))
+        counts = load_project(con, project_name, list(meta_df["genome_name"]), workers, commit_genomes)
+        LOGGER.info("inserted {}".format(", ".join("{} {}".format(count, table_name)
+                                                   for table_name, count in counts.items())))
+    create_indexes(con)
+    LOGGER.info("created indexes of {}".format(db_fp))
+    con.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, datefmt="%m/%d/%Y %I:%M:%S",
+                        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--arg_fp", default="./arg/create_tables.arg")
+    parser.add_argument("--db_fp", default=DB_PATH)
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes to parse genomes")
+    parser.add_argument("--commit_genomes", type=int, default=COMMIT_GENOMES,
+                        help="number of genomes loaded in a transaction. Interrupted loads into a DB which already "
+                             "held genomes resume from the last commit")
+    args = parser.parse_args()
+    main(args.arg_fp, args.db_fp, args.workers, args.commit_genomes)
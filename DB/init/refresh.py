@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+"""
+Refresh genome.db for genomes whose files under GENOME_DIREC were changed, added or removed since the last refresh,
+based on the size, mtime and sha1 of each file recorded in manifests table.
+Scaffolds and cdss of those genomes are reloaded in a single transaction, together with their sequences. Their hits
+are deleted, because they have to be searched again.
+Genomes in DB but not listed in meta_fp are refreshed as well, and removed only when their files are gone, or with
+--remove_unlisted.
+"""
+
+import sys
+import pathlib
+import logging
+import argparse
+import multiprocessing
+
+import pandas as pd
+from Bio import SeqIO
+
+ROOT_PATH = pathlib.Path().joinpath('../../').resolve()
+sys.path.append(str(ROOT_PATH))
+from mylib.path import DB_PATH, build_local_filepath, hash_file
+from create_tables import parse_genome, CHUNKSIZE
+from load_tables import BulkLoader, INSERT_QUERIES, GID, connect, create_indexes, get_project_id, append_genome
+
+LOGGER = logging.getLogger(__name__)
+REQUIRED_EXTENSIONS = ("dnaseq", "gff")  # files a genome is loaded from, see create_tables.parse_genome()
+REFRESH_QUERIES = dict(INSERT_QUERIES, sequences="INSERT INTO sequences VALUES (?, ?);",
+                       manifests="INSERT INTO manifests VALUES (?, ?, ?, ?, ?);")
+DEPENDENT_TABLES = ("hits", "sequences")  # tables of cds_id, whose rows are deleted with cdss
+
+
+def build_manifest_filepaths(genome_name):
+    return {
+        "dnaseq": build_local_filepath(genome_name, "fna").replace(".fna", ".dnaseq"),
+        "gff": build_local_filepath(genome_name, "gff"),
+        "faa": build_local_filepath(genome_name, "faa")  # optional, only for sequences table
+    }
+
+
+def scan_genome(task):
+    """
+    stat files of a genome, and hash them unless size and mtime are the same as the manifest
+    :param task: (genome_name, manifest, rehash) where manifest is dict of extension -> (size, mtime_ns, sha1)
+    :return: (genome_name, dict of extension -> (size, mtime_ns, sha1) of existing files)
+    """
+
+    genome_name, manifest, rehash = task
+    entries = dict()
+    for extension, fp in build_manifest_filepaths(genome_name).items():
+        try:
+            stat = pathlib.Path(fp).stat()
+        except FileNotFoundError:
+            continue
+        known = manifest.get(extension)
+        if not rehash and known is not None and known[:2] == (stat.st_size, stat.st_mtime_ns):
+            entries[extension] = known
+        else:
+            entries[extension] = (stat.st_size, stat.st_mtime_ns, hash_file(fp))
+    return genome_name, entries
+
+
+def parse_genome_with_sequences(genome_name):
+    """
+    :return: (genome_name, scaffold_records, cds_records, sequence_records) where sequence_records are list of
+             (cds_name, sequence) in .faa, or None without .faa
+    """
+
+    genome_name, scaffold_records, cds_records = parse_genome(genome_name)
+    faa_fp = build_manifest_filepaths(genome_name)["faa"]
+    sequence_records = None
+    if pathlib.Path(faa_fp).exists():
+        sequence_records = [(seqrec.id, str(seqrec.seq)) for seqrec in SeqIO.parse(faa_fp, "fasta")]
+    return genome_name, scaffold_records, cds_records, sequence_records
+
+
+def imap(func, tasks, workers=1):
+    if workers <= 1:
+        return list(map(func, tasks))
+    with multiprocessing.Pool(workers) as pool:
+        return list(pool.imap(func, tasks, chunksize=CHUNKSIZE))
+
+
+def load_listed_genomes(arg_fp):
+    """
+    :return: dict of genome_name -> project_name in the order of meta_fp of arg_fp
+    """
+
+    genome2project = dict()
+    arg_df = pd.read_csv(arg_fp, sep='\t', comment='#')
+    for project_name, meta_fp in zip(arg_df["project_name"], arg_df["meta_fp"]):
+        meta_df = pd.read_csv(meta_fp, sep='\t')
+        for genome_name in meta_df["genome_name"]:
+            genome2project.setdefault(genome_name, project_name)
+    return genome2project
+
+
+def plan_refresh(con, genome2project, workers=1, rehash=False, remove_unlisted=False):
+    """
+    compare files of genomes listed in arg_fp, and genomes in DB of the same projects, with their manifests.
+    genomes in DB are removed only when their files are gone, or when they are not listed and remove_unlisted is set.
+    :return: dict of action -> list of genome_names, and dict of genome_name -> scanned manifest, where actions are
+             "added", "changed", "removed" and "touched" (manifest to update without reloading rows)
+    """
+
+    query = "SELECT genome_id, genome_name, project_name FROM genomes JOIN projects USING (project_id);"
+    db_df = pd.read_sql_query(query, con)
+    db_df = db_df[db_df["project_name"].isin(set(genome2project.values()))]
+    genome2id = dict(zip(db_df["genome_name"], db_df["genome_id"]))
+    manifests = dict()  # key: genome_id, val: dict of extension -> (size, mtime_ns, sha1)
+    for genome_id, extension, size, mtime_ns, sha1 in con.execute("SELECT * FROM manifests;"):
+        manifests.setdefault(genome_id, dict())[extension] = (size, mtime_ns, sha1)
+
+    unlisted_genome_names = [genome_name for genome_name in genome2id if genome_name not in genome2project]
+    tasks = [(genome_name, manifests.get(genome2id.get(genome_name), dict()), rehash)
+             for genome_name in list(genome2project) + unlisted_genome_names]
+    scanned = dict(imap(scan_genome, tasks, workers))
+    LOGGER.info("scanned files of {} genomes".format(len(scanned)))
+    if len(unlisted_genome_names) > 0 and not remove_unlisted:
+        LOGGER.warning("kept {} genomes in DB not listed in meta_fp unless their files are gone, e.g. {}. "
+                       "Set --remove_unlisted to remove them".format(len(unlisted_genome_names),
+                                                                       unlisted_genome_names[0]))
+
+    plan = dict((action, []) for action in ("added", "changed", "removed", "touched"))
+    for genome_name, entries in scanned.items():
+        is_complete = all(extension in entries for extension in REQUIRED_EXTENSIONS)
+        if genome_name not in genome2id:
+            if is_complete:
+                plan["added"].append(genome_name)
+            else:
+                LOGGER.warning("skipped {} without {} files".format(genome_name, "/".join(REQUIRED_EXTENSIONS)))
+            continue
+
+        manifest = manifests.get(genome2id[genome_name])
+        if not is_complete or (remove_unlisted and genome_name not in genome2project):
+            plan["removed"].append(genome_name)
+        elif manifest is None:  # loaded before manifests, taken as it is
+            plan["touched"].append(genome_name)
+        elif any(manifest.get(extension, (None,) * 3)[2] != entry[2] for extension, entry in entries.items()) or \
+                set(manifest) != set(entries):
+            plan["changed"].append(genome_name)
+        elif manifest != entries:
+            plan["touched"].append(genome_name)
+    return plan, scanned
+
+
+def set_target_genomes(con, genome_ids):
+    con.execute("CREATE TEMP TABLE IF NOT EXISTS target_genomes (genome_id INTEGER PRIMARY KEY);")
+    con.execute("DELETE FROM target_genomes;")
+    con.executemany("INSERT INTO target_genomes VALUES (?);", [(genome_id,) for genome_id in genome_ids])
+
+
+def count_genome_hits(con, genome_ids):
+    """
+    :return: number of hits of cdss of the genomes, which are deleted with them
+    """
+
+    set_target_genomes(con, genome_ids)
+    return con.execute("SELECT COUNT(*) FROM hits WHERE cds_id IN (SELECT cds_id FROM cdss WHERE genome_id IN "
+                       "(SELECT genome_id FROM target_genomes));").fetchone()[0]
+
+
+def delete_genome_rows(con, genome_ids, table_names):
+    """
+    delete scaffolds, cdss and rows of dependent tables of the genomes
+    :return: dict of table_name -> number of deleted rows
+    """
+
+    counts = dict()
+    set_target_genomes(con, genome_ids)
+    for table_name in DEPENDENT_TABLES:
+        if table_name in table_names:
+            counts[table_name] = con.execute(
+                "DELETE FROM {} WHERE cds_id IN (SELECT cds_id FROM cdss WHERE genome_id IN "
+                "(SELECT genome_id FROM target_genomes));".format(table_name)).rowcount
+    for table_name in ("cdss", "scaffolds", "manifests"):
+        counts[table_name] = con.execute("DELETE FROM {} WHERE genome_id IN (SELECT genome_id FROM target_genomes);"
+                                         .format(table_name)).rowcount
+    return counts
+
+
+def refresh(con, genome2project, workers=1, rehash=False, dry_run=False, remove_unlisted=False):
+    """
+    :return: plan of plan_refresh()
+    """
+
+    plan, scanned = plan_refresh(con, genome2project, workers, rehash, remove_unlisted)
+    LOGGER.info("found {}".format(", ".join("{} {} genomes".format(len(genome_names), action)
+                                            for action, genome_names in plan.items())))
+    table_names = set(name for (name,) in con.execute("SELECT name FROM sqlite_master WHERE type = 'table';"))
+    if "hits" in table_names and len(plan["removed"] + plan["changed"]) > 0:
+        genome2id = dict(con.execute("SELECT genome_name, genome_id FROM genomes;").fetchall())
+        hit_count = count_genome_hits(con, [genome2id[genome_name]
+                                            for genome_name in plan["removed"] + plan["changed"]])
+        if hit_count > 0:
+            LOGGER.warning("{} {} hits of changed or removed genomes, which have to be searched again".format(
+                "would delete" if dry_run else "deleting", hit_count))
+    if dry_run or not any(plan.values()):
+        return plan
+
+    reload_genome_names = plan["changed"] + plan["added"]
+    parsed_lst = imap(parse_genome_with_sequences, reload_genome_names, workers)
+
+    loader = BulkLoader(con, queries=REFRESH_QUERIES)
+    con.execute("BEGIN IMMEDIATE;")
+    try:
+        genome2id = dict(con.execute("SELECT genome_name, genome_id FROM genomes;").fetchall())
+        delete_ids = [genome2id[genome_name] for genome_name in plan["removed"] + plan["changed"]]
+        counts = delete_genome_rows(con, delete_ids, table_names)
+        con.executemany("DELETE FROM manifests WHERE genome_id = ?;",
+                        [(genome2id[genome_name],) for genome_name in plan["touched"]])
+        LOGGER.info("deleted {}".format(", ".join("{} {}".format(count, table_name)
+                                                  for table_name, count in counts.items())))
+        con.executemany("DELETE FROM genomes WHERE genome_id = ?;",
+                        [(genome2id[genome_name],) for genome_name in plan["removed"]])
+
+        for genome_name, scaffold_records, cds_records, sequence_records in parsed_lst:
+            if genome_name in genome2id:
+                genome_id = genome2id[genome_name]
+            else:
+                genome_id = GID.reserve(1, con)[0]
+                genome2id[genome_name] = genome_id
+                project_id = get_project_id(loader, genome2project[genome_name])
+                loader.append("genomes", [(genome_id, project_id, genome_name)])
+            cds_ids = append_genome(loader, genome_id, scaffold_records, cds_records)
+            if sequence_records is not None and "sequences" in table_names:
+                cds2id = dict((cds_name, cds_id) for cds_id, (_, cds_name, _, _, _) in zip(cds_ids, cds_records))
+                loader.append("sequences", [(cds2id[cds_name], sequence) for cds_name, sequence in sequence_records])
+
+        for genome_name in reload_genome_names + plan["touched"]:
+            loader.append("manifests", [(genome2id[genome_name], extension, size, mtime_ns, sha1)
+                                        for extension, (size, mtime_ns, sha1) in scanned[genome_name].items()])
+        loader.flush()
+        con.execute("COMMIT;")
+    finally:
+        if con.in_transaction:
+            con.execute("ROLLBACK;")
+    LOGGER.info("inserted {}".format(", ".join("{} {}".format(count, table_name)
+                                               for table_name, count in loader.counts.items())))
+    return plan
+
+
+def main(arg_fp, db_fp, workers=1, rehash=False, dry_run=False, remove_unlisted=False):
+    genome2project = load_listed_genomes(arg_fp)
+    LOGGER.info("found {} genomes listed in {}".format(len(genome2project), arg_fp))
+    con = connect(db_fp, profile="update")  # rollback journal, as the DB to refresh already holds data
+    refresh(con, genome2project, workers, rehash, dry_run, remove_unlisted)
+    create_indexes(con)
+    con.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, datefmt="%m/%d/%Y %I:%M:%S",
+                        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--arg_fp", default="./arg/create_tables.arg",
+                        help="projects to refresh. Genomes of other projects in DB are left as they are")
+    parser.add_argument("--db_fp", default=DB_PATH)
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes to scan and parse genomes")
+    parser.add_argument("--rehash", action="store_true", help="hash all files even if size and mtime are unchanged")
+    parser.add_argument("--dry_run", action="store_true", help="only report genomes to refresh")
+    parser.add_argument("--remove_unlisted", action="store_true",
+                        help="remove genomes in DB not listed in meta_fp, which are kept by default unless their files "
+                             "are gone")
+    args = parser.parse_args()
+    main(args.arg_fp, args.db_fp, args.workers, args.rehash, args.dry_run, args.remove_unlisted)
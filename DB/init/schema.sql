@@ -30,3 +30,18 @@ CREATE TABLE cdss(
     strand TEXT,
     PRIMARY KEY (cds_id)
 );
+
+CREATE TABLE id_sequences(
+    table_name TEXT NOT NULL,
+    next_id INTEGER NOT NULL,
+    PRIMARY KEY (table_name)
+);
+
+CREATE TABLE manifests(
+    genome_id INTEGER NOT NULL,
+    extension TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha1 TEXT NOT NULL,
+    PRIMARY KEY (genome_id, extension)
+);
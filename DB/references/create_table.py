@@ -4,12 +4,14 @@ import re
 import sys
 import pathlib
 import logging
+import argparse
 
 import pandas as pd
 
 ROOT_PATH = pathlib.Path().joinpath('../../').resolve()
 sys.path.append(str(ROOT_PATH))
 from mylib.db import IDManager
+from mylib.profiler import Profiler, NULL_PROFILER
 
 LOGGER = logging.getLogger(__name__)
 RID = IDManager("refseqs")
@@ -34,16 +36,18 @@ def parse_header(header):
     return record
 
 
-def main(stat_fp, out_fp):
-    stat_df = pd.read_csv(stat_fp, sep="\t\t\t", header=None, names=["header", "length"], engine="python")
-    LOGGER.info("loaded {} records from {}".format(len(stat_df), stat_fp))
+def main(stat_fp, out_fp, profiler=NULL_PROFILER):
+    with profiler.stage("load"):
+        stat_df = pd.read_csv(stat_fp, sep="\t\t\t", header=None, names=["header", "length"], engine="python")
+        LOGGER.info("loaded {} records from {}".format(len(stat_df), stat_fp))
 
-    records = list(map(parse_header, stat_df["header"]))
-    header_df = pd.DataFrame(records, columns=["accession", "description", "lca"])
-    LOGGER.info("parsed {} header".format(len(header_df)))
+    with profiler.stage("parse"):
+        records = list(map(parse_header, stat_df["header"]))
+        header_df = pd.DataFrame(records, columns=["accession", "description", "lca"])
+        LOGGER.info("parsed {} header".format(len(header_df)))
 
     out_df = pd.DataFrame()
-    out_df["refseq_id"] = stat_df.index.map(lambda x: RID.new())
+    out_df["refseq_id"] = list(RID.reserve(len(stat_df)))
     out_df["refseq_name"] = header_df["accession"]
     out_df["description"] = header_df["description"]
     out_df["lca"] = header_df["lca"]
@@ -51,13 +55,21 @@ def main(stat_fp, out_fp):
     out_df["fk"] = header_df["description"].map(lambda desc: is_function_known(desc)).astype(int)
     out_df.drop_duplicates("refseq_name", inplace=True)
 
-    out_df.to_csv(out_fp, index=False, header=None, sep='\t')
+    with profiler.stage("output"):
+        out_df.to_csv(out_fp, index=False, header=None, sep='\t')
     LOGGER.info("outputed {} records to {}".format(len(out_df), out_fp))
+    profiler.count("refseqs", len(out_df))
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, datefmt="%m/%d/%Y %I:%M:%S",
                         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    stat_fp = "/home/mitsuki/GeneNeighborhoodAnalysis/GURatio/data/refseqs.stat"
-    out_fp = "./data/refseqs.tsv"
-    main(stat_fp, out_fp)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stat_fp", default="/home/mitsuki/GeneNeighborhoodAnalysis/GURatio/data/refseqs.stat")
+    parser.add_argument("--out_fp", default="./data/refseqs.tsv")
+    parser.add_argument("--profile_out", help="JSON report of wall time, cpu time and peak rss per stage")
+    args = parser.parse_args()
+    profiler = Profiler(enabled=args.profile_out is not None)
+    main(args.stat_fp, args.out_fp, profiler)
+    if args.profile_out:
+        profiler.save(args.profile_out, script="references/create_table", args=vars(args))
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import pathlib
+from logging import getLogger
+
+LOGGER = getLogger(__name__)
+
+
+class Checkpoint:
+    """
+    Append-only shard files with a manifest, to stream results of finished keys (e.g. origin gene names) to disk.
+    manifest.tsv records (key, shard_name, start, end) where [start, end) is the byte range of the key in the shard.
+    Each session appends to its own new shard, so that bytes written after the last manifest entry of a crashed
+    session are never referenced.
+    params.json records the parameters of the run, so that results computed under different parameters are never
+    merged on resume. Only these files are removed, other files in direc are left as they are.
+    """
+
+    MANIFEST_NAME = "manifest.tsv"
+    PARAMS_NAME = "params.json"
+
+    def __init__(self, direc, resume=False, params=None):
+        """
+        :param params: JSON serializable dict of the run parameters, which must be the same as the previous session
+                       on resume
+        :raise ValueError: if params differ from the ones recorded in direc on resume
+        """
+
+        self.direc = pathlib.Path(direc)
+        self.manifest_fp = self.direc.joinpath(self.MANIFEST_NAME)
+        self.params_fp = self.direc.joinpath(self.PARAMS_NAME)
+        if self.direc.exists() and not resume:
+            self.clear()
+        self.direc.mkdir(parents=True, exist_ok=True)
+
+        self.key2entry = dict()  # key: key, val: (shard_name, start, end)
+        if self.manifest_fp.exists():
+            with open(str(self.manifest_fp), 'r') as f:
+                text = f.read()
+            if not text.endswith('\n') and len(text) > 0:  # drop the line being written at the crash
+                LOGGER.warning("dropped incomplete manifest line: {}".format(text.split('\n')[-1]))
+                text = text[:text.rfind('\n') + 1]
+                with open(str(self.manifest_fp), 'w') as f:
+                    f.write(text)
+            for line in text.splitlines():
+                key, shard_name, start, end = line.split('\t')
+                self.key2entry[key] = (shard_name, int(start), int(end))
+
+        self.check_params(params)
+        shard_id = len(list(self.direc.glob("shard_*.tsv")))
+        self.shard_name = "shard_{:04d}.tsv".format(shard_id)
+        self.shard_fp = self.direc.joinpath(self.shard_name)
+        self.shard_offset = 0
+
+    def check_params(self, params):
+        """
+        record params on the first session, or compare them with the recorded ones
+        """
+
+        params = json.loads(json.dumps(params))  # e.g. tuples to lists, as they are read from the file
+        if self.params_fp.exists():
+            recorded = json.loads(self.params_fp.read_text())
+        elif len(self.key2entry) > 0:  # params unknown, e.g. killed before params were recorded
+            recorded = None
+        else:
+            tmp_fp = self.direc.joinpath("{}.tmp".format(self.PARAMS_NAME))
+            tmp_fp.write_text(json.dumps(params, sort_keys=True))
+            os.replace(str(tmp_fp), str(self.params_fp))
+            return
+        if recorded != params:
+            raise ValueError("parameters differ from the ones of {} keys in {}: {} != {}. "
+                             "Start without resume to discard them".format(len(self.key2entry), self.direc,
+                                                                           params, recorded))
+
+    def __contains__(self, key):
+        return key in self.key2entry
+
+    def __len__(self):
+        return len(self.key2entry)
+
+    def append(self, key, text):
+        """
+        append text of the finished key to the shard, then register it to the manifest.
+        """
+
+        data = text.encode()
+        with open(str(self.shard_fp), 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        entry = (self.shard_name, self.shard_offset, self.shard_offset + len(data))
+        self.shard_offset += len(data)
+
+        with open(str(self.manifest_fp), 'a') as f:
+            f.write("{}\t{}\t{}\t{}\n".format(key, *entry))
+            f.flush()
+            os.fsync(f.fileno())
+        self.key2entry[key] = entry
+
+    def merge(self, keys, out_fp, header=""):
+        """
+        concatenate texts of keys in the given order into out_fp.
+        """
+
+        missing_keys = [key for key in keys if key not in self.key2entry]
+        if len(missing_keys) > 0:
+            raise KeyError("{} keys are not found in {}, e.g. {}".format(
+                len(missing_keys), self.manifest_fp, missing_keys[0]))
+
+        shard2file = dict()
+        with open(out_fp, 'wb') as out:
+            out.write(header.encode())
+            for key in keys:
+                shard_name, start, end = self.key2entry[key]
+                if shard_name not in shard2file:
+                    shard2file[shard_name] = open(str(self.direc.joinpath(shard_name)), 'rb')
+                f = shard2file[shard_name]
+                f.seek(start)
+                out.write(f.read(end - start))
+        for f in shard2file.values():
+            f.close()
+
+    def iter_owned_filepaths(self):
+        yield self.manifest_fp
+        yield self.params_fp
+        yield from self.direc.glob("shard_*.tsv")
+
+    def clear(self):
+        for fp in list(self.iter_owned_filepaths()):
+            fp.unlink(missing_ok=True)
+
+    def remove(self):
+        """
+        remove files of the checkpoint, and direc if nothing else is left
+        """
+
+        self.clear()
+        try:
+            self.direc.rmdir()
+        except OSError:
+            LOGGER.info("kept {}, which has other files".format(self.direc))
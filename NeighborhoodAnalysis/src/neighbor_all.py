@@ -6,25 +6,34 @@ Detect all gene neighborhood relationships under given thresholds
 
 import argparse
 import logging
+import multiprocessing
 import pathlib
 import sys
 from collections import Counter
 
+import numpy as np
 import pandas as pd
 from ete3 import PhyloTree
 
 ROOT_PATH = pathlib.Path().joinpath('../../').resolve()
 sys.path.append(str(ROOT_PATH))
-from mylib.db import CdsDAO, load_genome_names_by_clade_name, load_cdss_by_genome_names
+from mylib.db import ColumnarCdsDAO
 from mylib.path import build_clade_filepath
-from neighborlib import NeighborhoodMatrix, set_gene_name_to_cdss, set_split_to_cdss, calc_bls
-from scorelib import score_naive, score_independent, score_conditional
+from mylib.profiler import Profiler, NULL_PROFILER
+from checkpointlib import Checkpoint
+from neighborlib import ArrayNeighborhoodMatrix, NeighborTable, load_segment_ids, BlsEngine, BlsCache
+from snapshotlib import SnapshotCache, load_clade_cds_df
+from scorelib import score_batch, score_naive_batch, bound_naive, bound_independent
 
 LOGGER = logging.getLogger(__name__)
 THRESH = {
     "SIZE": 10,  # lower limit for gene size
     "SCORE": 0.8  # lower limit for neighborhood score to be reported
 }
+BATCH_SIZE = 256  # number of candidate neighbor genes scored at once
+BOUND_EPS = 1e-9  # margin for rounding errors of upper bounds
+COLUMNS = ["x", "y", "score", "score_naive", "total", "found", "bls", "top_offset", "top_relationship", "top_ratio"]
+WORKER_STATE = dict()  # state inherited by forked worker processes (score_method, cdsDAO, neighbor_table, ...)
 
 
 def find_most_common_position(positions):
@@ -48,78 +57,258 @@ def find_most_common_position(positions):
     }
 
 
-def detect_edges_all(origin_gene_name, score_method, cdsDAO, tree=None):
-    neighbor_matrix = NeighborhoodMatrix(origin_gene_name, cdsDAO)
+def prune_candidates(neighbor_matrix, neighbor_gene_names, score_method):
+    """
+    skip candidates whose upper bound of the score is below the threshold, without building indicator matrices.
+    upper bounds are only available for naive and independent scores.
+    :return: list of remaining neighbor_gene_names
+    """
+
+    if score_method not in ("naive", "independent") or len(neighbor_gene_names) == 0:
+        return neighbor_gene_names
+
+    row_counts, col_counts = neighbor_matrix.count_genes(neighbor_gene_names)
+    if score_method == "naive":
+        bounds = bound_naive(row_counts, neighbor_matrix.shape[0])
+    elif score_method == "independent":
+        bounds = bound_independent(col_counts, (~neighbor_matrix.missing_msk).sum(axis=0))
+    msk = bounds >= THRESH["SCORE"] - BOUND_EPS
+    return [gene_name for gene_name, m in zip(neighbor_gene_names, msk) if m]
+
+
+def detect_edges_all(origin_gene_name, score_method, cdsDAO, neighbor_table=None, profiler=NULL_PROFILER):
+    """
+    bls of each record is left to -1, and found_genome_names are kept in the record for fill_bls()
+    """
+
+    with profiler.stage("matrix"):
+        neighbor_matrix = ArrayNeighborhoodMatrix(origin_gene_name, cdsDAO, neighbor_table)
 
     records = []
     if neighbor_matrix.shape[0] < THRESH["SIZE"]:
         LOGGER.debug("too small ortholog size = {}".format(neighbor_matrix.shape[0]))
         return records
 
-    neighbor_gene_names = sorted(neighbor_matrix.get_neighbor_gene_names())
-    LOGGER.debug("found {} candidate neighbor genes".format(len(neighbor_gene_names)))
-    for neighbor_gene_name in neighbor_gene_names:
-        indicator_matrix = neighbor_matrix.to_indicator_matrix(neighbor_gene_name)
-        if score_method == "naive":
-            score = score_naive(indicator_matrix)
-        elif score_method == "independent":
-            score = score_independent(indicator_matrix)
-        elif score_method == "conditional":
-            score = score_conditional(indicator_matrix)
-
-        if score >= THRESH["SCORE"]:
+    with profiler.stage("pruning"):
+        candidate_gene_names = sorted(neighbor_matrix.get_neighbor_gene_names())
+        neighbor_gene_names = prune_candidates(neighbor_matrix, candidate_gene_names, score_method)
+    profiler.count("candidates", len(candidate_gene_names))
+    profiler.count("pruned", len(candidate_gene_names) - len(neighbor_gene_names))
+    LOGGER.debug("found {} candidate neighbor genes, {} pruned by upper bound".format(
+        len(candidate_gene_names), len(candidate_gene_names) - len(neighbor_gene_names)))
+    for batch_start in range(0, len(neighbor_gene_names), BATCH_SIZE):
+        batch_gene_names = neighbor_gene_names[batch_start:batch_start + BATCH_SIZE]
+        with profiler.stage("scoring"):
+            indicator_tensor = neighbor_matrix.to_indicator_tensor(batch_gene_names)
+            scores = score_batch(indicator_tensor, score_method)
+            passed = np.nonzero(scores >= THRESH["SCORE"])[0]
+            naive_scores = score_naive_batch(indicator_tensor[passed])
+
+        for g, naive_score in zip(passed, naive_scores):
+            neighbor_gene_name = batch_gene_names[g]
             positions = neighbor_matrix.get_positions_by_gene_name(neighbor_gene_name)
             found_origin_names = set(map(lambda pos: pos.origin_name, positions))
             found_genome_names = set(map(lambda pos: pos.origin_name.split('-')[0], positions))
             record = {
                 "x": origin_gene_name,
                 "y": neighbor_gene_name,
-                "score": score,
-                "score_naive": score_naive(indicator_matrix),
+                "score": scores[g],
+                "score_naive": naive_score,
                 "total": neighbor_matrix.shape[0],
                 "found": len(found_origin_names),
-                "bls": calc_bls(found_genome_names, tree) if tree else -1
+                "bls": -1,
+                "found_genome_names": found_genome_names
             }
             record.update(find_most_common_position(positions))
             records.append(record)
-    LOGGER.info("found {} records".format(len(records)))
+    LOGGER.info("found {} records ({} of {} candidates pruned)".format(
+        len(records), len(candidate_gene_names) - len(neighbor_gene_names), len(candidate_gene_names)))
     return records
 
 
-def main(args):
-    genome_names = load_genome_names_by_clade_name(args.clade_name)
-    LOGGER.info("loaded {} {} genomes".format(len(genome_names), args.clade_name))
-    cdss = load_cdss_by_genome_names(genome_names)
-    LOGGER.info("loaded {} cdss".format(len(cdss)))
+def get_sweep_columns(sweep_dist):
+    return ["x", "y", "total"] + ["score_{}".format(dist) for dist in range(1, sweep_dist + 1)]
 
-    ortho_fp = pathlib.Path(build_clade_filepath(args.clade_name)).joinpath("./ortho/{}.ortho".format(args.clade_name))
-    ortho_df = pd.read_csv(ortho_fp, sep='\t')
-    cdss = set_gene_name_to_cdss(cdss, ortho_fp)
-    LOGGER.info("loaded orthology from {}".format(ortho_fp))
 
-    if args.split_fp:
-        cdss = set_split_to_cdss(cdss, args.split_fp)
-        LOGGER.info("loaded simulated segmentation from {}".format(args.split_fp))
+def detect_edges_sweep(origin_gene_name, score_method, cdsDAO, sweep_dist, neighbor_table=None,
+                       profiler=NULL_PROFILER):
+    """
+    score for every window of DIST = 1..sweep_dist, by slicing columns of the widest window.
+    records with any score above the threshold are reported.
+    """
 
-    tree = None
-    if args.tree_fp:
-        tree = PhyloTree(args.tree_fp, format=1)
-        LOGGER.info("loaded phylogenetic tree from {}".format(args.tree_fp))
+    with profiler.stage("matrix"):
+        neighbor_matrix = ArrayNeighborhoodMatrix(origin_gene_name, cdsDAO, neighbor_table, dist=sweep_dist)
 
     records = []
-    cdsDAO = CdsDAO(cdss)
-    gene_names = sorted(set(ortho_df["gene_name"]))
+    if neighbor_matrix.shape[0] < THRESH["SIZE"]:
+        LOGGER.debug("too small ortholog size = {}".format(neighbor_matrix.shape[0]))
+        return records
+
+    with profiler.stage("pruning"):
+        candidate_gene_names = sorted(neighbor_matrix.get_neighbor_gene_names())
+        neighbor_gene_names = prune_candidates(neighbor_matrix, candidate_gene_names, score_method)
+    profiler.count("candidates", len(candidate_gene_names))
+    profiler.count("pruned", len(candidate_gene_names) - len(neighbor_gene_names))
+    LOGGER.debug("found {} candidate neighbor genes, {} pruned by upper bound".format(
+        len(candidate_gene_names), len(candidate_gene_names) - len(neighbor_gene_names)))
+    dists = range(1, sweep_dist + 1)
+    for batch_start in range(0, len(neighbor_gene_names), BATCH_SIZE):
+        batch_gene_names = neighbor_gene_names[batch_start:batch_start + BATCH_SIZE]
+        with profiler.stage("scoring"):
+            indicator_tensor = neighbor_matrix.to_indicator_tensor(batch_gene_names)
+            score_arr = np.stack([score_batch(indicator_tensor[:, :, neighbor_matrix.get_window_slice(dist)],
+                                              score_method) for dist in dists], axis=1)  # (G x sweep_dist)
+            passed = np.nonzero(score_arr.max(axis=1) >= THRESH["SCORE"])[0]
+
+        for g in passed:
+            record = {
+                "x": origin_gene_name,
+                "y": batch_gene_names[g],
+                "total": neighbor_matrix.shape[0]
+            }
+            record.update(("score_{}".format(dist), score) for dist, score in zip(dists, score_arr[g]))
+            records.append(record)
+    LOGGER.info("found {} records ({} of {} candidates pruned)".format(
+        len(records), len(candidate_gene_names) - len(neighbor_gene_names), len(candidate_gene_names)))
+    return records
+
+
+def detect_edges(origin_gene_name, score_method, cdsDAO, neighbor_table=None, sweep_dist=None,
+                 profiler=NULL_PROFILER):
+    if sweep_dist:
+        records = detect_edges_sweep(origin_gene_name, score_method, cdsDAO, sweep_dist, neighbor_table, profiler)
+    else:
+        records = detect_edges_all(origin_gene_name, score_method, cdsDAO, neighbor_table, profiler)
+    profiler.count("genes")
+    profiler.count("records", len(records))
+    return records
+
+
+def detect_edges_worker(origin_gene_name):
+    """
+    :return: (records, profile of this origin gene to be merged in the parent process)
+    """
+
+    profiler = WORKER_STATE["profiler"]
+    profiler.reset()
+    records = detect_edges(origin_gene_name, WORKER_STATE["score_method"], WORKER_STATE["cdsDAO"],
+                           WORKER_STATE["neighbor_table"], WORKER_STATE["sweep_dist"], profiler)
+    return records, profiler.to_dict() if profiler.enabled else None
+
+
+def fill_bls(records, bls_engine=None, profiler=NULL_PROFILER):
+    with profiler.stage("bls"):
+        for record in records:
+            found_genome_names = record.pop("found_genome_names", None)
+            if bls_engine is not None and found_genome_names is not None:
+                record["bls"] = bls_engine.calc_bls(found_genome_names)
+    return records
+
+
+def iter_edges_all(gene_names, score_method, cdsDAO, neighbor_table=None, bls_engine=None, workers=1,
+                   sweep_dist=None, profiler=NULL_PROFILER):
+    """
+    yield records of each origin gene in the order of gene_names.
+    with workers > 1, origin genes are spread over forked processes, which share cdsDAO and neighbor_table without
+    pickling.
+    bls is always calculated in this process, so that a BlsCache is shared among all origin genes.
+    """
+
+    if workers <= 1:
+        for origin_gene_name in gene_names:
+            LOGGER.info("start {}".format(origin_gene_name))
+            records = detect_edges(origin_gene_name, score_method, cdsDAO, neighbor_table, sweep_dist, profiler)
+            yield fill_bls(records, bls_engine, profiler)
+    else:
+        WORKER_STATE.update(score_method=score_method, cdsDAO=cdsDAO, neighbor_table=neighbor_table,
+                            sweep_dist=sweep_dist, profiler=Profiler(enabled=profiler.enabled))
+        with multiprocessing.get_context("fork").Pool(workers) as pool:
+            for origin_gene_name, (records, profile) in zip(gene_names, pool.imap(detect_edges_worker, gene_names)):
+                LOGGER.info("done {}".format(origin_gene_name))
+                profiler.merge(profile)
+                yield fill_bls(records, bls_engine, profiler)
+        WORKER_STATE.clear()
+
+
+def records_to_tsv(records, columns=COLUMNS, header=False):
+    out_df = pd.DataFrame(records, columns=columns)
+    return out_df.to_csv(sep='\t', index=False, header=header)
+
+
+def build_run_params(args, columns):
+    """
+    parameters which change records, to be checked on resume of a checkpoint
+    """
+
+    return {
+        "clade_name": args.clade_name,
+        "score_method": args.score_method,
+        "sweep_dist": args.sweep_dist,
+        "dist": ArrayNeighborhoodMatrix.DIST,
+        "columns": columns,
+        "split_fp": str(pathlib.Path(args.split_fp).resolve()) if args.split_fp else None,
+        "replicate": args.replicate if args.split_fp else None,
+        "tree_fp": str(pathlib.Path(args.tree_fp).resolve()) if args.tree_fp else None,
+        "thresh": THRESH,
+        "bound_eps": BOUND_EPS
+    }
+
+
+def main(args):
+    profiler = Profiler(enabled=args.profile_out is not None)
+    ortho_fp = pathlib.Path(build_clade_filepath(args.clade_name)).joinpath("./ortho/{}.ortho".format(args.clade_name))
+    cds_df, gene_names = load_clade_cds_df(args.clade_name, ortho_fp, budget=int(args.snapshot_budget * 2 ** 30),
+                                           profiler=profiler)
+
+    bls_engine = None
+    if args.tree_fp:
+        bls_engine = BlsCache(BlsEngine(PhyloTree(args.tree_fp, format=1)), maxsize=args.bls_cache_size)
+        LOGGER.info("loaded phylogenetic tree with {} leafs from {}".format(
+            len(bls_engine.bls_engine), args.tree_fp))
+        if args.bls_cache_direc:
+            bls_cache_fp = BlsCache.build_filepath(args.bls_cache_direc, args.tree_fp)
+            bls_engine.load(bls_cache_fp)
+            LOGGER.info("loaded {} cached bls from {}".format(len(bls_engine), bls_cache_fp))
+
+    with profiler.stage("neighbor_table"):
+        cdsDAO = ColumnarCdsDAO(cds_df)
+        if args.split_fp:
+            cdsDAO.set_segment_ids(load_segment_ids(args.split_fp, cdsDAO, args.replicate))
+            LOGGER.info("loaded simulated segmentation from {}".format(args.split_fp))
+        neighbor_table = NeighborTable(cdsDAO,
+                                       dist=args.sweep_dist if args.sweep_dist else ArrayNeighborhoodMatrix.DIST)
+        LOGGER.info("extracted {} neighbor pairs".format(len(neighbor_table)))
     #    gene_names = list(gene_names)[:100]
-    LOGGER.info("found {} genes to search".format(len(gene_names)))
-    for origin_gene_name in gene_names:
-        LOGGER.info("start {}".format(origin_gene_name))
-        records += detect_edges_all(origin_gene_name, args.score_method, cdsDAO, tree)
-
-    out_df = pd.DataFrame(records, columns=["x", "y", "score", "score_naive", "total", "found", "bls",
-                                            "top_offset", "top_relationship", "top_ratio"])
-    out_df.to_csv(args.out_fp, sep='\t', index=False)
+    columns = get_sweep_columns(args.sweep_dist) if args.sweep_dist else COLUMNS
+    checkpoint_direc = args.checkpoint_direc if args.checkpoint_direc else "{}.shards".format(args.out_fp)
+    checkpoint = Checkpoint(checkpoint_direc, resume=args.resume, params=build_run_params(args, columns))
+    todo_gene_names = [gene_name for gene_name in gene_names if gene_name not in checkpoint]
+    LOGGER.info("found {} genes to search ({} done in {})".format(
+        len(todo_gene_names), len(gene_names) - len(todo_gene_names), checkpoint_direc))
+    edges_iter = iter_edges_all(todo_gene_names, args.score_method, cdsDAO, neighbor_table, bls_engine,
+                                workers=args.workers, sweep_dist=args.sweep_dist, profiler=profiler)
+    for origin_gene_name, records in zip(todo_gene_names, edges_iter):
+        with profiler.stage("output"):
+            checkpoint.append(origin_gene_name, records_to_tsv(records, columns))
+
+    with profiler.stage("output"):
+        checkpoint.merge(gene_names, args.out_fp, header=records_to_tsv([], columns, header=True))
+        checkpoint.remove()
     LOGGER.info("saved results to {}".format(args.out_fp))
 
+    if bls_engine is not None:
+        LOGGER.info("bls cache: {} hits, {} misses, {} entries".format(
+            bls_engine.hits, bls_engine.misses, len(bls_engine)))
+        if args.bls_cache_direc:
+            bls_engine.save(bls_cache_fp)
+            LOGGER.info("saved {} cached bls to {}".format(len(bls_engine), bls_cache_fp))
+        profiler.count("bls_cache_hits", bls_engine.hits)
+        profiler.count("bls_cache_misses", bls_engine.misses)
+
+    if args.profile_out:
+        profiler.save(args.profile_out, script="neighbor_all", args=vars(args))
+
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, datefmt="%m/%d/%Y %I:%M:%S",
@@ -128,7 +317,20 @@ if __name__ == "__main__":
     parser.add_argument("--clade_name", required=True, help="clade_name")
     parser.add_argument("--score_method", required=True, choices=["naive", "independent", "conditional"])
     parser.add_argument("--out_fp", required=True)
-    parser.add_argument("--split_fp", help="simulated segment map")
+    parser.add_argument("--split_fp", help="simulated segment map (.map), or replicates of segmentation (.npz)")
+    parser.add_argument("--replicate", type=int, default=0, help="replicate to use when split_fp is .npz")
     parser.add_argument("--tree_fp", help="newick tree")
+    parser.add_argument("--bls_cache_size", type=int, default=BlsCache.MAXSIZE, help="max entries of bls cache")
+    parser.add_argument("--bls_cache_direc", help="directory to persist bls cache, keyed by the hash of tree_fp")
+    parser.add_argument("--sweep_dist", type=int,
+                        help="score every window of DIST = 1..sweep_dist in one pass, instead of the default DIST")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--checkpoint_direc", help="directory of shards for finished genes (default: {out_fp}.shards)")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip genes already finished in checkpoint_direc, which must have been run with the same "
+                             "parameters")
+    parser.add_argument("--snapshot_budget", type=float, default=SnapshotCache.BUDGET / 2 ** 30,
+                        help="disk budget in GB of clade snapshots under the clade directory, 0 to disable")
+    parser.add_argument("--profile_out", help="JSON report of wall time, cpu time and peak rss per stage")
     args = parser.parse_args()
     main(args)
@@ -14,25 +14,26 @@ import pandas as pd
 
 ROOT_PATH = pathlib.Path().joinpath('../../').resolve()
 sys.path.append(str(ROOT_PATH))
-from mylib.db import CdsDAO, load_genome_names_by_clade_name, load_cdss_by_genome_names
+from mylib.db import ColumnarCdsDAO
 from mylib.path import build_clade_filepath
-from neighborlib import NeighborhoodMatrix, set_gene_name_to_cdss, set_split_to_cdss
-from scorelib import score_naive, score_independent, score_conditional
+from mylib.profiler import Profiler, NULL_PROFILER
+from neighborlib import ArrayNeighborhoodMatrix, NeighborTable, load_segment_ids
+from snapshotlib import SnapshotCache, load_clade_cds_df
+from scorelib import score_batch
 
 LOGGER = logging.getLogger(__name__)
 
 
-def detect_edges_target(origin_gene_name, neighbor_gene_names, score_method, cdsDAO):
-    neighbor_matrix = NeighborhoodMatrix(origin_gene_name, cdsDAO)
+def detect_edges_target(origin_gene_name, neighbor_gene_names, score_method, cdsDAO, neighbor_table=None,
+                        profiler=NULL_PROFILER):
+    with profiler.stage("matrix"):
+        neighbor_matrix = ArrayNeighborhoodMatrix(origin_gene_name, cdsDAO, neighbor_table)
+    neighbor_gene_names = list(neighbor_gene_names)
+    with profiler.stage("scoring"):
+        indicator_tensor = neighbor_matrix.to_indicator_tensor(neighbor_gene_names)
+        scores = score_batch(indicator_tensor, score_method)
     records = []
-    for neighbor_gene_name in neighbor_gene_names:
-        indicator_matrix = neighbor_matrix.to_indicator_matrix(neighbor_gene_name)
-        if score_method == "naive":
-            score = score_naive(indicator_matrix)
-        elif score_method == "independent":
-            score = score_independent(indicator_matrix)
-        elif score_method == "conditional":
-            score = score_conditional(indicator_matrix)
+    for neighbor_gene_name, score in zip(neighbor_gene_names, scores):
         records.append({
             "x": origin_gene_name,
             "y": neighbor_gene_name,
@@ -42,32 +43,37 @@ def detect_edges_target(origin_gene_name, neighbor_gene_names, score_method, cds
 
 
 def main(args):
-    genome_names = load_genome_names_by_clade_name(args.clade_name)
-    LOGGER.info("loaded {} {} genomes".format(len(genome_names), args.clade_name))
-    cdss = load_cdss_by_genome_names(genome_names)
-    LOGGER.info("loaded {} cdss".format(len(cdss)))
-
+    profiler = Profiler(enabled=args.profile_out is not None)
     ortho_fp = pathlib.Path(build_clade_filepath(args.clade_name)).joinpath("./ortho/{}.ortho".format(args.clade_name))
-    cdss = set_gene_name_to_cdss(cdss, ortho_fp)
-    LOGGER.info("loaded orthology from {}".format(ortho_fp))
-
-    if args.split_fp:
-        cdss = set_split_to_cdss(cdss, args.split_fp)
-        LOGGER.info("loaded simulated segmentation from {}".format(args.split_fp))
+    cds_df, _ = load_clade_cds_df(args.clade_name, ortho_fp, budget=int(args.snapshot_budget * 2 ** 30),
+                                  profiler=profiler)
 
     neighbor_df = pd.read_csv(args.neighbor_fp, comment='#')
     LOGGER.info("loaded {} relationships from {}".format(len(neighbor_df), args.neighbor_fp))
 
     records = []
-    cdsDAO = CdsDAO(cdss)
+    with profiler.stage("neighbor_table"):
+        cdsDAO = ColumnarCdsDAO(cds_df)
+        if args.split_fp:
+            cdsDAO.set_segment_ids(load_segment_ids(args.split_fp, cdsDAO, args.replicate))
+            LOGGER.info("loaded simulated segmentation from {}".format(args.split_fp))
+        neighbor_table = NeighborTable(cdsDAO)
+        LOGGER.info("extracted {} neighbor pairs".format(len(neighbor_table)))
     for origin_gene_name, sub_df in neighbor_df.groupby("x"):
         neighbor_gene_names = sub_df["y"]
-        records += detect_edges_target(origin_gene_name, neighbor_gene_names, args.score_method, cdsDAO)
-
-    out_df = pd.DataFrame(records, columns=["x", "y", "score"])
-    out_df.to_csv(args.out_fp, sep='\t', index=False)
+        records += detect_edges_target(origin_gene_name, neighbor_gene_names, args.score_method, cdsDAO,
+                                       neighbor_table, profiler)
+        profiler.count("genes")
+    profiler.count("records", len(records))
+
+    with profiler.stage("output"):
+        out_df = pd.DataFrame(records, columns=["x", "y", "score"])
+        out_df.to_csv(args.out_fp, sep='\t', index=False)
     LOGGER.info("saved results to {}".format(args.out_fp))
 
+    if args.profile_out:
+        profiler.save(args.profile_out, script="neighbor_target", args=vars(args))
+
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, datefmt="%m/%d/%Y %I:%M:%S",
@@ -77,6 +83,10 @@ if __name__ == "__main__":
     parser.add_argument("--score_method", required=True, choices=["naive", "independent", "conditional"])
     parser.add_argument("--out_fp", required=True)
     parser.add_argument("--neighbor_fp", required=True, help=".neighbor to follow")
-    parser.add_argument("--split_fp", help="simulated segment map")
+    parser.add_argument("--split_fp", help="simulated segment map (.map), or replicates of segmentation (.npz)")
+    parser.add_argument("--replicate", type=int, default=0, help="replicate to use when split_fp is .npz")
+    parser.add_argument("--snapshot_budget", type=float, default=SnapshotCache.BUDGET / 2 ** 30,
+                        help="disk budget in GB of clade snapshots under the clade directory, 0 to disable")
+    parser.add_argument("--profile_out", help="JSON report of wall time, cpu time and peak rss per stage")
     args = parser.parse_args()
     main(args)
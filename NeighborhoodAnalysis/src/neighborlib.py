@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
 
-from collections import defaultdict
+import hashlib
+import pathlib
+from collections import OrderedDict, defaultdict
 from logging import getLogger
 
 import numpy as np
 import pandas as pd
 
+from splitlib import load_replicate
+
 LOGGER = getLogger(__name__)
 
 
@@ -130,6 +134,166 @@ class NeighborhoodMatrix:
         return ret
 
 
+class ArrayNeighborhoodMatrix:
+    """
+    Columnar version of NeighborhoodMatrix. The window is kept as numpy arrays of integer gene codes (see CdsDAO),
+    and MatrixPositions are only created on demand by the accessors.
+    """
+
+    DIST = NeighborhoodMatrix.DIST
+
+    def __init__(self, origin_gene_name, cdsDAO, neighbor_table=None, dist=None):
+        """
+        the window is filled from neighbor_table (see NeighborTable) if given, otherwise by looking up cdsDAO.
+        dist is the half width of the window, DIST by default.
+        initialize the following data structures:
+
+        self.origin_idxs: numpy 1D (H) array of cds idx of origin cdss, i.e. origin row -> cds idx
+        self.neighbor_idx_arr: numpy 2D (HxW) array of cds idx of neighbor cdss, where -1 for missing
+        self.gene_arr: numpy 2D (HxW) array of neighbor gene codes, where -1 for missing or cdss without gene
+        self.forward_arr: numpy 2D (HxW) bool array, True if the neighbor cds has the same strand as the origin cds
+        self.missing_msk: numpy 2D (HxW) bool array, True if no cds found at the position
+        """
+
+        self.origin_gene_name = origin_gene_name
+        self.cdsDAO = cdsDAO
+        self.dist = self.DIST if dist is None else dist
+        self.origin_idxs = cdsDAO.get_idxs_by_gene_name(origin_gene_name).astype(np.int32)
+        self.shape = (len(self.origin_idxs), 2 * self.dist + 1)
+
+        self.neighbor_idx_arr = -np.ones(self.shape, dtype=np.int32)
+        self.forward_arr = np.zeros(self.shape, dtype=bool)
+        if neighbor_table is not None:
+            assert neighbor_table.dist == self.dist
+            table_slice = neighbor_table.get_slice(cdsDAO.get_code_by_gene_name(origin_gene_name))
+            rows = neighbor_table.row_arr[table_slice]
+            cols = neighbor_table.offset_arr[table_slice] + self.dist
+            self.neighbor_idx_arr[rows, cols] = neighbor_table.neighbor_idx_arr[table_slice]
+            self.forward_arr[rows, cols] = neighbor_table.forward_arr[table_slice]
+        else:
+            for j, offset in enumerate(range(-self.dist, self.dist + 1)):
+                neighbor_idxs = cdsDAO.get_neighbor_idxs(self.origin_idxs, offset)
+                found_msk = neighbor_idxs >= 0
+                self.neighbor_idx_arr[:, j] = neighbor_idxs
+                self.forward_arr[found_msk, j] = (cdsDAO.strand_codes[neighbor_idxs[found_msk]] ==
+                                                  cdsDAO.strand_codes[self.origin_idxs[found_msk]])
+        self.missing_msk = self.neighbor_idx_arr < 0
+        self.gene_arr = np.where(self.missing_msk, -1, cdsDAO.gene_codes[self.neighbor_idx_arr]).astype(np.int32)
+
+    def __repr__(self):
+        return "<ArrayMatrix@{0}({1}x{2})>".format(self.origin_gene_name, self.shape[0], self.shape[1])
+
+    def _get_gene_msk(self, gene_name):
+        if gene_name is None:
+            return (self.gene_arr == -1) & ~self.missing_msk
+        code = self.cdsDAO.get_code_by_gene_name(gene_name)
+        if code < 0:
+            return np.zeros(self.shape, dtype=bool)
+        return self.gene_arr == code
+
+    def _to_position(self, i, j):
+        if self.missing_msk[i, j]:
+            return None
+        origin_cds = self.cdsDAO.get_cds_by_idx(int(self.origin_idxs[i]))
+        neighbor_cds = self.cdsDAO.get_cds_by_idx(int(self.neighbor_idx_arr[i, j]))
+        return MatrixPosition(i, j, j - self.dist,
+                              is_forward=bool(self.forward_arr[i, j]),
+                              origin_name=origin_cds.cds_name,
+                              cds_name=neighbor_cds.cds_name,
+                              gene_name=self.cdsDAO.get_gene_name_by_code(self.gene_arr[i, j]))
+
+    def get_count_by_offset(self, offset):
+        """
+        :param offset: should between [-dist, dist]
+        :return: number of cdss found at the offset
+        """
+
+        if abs(offset) > self.dist:
+            return 0
+        return int((~self.missing_msk[:, offset + self.dist]).sum())
+
+    def get_positions_by_offset(self, offset, dropna=False):
+        """
+        :param offset:
+        :param dropna: remove None if true
+        :return: all MatrixPositions or None at the offset
+        """
+
+        if abs(offset) > self.dist:
+            return []
+        j = offset + self.dist
+        positions = [self._to_position(i, j) for i in range(self.shape[0])]
+        if dropna:
+            return list(filter(lambda pos: pos is not None, positions))
+        else:
+            return positions
+
+    def get_positions_by_gene_name(self, gene_name):
+        """
+        :param gene_name:
+        :return: all MatrixPoisitions where the gene found
+        """
+
+        return [self._to_position(i, j) for i, j in zip(*np.nonzero(self._get_gene_msk(gene_name)))]
+
+    def get_neighbor_gene_names(self):
+        """
+        list all the neighborhood gene names which appeared at least once in the matrix.
+        """
+
+        codes = np.unique(self.gene_arr[self.gene_arr >= 0])
+        gene_name_set = set(self.cdsDAO.get_gene_name_by_code(code) for code in codes)
+        gene_name_set.discard(self.origin_gene_name)
+        return gene_name_set
+
+    def to_indicator_matrix(self, gene_name):
+        """
+        convert to indicator matrix, where 1 stands for target gene, 0 for other gene, and -1 for missing
+        """
+
+        return np.where(self.missing_msk, -1, self._get_gene_msk(gene_name)).astype(float)
+
+    def count_genes(self, gene_names):
+        """
+        count occurrences of each gene without building indicator matrices
+        :return: numpy 1D (G) array of the number of rows where each gene found,
+                 and numpy 2D (GxW) array of the number of each gene found at each column
+        """
+
+        codes = np.array([self.cdsDAO.get_code_by_gene_name(gene_name) for gene_name in gene_names], dtype=np.int32)
+        rows, cols = np.nonzero(self.gene_arr >= 0)
+        genes = self.gene_arr[rows, cols]
+        sorter = np.argsort(codes)
+        positions = np.minimum(np.searchsorted(codes, genes, sorter=sorter), max(len(codes) - 1, 0))
+        msk = codes[sorter[positions]] == genes if len(codes) > 0 else np.zeros(len(genes), dtype=bool)
+        gs, rows, cols = sorter[positions[msk]], rows[msk], cols[msk]
+
+        width = self.shape[1]
+        col_counts = np.bincount(gs * width + cols, minlength=len(codes) * width).reshape(len(codes), width)
+        row_counts = np.bincount(np.unique(gs * self.shape[0] + rows) // max(self.shape[0], 1), minlength=len(codes))
+        return row_counts, col_counts
+
+    def get_window_slice(self, dist):
+        """
+        :return: slice of columns for the smaller window of dist (<= self.dist)
+        """
+
+        assert 0 <= dist <= self.dist
+        return slice(self.dist - dist, self.dist + dist + 1)
+
+    def to_indicator_tensor(self, gene_names):
+        """
+        stack indicator matrices of gene_names into numpy 3D (GxHxW) int8 tensor for batched scoring
+        """
+
+        codes = np.array([self.cdsDAO.get_code_by_gene_name(gene_name) for gene_name in gene_names], dtype=np.int32)
+        tensor = (self.gene_arr[np.newaxis, :, :] == codes[:, np.newaxis, np.newaxis]).astype(np.int8)
+        for g in np.nonzero(codes < 0)[0]:  # None or unknown gene_name
+            tensor[g] = self._get_gene_msk(gene_names[g])
+        tensor[:, self.missing_msk] = -1
+        return tensor
+
+
 def calc_bls(genome_names, tree):
     """
     calculate sum of branch length covered by a subset of leafs
@@ -153,16 +317,272 @@ def calc_bls(genome_names, tree):
     return bls
 
 
-def set_split_to_cdss(cdss, split_fp):
-    split_df = pd.read_csv(split_fp, sep='\t')
-    cds2split = dict(zip(split_df["cds_id"], split_df["split_id"]))
-    for cds in cdss:
-        if cds.cds_id in cds2split:
-            cds.scaffold_id = cds2split[cds.cds_id]
-        else:
-            LOGGER.error("cds_id = {} is not defined in {}".format(cds.cds_id, split_fp))
-            exit(1)
-    return cdss
+class NeighborTable:
+    """
+    All (origin cds, neighbor cds) pairs within the window of the whole clade, extracted by a single vectorized pass
+    over the cds arrays of CdsDAO. Pairs are the same as CdsDAO.get_neighbor_idxs, i.e. the neighbor is the cds with
+    cds_id +/- offset (depending on the strand of the origin) in the same segment (see CdsDAO.set_segment_ids).
+    Only cdss with gene are used as origins, and pairs are sorted by (origin gene code, origin row, offset),
+    where origin row is the order of the origin cds in CdsDAO.get_idxs_by_gene_name (= row of ArrayNeighborhoodMatrix).
+    """
+
+    def __init__(self, cdsDAO, dist=NeighborhoodMatrix.DIST):
+        """
+        initialize the following numpy 1D arrays, aligned to each pair:
+
+        self.origin_gene_arr: gene code of the origin cds
+        self.neighbor_gene_arr: gene code of the neighbor cds, -1 for cdss without gene
+        self.row_arr: origin row
+        self.offset_arr: offset in [-dist, dist]
+        self.forward_arr: True if the neighbor cds has the same strand as the origin cds
+        self.neighbor_idx_arr: cds idx of the neighbor cds
+        self.gene_starts: start of the pairs of each origin gene code, with the total count at the end
+        """
+
+        self.dist = dist
+        gene_codes = cdsDAO.gene_codes
+        origin_idxs = np.nonzero(gene_codes >= 0)[0]
+        origin_idxs = origin_idxs[np.argsort(gene_codes[origin_idxs], kind="stable")]
+        origin_genes = gene_codes[origin_idxs]
+        origin_starts = np.searchsorted(origin_genes, np.arange(len(cdsDAO.gene_names)))
+        rows = np.arange(len(origin_idxs)) - origin_starts[origin_genes]
+
+        columns = defaultdict(list)
+        for offset in range(-dist, dist + 1):
+            neighbor_idxs = cdsDAO.get_neighbor_idxs(origin_idxs, offset)
+            msk = neighbor_idxs >= 0
+            columns["origin_gene"].append(origin_genes[msk])
+            columns["row"].append(rows[msk])
+            columns["offset"].append(np.full(msk.sum(), offset))
+            columns["forward"].append(cdsDAO.strand_codes[neighbor_idxs[msk]] == cdsDAO.strand_codes[origin_idxs[msk]])
+            columns["neighbor_idx"].append(neighbor_idxs[msk])
+        columns = dict((key, np.concatenate(val)) for key, val in columns.items())
+
+        order = np.lexsort((columns["offset"], columns["row"], columns["origin_gene"]))
+        self.origin_gene_arr = columns["origin_gene"][order].astype(np.int32)
+        self.row_arr = columns["row"][order].astype(np.int32)
+        self.offset_arr = columns["offset"][order].astype(np.int16)
+        self.forward_arr = columns["forward"][order]
+        self.neighbor_idx_arr = columns["neighbor_idx"][order].astype(np.int32)
+        self.neighbor_gene_arr = gene_codes[self.neighbor_idx_arr]
+        self.gene_starts = np.searchsorted(self.origin_gene_arr, np.arange(len(cdsDAO.gene_names) + 1))
+
+    def __len__(self):
+        return len(self.origin_gene_arr)
+
+    def get_slice(self, gene_code):
+        """
+        :return: slice of pairs whose origin gene is gene_code
+        """
+
+        if gene_code < 0:
+            return slice(0, 0)
+        return slice(self.gene_starts[gene_code], self.gene_starts[gene_code + 1])
+
+
+class BlsEngine:
+    """
+    Array representation of a tree to calculate branch length sum (BLS) covered by a subset of leafs,
+    without copying and pruning the tree like calc_bls.
+    BLS equals half the sum of distances between leafs adjacent in DFS order (cyclic),
+    and each distance is given by the lowest common ancestor (LCA) using a sparse table over the Euler tour.
+    """
+
+    def __init__(self, tree):
+        """
+        initialize the following data structures, where nodes are indexed in preorder:
+
+        self.parent_arr: parent node idx, -1 for root
+        self.dist_arr: branch length to the parent node
+        self.depth_arr: distance from the root
+        self.euler_arr: node idx in Euler tour order
+        self.first_arr: first position of each node in the Euler tour
+        self.sparse_table: 2D array, where sparse_table[k][i] is the Euler position with the minimum level in
+                           [i, i + 2^k)
+        self.leaf2idx: key: leaf name, val: node idx
+        """
+
+        nodes = list(tree.get_tree_root().traverse("preorder"))
+        node2idx = dict((id(node), idx) for idx, node in enumerate(nodes))
+        node_count = len(nodes)
+
+        self.parent_arr = -np.ones(node_count, dtype=np.int32)
+        self.dist_arr = np.zeros(node_count)
+        self.depth_arr = np.zeros(node_count)
+        level_arr = np.zeros(node_count, dtype=np.int32)
+        children = [[] for _ in range(node_count)]
+        for idx, node in enumerate(nodes):
+            if idx > 0:  # parents always come before children in preorder
+                parent_idx = node2idx[id(node.up)]
+                self.parent_arr[idx] = parent_idx
+                self.dist_arr[idx] = node.dist
+                self.depth_arr[idx] = self.depth_arr[parent_idx] + node.dist
+                level_arr[idx] = level_arr[parent_idx] + 1
+                children[parent_idx].append(idx)
+        self.leaf2idx = dict((node.name, idx) for idx, node in enumerate(nodes) if node.is_leaf())
+
+        euler = []
+        stack = [(0, 0)]  # (node idx, next child position)
+        while len(stack) > 0:
+            idx, pos = stack.pop()
+            euler.append(idx)
+            if pos < len(children[idx]):
+                stack.append((idx, pos + 1))
+                stack.append((children[idx][pos], 0))
+        self.euler_arr = np.array(euler, dtype=np.int32)
+        self.first_arr = np.zeros(node_count, dtype=np.int32)
+        self.first_arr[self.euler_arr[::-1]] = np.arange(len(euler) - 1, -1, -1, dtype=np.int32)
+
+        self.euler_level_arr = level_arr[self.euler_arr]
+        table = [np.arange(len(euler), dtype=np.int32)]
+        width = 1
+        while 2 * width <= len(euler):
+            prev = table[-1]
+            left, right = prev[:len(euler) - width], prev[width:]
+            row = prev.copy()
+            row[:len(euler) - width] = np.where(self.euler_level_arr[left] <= self.euler_level_arr[right], left, right)
+            table.append(row)
+            width *= 2
+        self.sparse_table = np.array(table)
+
+    def __len__(self):
+        return len(self.leaf2idx)
+
+    def get_lca(self, idxs1, idxs2):
+        """
+        :param idxs1, idxs2: numpy 1D arrays of node idx
+        :return: numpy 1D array of node idx of LCA for each pair
+        """
+
+        firsts1, firsts2 = self.first_arr[idxs1], self.first_arr[idxs2]
+        lefts, rights = np.minimum(firsts1, firsts2), np.maximum(firsts1, firsts2)
+        ks = np.floor(np.log2(rights - lefts + 1)).astype(np.int32)
+        candidates1 = self.sparse_table[ks, lefts]
+        candidates2 = self.sparse_table[ks, rights - (1 << ks) + 1]
+        msk = self.euler_level_arr[candidates1] <= self.euler_level_arr[candidates2]
+        return self.euler_arr[np.where(msk, candidates1, candidates2)]
+
+    def calc_bls(self, genome_names):
+        """
+        calculate sum of branch length covered by a subset of leafs. Same as calc_bls(genome_names, tree).
+        """
+
+        genome_names = set(genome_names)
+        if len(genome_names) <= 1:
+            return 0.0
+
+        missing_names = [genome_name for genome_name in genome_names if genome_name not in self.leaf2idx]
+        if len(missing_names) > 0:
+            raise ValueError("{} leafs are not found in the tree, e.g. {}".format(
+                len(missing_names), sorted(missing_names)[0]))
+        idxs = np.array([self.leaf2idx[genome_name] for genome_name in genome_names], dtype=np.int32)
+        idxs = idxs[np.argsort(self.first_arr[idxs])]  # sort in DFS order
+        next_idxs = np.roll(idxs, -1)
+        lca_idxs = self.get_lca(idxs, next_idxs)
+        dists = self.depth_arr[idxs] + self.depth_arr[next_idxs] - 2 * self.depth_arr[lca_idxs]
+        return float(dists.sum() / 2)
+
+
+class BlsCache:
+    """
+    Bounded LRU cache of BlsEngine.calc_bls, keyed by the bitset of genome indices (sorted leaf names).
+    """
+
+    MAXSIZE = 1000000
+
+    def __init__(self, bls_engine, maxsize=MAXSIZE):
+        self.bls_engine = bls_engine
+        self.maxsize = maxsize
+        self.leaf2bit = dict((leaf_name, bit) for bit, leaf_name in enumerate(sorted(bls_engine.leaf2idx.keys())))
+        self.cache = OrderedDict()  # key: bitset, val: bls
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.cache)
+
+    def get_key(self, genome_names):
+        bit_arr = np.zeros(len(self.leaf2bit), dtype=bool)
+        bit_arr[[self.leaf2bit[genome_name] for genome_name in genome_names]] = True
+        return np.packbits(bit_arr).tobytes()
+
+    def calc_bls(self, genome_names):
+        try:
+            key = self.get_key(genome_names)
+        except KeyError:  # let bls_engine raise the error
+            return self.bls_engine.calc_bls(genome_names)
+
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        self.misses += 1
+        bls = self.bls_engine.calc_bls(genome_names)
+        self.cache[key] = bls
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+        return bls
+
+    @staticmethod
+    def build_filepath(direc, tree_fp):
+        with open(tree_fp, 'rb') as f:
+            tree_hash = hashlib.sha1(f.read()).hexdigest()
+        return str(pathlib.Path(direc).joinpath("{}.bls.npz".format(tree_hash)))
+
+    def load(self, fp):
+        """
+        load cached bls from fp if exists. Entries are treated as the least recently used.
+        """
+
+        if not pathlib.Path(fp).exists():
+            return
+        npz = np.load(fp)
+        for key_arr, bls in zip(npz["keys"][::-1], npz["bls"][::-1]):  # from the most recently used
+            key = key_arr.tobytes()
+            if key not in self.cache and len(self.cache) < self.maxsize:
+                self.cache[key] = float(bls)
+                self.cache.move_to_end(key, last=False)
+
+    def save(self, fp):
+        pathlib.Path(fp).parent.mkdir(parents=True, exist_ok=True)
+        key_size = (len(self.leaf2bit) + 7) // 8
+        keys = np.frombuffer(b''.join(self.cache.keys()), dtype=np.uint8).reshape(len(self.cache), key_size)
+        np.savez(fp, keys=keys, bls=np.array(list(self.cache.values()), dtype=float))
+
+
+def load_segment_ids(split_fp, cdsDAO, replicate=0):
+    """
+    load simulated segmentation to be overlaid by CdsDAO.set_segment_ids()
+    :param split_fp: .map written by split.py, or .npz of replicates written by split.py --replicates
+    :param replicate: replicate to load from .npz
+    :return: array of segment id aligned to idx of cdsDAO
+    :raise KeyError: if any cds of cdsDAO is not defined in split_fp
+    """
+
+    if str(split_fp).endswith(".npz"):
+        split_df = load_replicate(split_fp, replicate)
+    else:
+        split_df = pd.read_csv(split_fp, sep='\t')
+    segment_col = "segment_id" if "segment_id" in split_df.columns else "split_id"
+
+    positions = pd.Index(split_df["cds_id"]).get_indexer(cdsDAO.cds_ids)
+    missing_msk = positions < 0
+    if missing_msk.any():
+        raise KeyError("{} cds_ids are not defined in {}, e.g. cds_id = {}".format(
+            missing_msk.sum(), split_fp, cdsDAO.cds_ids[missing_msk][0]))
+    return split_df[segment_col].values[positions]
+
+
+def set_gene_name_to_cds_df(cds_df, ortho_fp):
+    """
+    DataFrame version of set_gene_name_to_cdss(), where gene_name is NaN for cdss without gene
+    """
+
+    ortho_df = pd.read_csv(ortho_fp, sep='\t', usecols=["cds_name", "gene_name"])
+    ortho_df = ortho_df.drop_duplicates("cds_name", keep="last")
+    cds_df["gene_name"] = cds_df["cds_name"].map(pd.Series(ortho_df["gene_name"].values, index=ortho_df["cds_name"]))
+    return cds_df
 
 
 def set_gene_name_to_cdss(cdss, ortho_fp):
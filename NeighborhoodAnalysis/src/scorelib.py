@@ -40,3 +40,100 @@ def score_conditional(indicator_matrix):
         score_arr += target_arr * (1 - score_arr)
     score = np.mean(score_arr)
     return score
+
+
+def score_naive_batch(indicator_tensor):
+    """
+    batched version of score_naive
+    :param indicator_tensor: 3D (GxHxW) stack of indicator matrices sharing the same missing positions
+    :return: numpy 1D (G) array of scores
+    """
+
+    total = indicator_tensor.shape[1]
+    found_arr = ((indicator_tensor == 1).sum(axis=2) > 0).sum(axis=1)
+    if total > 0:
+        return found_arr / total
+    else:
+        return np.zeros(indicator_tensor.shape[0])
+
+
+def score_independent_batch(indicator_tensor):
+    """
+    batched version of score_independent
+    :param indicator_tensor: 3D (GxHxW) stack of indicator matrices sharing the same missing positions
+    :return: numpy 1D (G) array of scores
+    """
+
+    if indicator_tensor.shape[0] == 0:
+        return np.zeros(0)
+    total_arr = (indicator_tensor[0] >= 0).sum(axis=0)  # missing positions are shared among genes
+    found_arr = (indicator_tensor == 1).sum(axis=1)
+    msk = total_arr > 0
+    if msk.sum() == 0:
+        return np.zeros(indicator_tensor.shape[0])
+    else:
+        freq_arr = found_arr[:, msk] / total_arr[msk]
+        score_arr = 1 - np.prod(1 - freq_arr, axis=1)
+        return score_arr
+
+
+def score_conditional_batch(indicator_tensor):
+    """
+    batched version of score_conditional
+    :param indicator_tensor: 3D (GxHxW) stack of indicator matrices sharing the same missing positions
+    :return: numpy 1D (G) array of scores
+    """
+
+    def calculate_phat(target_arr, score_arr):
+        # batched np.dot for each gene, which keeps the same summation order as score_conditional
+        weight_arr = (1 - score_arr)[:, :, np.newaxis]
+        num = np.matmul((target_arr == 1)[:, np.newaxis, :], weight_arr)[:, 0, 0]
+        den = np.matmul((target_arr >= 0)[:, np.newaxis, :], weight_arr)[:, 0, 0]
+        return np.divide(num, den, out=np.zeros(len(den)), where=den > 0)
+
+    gene_count, row_count, _ = indicator_tensor.shape
+    if gene_count == 0:
+        return np.zeros(0)
+    score_arr = np.zeros((gene_count, row_count))
+    total_arr = (indicator_tensor[0] >= 0).sum(axis=0)  # missing positions are shared among genes
+    for j in np.argsort(total_arr)[::-1]:
+        target_arr = indicator_tensor[:, :, j].astype(float)
+        phat = calculate_phat(target_arr, score_arr)
+        target_arr = np.where(target_arr == -1, phat[:, np.newaxis], target_arr)  # fill missing value with phat
+        score_arr += target_arr * (1 - score_arr)
+    score = np.mean(score_arr, axis=1)
+    return score
+
+
+def score_batch(indicator_tensor, score_method):
+    if score_method == "naive":
+        return score_naive_batch(indicator_tensor)
+    elif score_method == "independent":
+        return score_independent_batch(indicator_tensor)
+    elif score_method == "conditional":
+        return score_conditional_batch(indicator_tensor)
+    else:
+        raise ValueError("unknown score_method: {}".format(score_method))
+
+
+def bound_naive(row_counts, total):
+    """
+    upper bound (= exact value) of score_naive from the number of rows where each gene found
+    """
+
+    if total > 0:
+        return row_counts / total
+    else:
+        return np.zeros(len(row_counts))
+
+
+def bound_independent(col_counts, total_arr):
+    """
+    upper bound (= exact value) of score_independent from counts, which only depends on the frequency of each gene
+    at each column. It is also an upper bound of scores of any narrower window, e.g. of detect_edges_sweep().
+    :param col_counts: numpy 2D (GxW) array of the number of each gene found at each column
+    :param total_arr: numpy 1D (W) array of the number of observed cdss at each column
+    """
+
+    msk = total_arr > 0
+    return 1 - np.prod(1 - col_counts[:, msk] / total_arr[msk], axis=1)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+from logging import getLogger
+
+import numpy as np
+import pandas as pd
+
+from mylib.db import DB_PATH, get_connection, load_genome_names_by_clade_name, load_cds_df_by_genome_names
+from mylib.path import build_clade_filepath, hash_file
+from mylib.profiler import NULL_PROFILER
+from neighborlib import set_gene_name_to_cds_df
+
+LOGGER = getLogger(__name__)
+INT_COLUMNS = ["cds_id", "genome_id", "scaffold_id", "start", "end", "length"]
+
+
+class SnapshotCache:
+    """
+    Columnar snapshots of the cdss of a clade (cds_df with gene_name joined from .ortho), one directory per key with
+    a memory-mappable .npy per column, so that analysis scripts skip DB queries and the ortho join on start-up.
+    The key is a hash of the DB file identity (device, inode, size, mtime) and the content of the .ortho file,
+    so that any change of either invalidates the snapshot.
+    Snapshots are evicted in least recently used order while the total size exceeds the budget.
+    """
+
+    META_NAME = "meta.json"
+    BUDGET = 4 * 2 ** 30  # in bytes
+
+    def __init__(self, direc, budget=BUDGET):
+        self.direc = pathlib.Path(direc)
+        self.budget = budget
+
+    @staticmethod
+    def build_key(clade_name, db_fp=None, ortho_fp=None):
+        stat = os.stat(str(db_fp if db_fp else DB_PATH))
+        identity = {
+            "clade_name": clade_name,
+            "db": [str(pathlib.Path(db_fp if db_fp else DB_PATH).resolve()), stat.st_dev, stat.st_ino, stat.st_size,
+                   stat.st_mtime_ns],
+            "ortho": hash_file(ortho_fp) if ortho_fp else None
+        }
+        return hashlib.sha1(json.dumps(identity, sort_keys=True).encode()).hexdigest()
+
+    def __contains__(self, key):
+        return self.direc.joinpath(key, self.META_NAME).exists()
+
+    def load(self, key):
+        """
+        :return: (cds_df, gene_names) where gene_name of cds_df is categorical of gene_names, None without .ortho
+        """
+
+        snapshot_direc = self.direc.joinpath(key)
+        meta_fp = snapshot_direc.joinpath(self.META_NAME)
+        meta = json.loads(meta_fp.read_text())
+        os.utime(str(meta_fp))  # mark as recently used
+
+        columns = dict()
+        for column in INT_COLUMNS + ["cds_name"]:
+            columns[column] = np.load(str(snapshot_direc.joinpath("{}.npy".format(column))), mmap_mode='r')
+        cds_df = pd.DataFrame({column: columns[column] for column in INT_COLUMNS})
+        cds_df.insert(3, "cds_name", columns["cds_name"].astype(object))
+        strand_codes = np.load(str(snapshot_direc.joinpath("strand.npy")), mmap_mode='r')
+        cds_df["strand"] = pd.Categorical.from_codes(strand_codes, meta["strands"])
+        gene_names = meta["gene_names"]
+        if gene_names is not None:
+            gene_codes = np.load(str(snapshot_direc.joinpath("gene_code.npy")), mmap_mode='r')
+            cds_df["gene_name"] = pd.Categorical.from_codes(gene_codes, gene_names)
+        return cds_df, gene_names
+
+    def save(self, key, cds_df, gene_names=None):
+        """
+        write to a temporary directory first, so that concurrent readers never see a half-written snapshot
+        :param gene_names: sorted gene_names of .ortho, to encode gene_name of cds_df
+        """
+
+        self.direc.mkdir(parents=True, exist_ok=True)
+        tmp_direc = self.direc.joinpath("{}.{}.tmp".format(key, os.getpid()))
+        tmp_direc.mkdir()
+        for column in INT_COLUMNS:
+            np.save(str(tmp_direc.joinpath("{}.npy".format(column))), cds_df[column].to_numpy(dtype=np.int64))
+        np.save(str(tmp_direc.joinpath("cds_name.npy")), cds_df["cds_name"].to_numpy(dtype=str))
+        strand_codes, strands = pd.factorize(cds_df["strand"].astype(object))
+        np.save(str(tmp_direc.joinpath("strand.npy")), strand_codes.astype(np.int8))
+        if gene_names is not None:
+            gene_codes = pd.Categorical(cds_df["gene_name"].astype(object), categories=gene_names).codes
+            np.save(str(tmp_direc.joinpath("gene_code.npy")), gene_codes.astype(np.int32))
+        meta = {"rows": len(cds_df), "strands": list(strands), "gene_names": gene_names}
+        tmp_direc.joinpath(self.META_NAME).write_text(json.dumps(meta))
+
+        try:
+            os.rename(str(tmp_direc), str(self.direc.joinpath(key)))
+        except OSError:  # saved by another process meanwhile
+            shutil.rmtree(str(tmp_direc))
+        self.evict(keep=key)
+
+    def get_size(self, key):
+        return sum(fp.stat().st_size for fp in self.direc.joinpath(key).iterdir())
+
+    def evict(self, keep=None):
+        """
+        remove least recently used snapshots until the total size is within the budget
+        :param keep: key never to be removed, e.g. the one just saved
+        """
+
+        entries = []  # (last used, key, size)
+        for meta_fp in self.direc.glob("*/{}".format(self.META_NAME)):
+            key = meta_fp.parent.name
+            entries.append((meta_fp.stat().st_mtime_ns, key, self.get_size(key)))
+        total_size = sum(size for _, _, size in entries)
+        for _, key, size in sorted(entries):
+            if total_size <= self.budget:
+                break
+            if key != keep:
+                shutil.rmtree(str(self.direc.joinpath(key)), ignore_errors=True)
+                total_size -= size
+                LOGGER.info("evicted snapshot {} ({} bytes)".format(key, size))
+
+
+def load_clade_cds_df(clade_name, ortho_fp=None, budget=SnapshotCache.BUDGET, snapshot_direc=None, db_fp=None,
+                      profiler=NULL_PROFILER):
+    """
+    load cdss of the clade with gene_name from ortho_fp, through the snapshot cache unless budget is 0
+    :param snapshot_direc: directory of snapshots, {build_clade_filepath(clade_name)}/snapshot by default
+    :param profiler: DB queries and snapshots are timed as "db_load" stage, and the join of ortho_fp as "ortho_join"
+    :return: (cds_df, gene_names) where gene_names are sorted gene_names of ortho_fp, None without ortho_fp
+    """
+
+    with profiler.stage("db_load"):
+        if budget > 0:
+            if snapshot_direc is None:
+                snapshot_direc = pathlib.Path(build_clade_filepath(clade_name)).joinpath("snapshot")
+            cache = SnapshotCache(snapshot_direc, budget)
+            key = cache.build_key(clade_name, db_fp, ortho_fp)
+            if key in cache:
+                cds_df, gene_names = cache.load(key)
+                LOGGER.info("loaded {} cdss of {} from snapshot {}".format(len(cds_df), clade_name, key))
+                return cds_df, gene_names
+
+        con = get_connection(db_fp)
+        genome_names = load_genome_names_by_clade_name(clade_name, con)
+        LOGGER.info("loaded {} {} genomes".format(len(genome_names), clade_name))
+        cds_df = load_cds_df_by_genome_names(genome_names, con)
+        con.close()
+
+    gene_names = None
+    if ortho_fp:
+        with profiler.stage("ortho_join"):
+            cds_df = set_gene_name_to_cds_df(cds_df, ortho_fp)
+            gene_names = sorted(set(pd.read_csv(ortho_fp, sep='\t', usecols=["gene_name"])["gene_name"]))
+        LOGGER.info("loaded orthology from {}".format(ortho_fp))
+
+    if budget > 0:
+        with profiler.stage("db_load"):
+            cache.save(key, cds_df, gene_names)
+        LOGGER.info("saved snapshot {} to {}".format(key, snapshot_direc))
+    return cds_df, gene_names
@@ -1,92 +1,201 @@
 #!/usr/bin/env python3
 
+import argparse
+import copy
+import heapq
 import logging
 import math
+import multiprocessing
 import pathlib
-import random
 import sys
-from collections import defaultdict
 
 import numpy as np
 import pandas as pd
 
 ROOT_PATH = pathlib.Path().joinpath('../../').resolve()
 sys.path.append(str(ROOT_PATH))
-from mylib.db import load_genome_names_by_clade_name, load_cdss_by_genome_names
-from splitlib import SegmentManager, Wcf
+from mylib.profiler import Profiler
+from snapshotlib import SnapshotCache, load_clade_cds_df
+from splitlib import SegmentManager, Wcf, save_replicates
 
 LOGGER = logging.getLogger(__name__)
+WORKER_STATE = dict()  # state inherited by forked worker processes (segment_manager, wcf_model)
 
 
 def calc_loss(wcf1, wcf2):
-    size = max(len(wcf1), len(wcf2))
-    wcf1_ = np.ones(size)
-    wcf2_ = np.ones(size)
-    wcf1_[:len(wcf1)] = wcf1.to_array()
-    wcf2_[:len(wcf2)] = wcf2.to_array()
-    loss = abs(wcf1_ - wcf2_).sum()
+    """
+    L1 distance of two weighted cumlative frequencies, which are 1.0 beyond their length
+    """
+
+    arr1, arr2 = wcf1.to_array(), wcf2.to_array()
+    if len(arr1) < len(arr2):
+        arr1, arr2 = arr2, arr1
+    loss = abs(arr1[:len(arr2)] - arr2).sum() + (1 - arr1[len(arr2):]).sum()
     return loss
 
 
-def fit(segment_manager, wcf_model):
+def calc_keep_counts(wcf_model, total_member_count):
     """
-    update SegmentManager to follow wcf_model
+    number of segments to keep for each size, so that segments of size >= k hold (1 - wcf_model[k - 1]) of members.
+    the counts only depend on the model, and segments longer than the model are all split.
+    :return: array of the count indexed by size
     """
 
-    total_member_count = segment_manager.get_member_count()
+    keep_counts = np.zeros(len(wcf_model) + 1, dtype=np.int64)
     used_member_count = 0
-    for size in range(segment_manager.get_max_segment_size(), 5, -1):  # split segments in descending order
-        segment_ids = segment_manager.get_segments_by_size(size)
+    for size in range(len(wcf_model), 5, -1):
         available_member_count = total_member_count * (1 - wcf_model[size - 1]) - used_member_count
         assert available_member_count >= 0
         keep_segment_count = math.floor(available_member_count / size)
-        split_segment_count = len(segment_ids) - keep_segment_count
-
+        keep_counts[size] = keep_segment_count
         used_member_count += size * keep_segment_count
+    return keep_counts
+
+
+def fit(segment_manager, wcf_model, rng):
+    """
+    update SegmentManager to follow wcf_model.
+    sizes are visited in descending order, but only the ones with segments, using a heap of sizes.
+    all segments to split of a size are split at once.
+    :param rng: np.random.Generator to choose segments and split points
+    """
+
+    keep_counts = calc_keep_counts(wcf_model, segment_manager.get_member_count())
+    queued_sizes = set(size for size, segment_ids in segment_manager.size2segments.items()
+                       if size > 5 and len(segment_ids) > 0)
+    size_heap = [-size for size in queued_sizes]
+    heapq.heapify(size_heap)
+    while len(size_heap) > 0:
+        size = -heapq.heappop(size_heap)
+        segment_ids = np.sort(np.fromiter(segment_manager.get_segments_by_size(size), dtype=np.int64))
+        keep_segment_count = keep_counts[size] if size < len(keep_counts) else 0
+        split_segment_count = len(segment_ids) - keep_segment_count
         if split_segment_count > 0:
-            for segment_id in random.sample(segment_ids, split_segment_count):
-                idx = random.randint(3, size - 3)
-                segment_manager.split(segment_id, idx)
+            split_segment_ids = rng.choice(segment_ids, split_segment_count, replace=False)
+            idxs = rng.integers(3, size - 3, size=split_segment_count, endpoint=True)
+            segment_manager.split_all(split_segment_ids, idxs)
+            for new_size in np.unique(np.concatenate([idxs, size - idxs])).tolist():
+                if new_size > 5 and new_size not in queued_sizes:
+                    queued_sizes.add(new_size)
+                    heapq.heappush(size_heap, -new_size)
     return segment_manager
 
 
-def main(clade_name, model_fp, out_fp):
-    genome_names = load_genome_names_by_clade_name(clade_name)
-    LOGGER.info("loaded {} {} genomes".format(len(genome_names), clade_name))
-    cdss = load_cdss_by_genome_names(genome_names)
-    LOGGER.info("loaded {} cdss".format(len(cdss)))
-
-    model_df = pd.read_csv(model_fp, sep='\t')
-    wcf_model = Wcf(model_df["x"], model_df["y"])
-    LOGGER.info("loaded model distribution from {}".format(model_fp))
+def build_segment_manager(cds_df):
+    """
+    :param cds_df: DataFrame of cdss, see load_cds_df_by_genome_names()
+    :return: (SegmentManager with a segment of each scaffold, array of scaffold_id of each member)
+    """
 
     segment_manager = SegmentManager()
-    scaffold2members = defaultdict(list)  # key: scaffold_id, val: list of cds_id
-    for cds in cdss:
-        scaffold2members[cds.scaffold_id].append(cds.cds_id)
-    for _, members in scaffold2members.items():
-        segment_manager.add(members)
-    assert len(segment_manager) == len(scaffold2members)
-    LOGGER.info("initialized segment manager with {} segments".format(len(segment_manager)))
+    scaffold_codes, scaffold_uniques = pd.factorize(cds_df["scaffold_id"])  # in the order of appearance
+    order = np.argsort(scaffold_codes, kind="stable")
+    members = cds_df["cds_id"].to_numpy(dtype=np.int64)[order]
+    scaffold_starts = np.searchsorted(scaffold_codes[order], np.arange(len(scaffold_uniques) + 1))
+    for start, end in zip(scaffold_starts[:-1].tolist(), scaffold_starts[1:].tolist()):
+        segment_manager.add(members[start:end])
+    assert len(segment_manager) == len(scaffold_uniques)
+    return segment_manager, cds_df["scaffold_id"].to_numpy(dtype=np.int64)[order]
+
+
+def fit_replicate(seed_seq):
+    """
+    fit a copy of the initial SegmentManager inherited by forked worker processes
+    :return: (boundaries, loss)
+    """
+
+    segment_manager = copy.deepcopy(WORKER_STATE["segment_manager"])
+    wcf_model = WORKER_STATE["wcf_model"]
+    segment_manager = fit(segment_manager, wcf_model, np.random.default_rng(seed_seq))
+    return segment_manager.get_boundaries(), calc_loss(wcf_model, segment_manager.to_wcf())
 
-    wcf_before = segment_manager.to_wcf()
-    segment_manager = fit(segment_manager, wcf_model)
-    wcf_after = segment_manager.to_wcf()
-    LOGGER.info("updated sement manager to {} segments. Fitting loss: {} -> {}".format(
-        len(segment_manager), calc_loss(wcf_model, wcf_before), calc_loss(wcf_model, wcf_after)))
 
-    scaffold_df = pd.DataFrame(list(map(lambda cds: {"cds_id": cds.cds_id, "scaffold_id": cds.scaffold_id}, cdss)))
-    segment_df = segment_manager.to_df().rename(columns={"member": "cds_id"})
-    out_df = pd.merge(scaffold_df, segment_df)
-    assert len(scaffold_df) == len(segment_df) == len(out_df)
-    out_df.to_csv(out_fp, index=False, sep='\t')
-    LOGGER.info("saved results to {}".format(out_fp))
+def iter_replicates(segment_manager, wcf_model, seed_seqs, workers=1):
+    """
+    yield (boundaries, loss) of each replicate in the order of seed_seqs.
+    results only depend on seed_seqs, regardless of the number of workers.
+    """
+
+    WORKER_STATE.update(segment_manager=segment_manager, wcf_model=wcf_model)
+    if workers <= 1:
+        yield from map(fit_replicate, seed_seqs)
+    else:
+        with multiprocessing.get_context("fork").Pool(workers) as pool:
+            yield from pool.imap(fit_replicate, seed_seqs)
+    WORKER_STATE.clear()
+
+
+def main(args):
+    out_fp = args.out_fp
+    if args.replicates and not out_fp.endswith(".npz"):  # e.g. the default .map, to which numpy appends .npz
+        out_fp = str(pathlib.Path(out_fp).with_suffix(".npz"))
+        LOGGER.warning("save replicates to {} instead of {}, as they are saved in .npz".format(out_fp, args.out_fp))
+    profiler = Profiler(enabled=args.profile_out is not None)
+    cds_df, _ = load_clade_cds_df(args.clade_name, budget=int(args.snapshot_budget * 2 ** 30), profiler=profiler)
+
+    model_df = pd.read_csv(args.model_fp, sep='\t')
+    wcf_model = Wcf(model_df["x"], model_df["y"])
+    LOGGER.info("loaded model distribution from {}".format(args.model_fp))
+
+    segment_manager, scaffold_ids = build_segment_manager(cds_df)
+    LOGGER.info("initialized segment manager with {} segments".format(len(segment_manager)))
+    loss_before = calc_loss(wcf_model, segment_manager.to_wcf())
+
+    seed_seq = np.random.SeedSequence(args.seed)
+    LOGGER.info("use seed = {}".format(seed_seq.entropy))
+    if args.replicates:
+        boundaries_lst = []
+        losses = []
+        with profiler.stage("fit"):
+            replicates_iter = iter_replicates(segment_manager, wcf_model, seed_seq.spawn(args.replicates),
+                                              workers=args.workers)
+            for replicate, (boundaries, loss) in enumerate(replicates_iter):
+                LOGGER.info("replicate {}: {} segments. Fitting loss: {} -> {}".format(
+                    replicate, len(boundaries), loss_before, loss))
+                boundaries_lst.append(boundaries)
+                losses.append(loss)
+        profiler.count("replicates", len(boundaries_lst))
+
+        with profiler.stage("output"):
+            save_replicates(out_fp, segment_manager.member_buf, scaffold_ids, boundaries_lst,
+                            seed=str(seed_seq.entropy), loss=np.array(losses))
+        LOGGER.info("saved {} replicates to {}".format(len(boundaries_lst), out_fp))
+    else:
+        with profiler.stage("fit"):
+            segment_manager = fit(segment_manager, wcf_model, np.random.default_rng(seed_seq))
+        LOGGER.info("updated sement manager to {} segments. Fitting loss: {} -> {}".format(
+            len(segment_manager), loss_before, calc_loss(wcf_model, segment_manager.to_wcf())))
+        profiler.count("segments", len(segment_manager))
+
+        with profiler.stage("output"):
+            scaffold_df = cds_df[["cds_id", "scaffold_id"]]
+            segment_df = segment_manager.to_df().rename(columns={"member": "cds_id"})
+            out_df = pd.merge(scaffold_df, segment_df)
+            assert len(scaffold_df) == len(segment_df) == len(out_df)
+            out_df.to_csv(out_fp, index=False, sep='\t')
+        LOGGER.info("saved results to {}".format(out_fp))
+
+    if args.profile_out:
+        profiler.save(args.profile_out, script="split", args=vars(args))
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, datefmt="%m/%d/%Y %I:%M:%S",
                         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    clade_name = "Enterobacterales"
-    model_fp = "./splitdata/MGII.dist"
-    out_fp = "./splitdata/00.map"
-    main(clade_name, model_fp, out_fp)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clade_name", default="Enterobacterales", help="clade_name")
+    parser.add_argument("--model_fp", default="./splitdata/MGII.dist", help="model distribution to follow")
+    parser.add_argument("--out_fp", default="./splitdata/00.map",
+                        help=".map of one segmentation, or .npz of boundaries with --replicates (.map is replaced "
+                             "with .npz)")
+    parser.add_argument("--replicates", type=int,
+                        help="number of segmentations to simulate, saved in a compact .npz "
+                             "(see splitlib.load_replicate)")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes for --replicates")
+    parser.add_argument("--seed", type=int,
+                        help="root seed, from which an independent stream of each replicate is spawned")
+    parser.add_argument("--snapshot_budget", type=float, default=SnapshotCache.BUDGET / 2 ** 30,
+                        help="disk budget in GB of clade snapshots under the clade directory, 0 to disable")
+    parser.add_argument("--profile_out", help="JSON report of wall time, cpu time and peak rss per stage")
+    args = parser.parse_args()
+    main(args)
@@ -1,89 +1,225 @@
 #!/usr/bin/env python3
 
+from array import array
 from collections import defaultdict
 
+import numpy as np
 import pandas as pd
-from scipy import stats
 
 
 class SegmentManager:
+    """
+    Segments of integer members (e.g. cds_ids of a scaffold), stored as [start, end) offsets of one global member
+    buffer.
+    members are only appended by add(), so that split() registers two new offset pairs without copying members.
+    """
+
     def __init__(self):
-        self.next_id = 0
-        self.segment2members = dict()  # key: segment_id, val: list of members
+        self.member_buf = array("q")  # global member buffer
+        self.start_buf = array("q")  # key: segment_id, val: start offset in member_buf
+        self.end_buf = array("q")  # key: segment_id, val: end offset in member_buf, or -1 for deleted segments
         self.size2segments = defaultdict(set)  # key: size, val: set of segment_ids of the size
+        self.segment_count = 0
         self.member_count = 0
 
     def __len__(self):
-        return len(self.segment2members)
+        return self.segment_count
 
-    def add(self, members):
+    @property
+    def next_id(self):
+        return len(self.start_buf)
+
+    def register(self, start, end):
         segment_id = self.next_id
-        size = len(members)
-        self.next_id += 1
-        self.segment2members[segment_id] = members
+        size = end - start
+        self.start_buf.append(start)
+        self.end_buf.append(end)
         self.size2segments[size].add(segment_id)
+        self.segment_count += 1
         self.member_count += size
         return segment_id
 
+    def add(self, members):
+        start = len(self.member_buf)
+        self.member_buf.extend(members)
+        return self.register(start, len(self.member_buf))
+
+    def get_offsets_by_id(self, segment_id):
+        end = self.end_buf[segment_id]
+        if end < 0:
+            raise KeyError(segment_id)
+        return self.start_buf[segment_id], end
+
     def delete(self, segment_id):
-        size = len(self.segment2members[segment_id])
-        del self.segment2members[segment_id]
+        start, end = self.get_offsets_by_id(segment_id)
+        size = end - start
+        self.end_buf[segment_id] = -1
         self.size2segments[size].remove(segment_id)
+        self.segment_count -= 1
         self.member_count -= size
 
     def split(self, segment_id, idx):
-        members = self.get_members_by_id(segment_id)
+        start, end = self.get_offsets_by_id(segment_id)
+        mid = range(start, end)[:idx].stop  # clip idx as members[:idx] does
         self.delete(segment_id)
-        segment_id1 = self.add(members[:idx])
-        segment_id2 = self.add(members[idx:])
+        segment_id1 = self.register(start, mid)
+        segment_id2 = self.register(mid, end)
         return segment_id1, segment_id2
 
+    def split_all(self, segment_ids, idxs):
+        """
+        split segments at once, same as split() of each pair of segment_id and idx
+        :param segment_ids: array of distinct existing segment_ids
+        :param idxs: array of split points in [0, size] of each segment
+        :return: (array of segment_id1, array of segment_id2)
+        """
+
+        segment_ids = np.asarray(segment_ids, dtype=np.int64)
+        if len(np.unique(segment_ids)) < len(segment_ids):
+            raise ValueError("segment_ids to split are not distinct")
+        starts = np.frombuffer(self.start_buf, dtype=np.int64)[segment_ids]
+        ends = np.frombuffer(self.end_buf, dtype=np.int64)[segment_ids]
+        if (ends < 0).any():
+            raise KeyError(int(segment_ids[ends < 0][0]))
+        mids = starts + np.clip(idxs, 0, ends - starts)
+
+        np.frombuffer(self.end_buf, dtype=np.int64)[segment_ids] = -1
+        self.update_size2segments(segment_ids, ends - starts, remove=True)
+        segment_ids1 = self.next_id + np.arange(len(segment_ids))
+        segment_ids2 = segment_ids1 + len(segment_ids)
+        self.start_buf.frombytes(np.concatenate([starts, mids]).tobytes())
+        self.end_buf.frombytes(np.concatenate([mids, ends]).tobytes())
+        self.update_size2segments(segment_ids1, mids - starts)
+        self.update_size2segments(segment_ids2, ends - mids)
+        self.segment_count += len(segment_ids)
+        return segment_ids1, segment_ids2
+
+    def update_size2segments(self, segment_ids, sizes, remove=False):
+        order = np.argsort(sizes, kind="stable")
+        unique_sizes, size_starts = np.unique(sizes[order], return_index=True)
+        for size, ids in zip(unique_sizes.tolist(), np.split(segment_ids[order], size_starts[1:])):
+            if remove:
+                self.size2segments[size].difference_update(ids.tolist())
+            else:
+                self.size2segments[size].update(ids.tolist())
+
     def get_members_by_id(self, segment_id):
-        return self.segment2members[segment_id]
+        start, end = self.get_offsets_by_id(segment_id)
+        return self.member_buf[start:end].tolist()
 
     def get_segments_by_size(self, size):
         return self.size2segments[size]
 
     def get_max_segment_size(self):
-        return max(self.size2segments.keys())
+        return max(size for size, segment_ids in self.size2segments.items() if len(segment_ids) > 0)
 
     def get_segment_count(self):
-        return len(self.segment2members)
+        return self.segment_count
 
     def get_member_count(self):
         return self.member_count
 
+    def get_segment_arrays(self):
+        """
+        :return: (segment_ids, starts, sizes) of existing segments in the ascending order of segment_id
+        """
+
+        end_arr = np.frombuffer(self.end_buf, dtype=np.int64).copy()
+        segment_ids = np.nonzero(end_arr >= 0)[0]
+        starts = np.frombuffer(self.start_buf, dtype=np.int64)[segment_ids]
+        sizes = end_arr[segment_ids] - starts
+        return segment_ids, starts, sizes
+
+    def get_boundaries(self):
+        """
+        start offsets of existing non-empty segments in ascending order.
+        as long as segments tile the member buffer (i.e. only add() and split() are used), they describe the
+        segmentation.
+        """
+
+        _, starts, sizes = self.get_segment_arrays()
+        return np.sort(starts[sizes > 0])
+
     def to_wcf(self):
-        x = []
-        y = []
-        for size, segment_ids in self.size2segments.items():
-            if len(segment_ids) > 0:
-                x.append(size)
-                y.append(len(segment_ids))
-        wcf = Wcf(x, y)
+        _, _, sizes = self.get_segment_arrays()
+        counts = np.bincount(sizes)
+        x = np.nonzero(counts)[0]
+        wcf = Wcf(x, counts[x])
         return wcf
 
     def to_df(self):
-        if len(self.segment2members) == 0:
+        if self.segment_count == 0:
             return pd.DataFrame(columns=["segment_id", "member"])
 
-        records = []
-        for segment_id, members in self.segment2members.items():
-            records += [{"segment_id": segment_id, "member": m} for m in members]
-        df = pd.DataFrame(records, columns=["segment_id", "member"])
+        segment_ids, starts, sizes = self.get_segment_arrays()
+        offsets = np.cumsum(sizes) - sizes  # offsets of each segment in the output
+        member_idxs = np.repeat(starts - offsets, sizes) + np.arange(sizes.sum())
+        df = pd.DataFrame({
+            "segment_id": np.repeat(segment_ids, sizes),
+            "member": np.frombuffer(self.member_buf, dtype=np.int64)[member_idxs]
+        }, columns=["segment_id", "member"])
         return df
 
 
+def boundaries_to_segment_ids(boundaries, member_count):
+    """
+    :return: array of segment_id of each member, where segments are numbered in the order of the member buffer
+    """
+
+    marker_arr = np.zeros(member_count, dtype=np.int64)
+    marker_arr[boundaries] = 1
+    return np.cumsum(marker_arr) - 1
+
+
+def save_replicates(fp, members, scaffold_ids, boundaries_lst, **meta):
+    """
+    save replicates of segmentation in a compact form, where members and scaffold_ids are shared among replicates
+    and each replicate only keeps its boundaries.
+    :param members: member buffer of SegmentManager (i.e. cds_ids)
+    :param scaffold_ids: scaffold_id of each member
+    :param boundaries_lst: list of SegmentManager.get_boundaries() of each replicate
+    :param meta: additional arrays to save (e.g. seed, loss)
+    :raise ValueError: unless fp ends with .npz, to which numpy would append .npz
+    """
+
+    if not str(fp).endswith(".npz"):
+        raise ValueError("replicates must be saved to .npz, but got {}".format(fp))
+    replicate_starts = np.cumsum([0] + [len(boundaries) for boundaries in boundaries_lst])
+    np.savez_compressed(fp, members=np.asarray(members, dtype=np.int64), scaffold_ids=np.asarray(scaffold_ids),
+                        boundaries=np.concatenate(boundaries_lst).astype(np.int64),
+                        replicate_starts=replicate_starts, **meta)
+
+
+def load_replicate(fp, replicate):
+    """
+    :return: DataFrame with cds_id, scaffold_id and segment_id of the replicate, as written by split.py
+    """
+
+    with np.load(fp) as data:
+        replicate_starts = data["replicate_starts"]
+        if not 0 <= replicate < len(replicate_starts) - 1:
+            raise IndexError("replicate = {} is out of {} replicates in {}".format(
+                replicate, len(replicate_starts) - 1, fp))
+        boundaries = data["boundaries"][replicate_starts[replicate]:replicate_starts[replicate + 1]]
+        df = pd.DataFrame({
+            "cds_id": data["members"],
+            "scaffold_id": data["scaffold_ids"],
+            "segment_id": boundaries_to_segment_ids(boundaries, len(data["members"]))
+        })
+    return df
+
+
 class Wcf:
     """
-    weighted cumlative frequencies
+    weighted cumlative frequencies, i.e. wcf[k] is the fraction of members in segments of size <= k
     """
 
     def __init__(self, x, y):
         assert len(x) == len(y)
-        weights = [x * y for x, y in zip(x, y)]
-        res = stats.cumfreq(x, numbins=max(x) + 1, defaultreallimits=(0, max(x) + 1), weights=weights)
-        self.wcf = res.cumcount / res.cumcount[-1]
+        x = np.asarray(x, dtype=np.int64)
+        weight_arr = np.bincount(x, weights=x * np.asarray(y, dtype=np.float64), minlength=x.max() + 1)
+        cumcount = np.cumsum(weight_arr)
+        self.wcf = cumcount / cumcount[-1]
 
     def __getitem__(self, key):
         if key < len(self.wcf):
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import pathlib
+import tempfile
+import unittest
+
+from checkpointlib import Checkpoint
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.tmp_direc = tempfile.TemporaryDirectory()
+        self.direc = pathlib.Path(self.tmp_direc.name).joinpath("shards")
+        self.out_fp = str(pathlib.Path(self.tmp_direc.name).joinpath("out.tsv"))
+
+    def tearDown(self):
+        self.tmp_direc.cleanup()
+
+    def read_out(self):
+        with open(self.out_fp, 'r') as f:
+            return f.read()
+
+    def test_merge(self):
+        checkpoint = Checkpoint(self.direc)
+        checkpoint.append("b", "b\t2\n")
+        checkpoint.append("a", "a\t1\n")
+        checkpoint.append("c", "")
+        self.assertEqual(len(checkpoint), 3)
+        checkpoint.merge(["a", "b", "c"], self.out_fp, header="key\tval\n")
+        self.assertEqual(self.read_out(), "key\tval\na\t1\nb\t2\n")
+        with self.assertRaises(KeyError):
+            checkpoint.merge(["a", "d"], self.out_fp)
+
+    def test_resume(self):
+        checkpoint = Checkpoint(self.direc)
+        checkpoint.append("a", "a\t1\n")
+        with open(str(checkpoint.shard_fp), 'a') as f:
+            f.write("b\t")  # crashed while writing b
+        with open(str(checkpoint.manifest_fp), 'a') as f:
+            f.write("b\tshard")
+
+        checkpoint = Checkpoint(self.direc, resume=True)
+        self.assertIn("a", checkpoint)
+        self.assertNotIn("b", checkpoint)
+        checkpoint.append("b", "b\t2\n")
+        checkpoint.merge(["a", "b"], self.out_fp)
+        self.assertEqual(self.read_out(), "a\t1\nb\t2\n")
+
+        checkpoint = Checkpoint(self.direc, resume=True)
+        self.assertEqual(len(checkpoint), 2)
+
+        checkpoint = Checkpoint(self.direc)
+        self.assertEqual(len(checkpoint), 0)
+        checkpoint.remove()
+        self.assertFalse(self.direc.exists())
+
+    def test_params(self):
+        params = {"score_method": "naive", "columns": ("x", "y")}
+        checkpoint = Checkpoint(self.direc, params=params)
+        checkpoint.append("a", "a\t1\n")
+        self.assertEqual(len(Checkpoint(self.direc, resume=True, params=params)), 1)  # tuples are read as lists
+        with self.assertRaises(ValueError):
+            Checkpoint(self.direc, resume=True, params=dict(params, score_method="independent"))
+        checkpoint = Checkpoint(self.direc, params=dict(params, score_method="independent"))  # discards old results
+        self.assertEqual(len(checkpoint), 0)
+
+    def test_unrelated_files(self):
+        self.direc.mkdir()
+        other_fp = self.direc.joinpath("other.txt")
+        other_fp.write_text("not a shard")
+        checkpoint = Checkpoint(self.direc)
+        checkpoint.append("a", "a\t1\n")
+        checkpoint = Checkpoint(self.direc)  # start over
+        self.assertEqual(len(checkpoint), 0)
+        checkpoint.append("a", "a\t1\n")
+        checkpoint.remove()
+        self.assertEqual(list(self.direc.iterdir()), [other_fp])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
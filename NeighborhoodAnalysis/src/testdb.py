@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+import multiprocessing
+import pathlib
+import sqlite3
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+ROOT_PATH = pathlib.Path().joinpath('../../').resolve()
+sys.path.append(str(ROOT_PATH))
+sys.path.append(str(ROOT_PATH.joinpath("DB/init")))
+from mylib.db import (ColumnarCdsDAO, IDManager, NameIndex, get_engine, get_connection, dispose_engines,
+                       load_cds_df_by_genome_names)
+from neighborlib import set_gene_name_to_cds_df
+from testneighborlib import build_cdss
+
+
+def build_db(db_fp):
+    con = sqlite3.connect(str(db_fp))
+    con.executescript(ROOT_PATH.joinpath("DB/init/schema.sql").read_text())
+    con.executescript(ROOT_PATH.joinpath("DB/clades/schema.sql").read_text())
+    con.executescript(ROOT_PATH.joinpath("DB/references/schema.sql").read_text())
+    con.close()
+
+
+class TestEngine(unittest.TestCase):
+    def setUp(self):
+        self.tmp_direc = tempfile.TemporaryDirectory()
+        self.db_fp = pathlib.Path(self.tmp_direc.name).joinpath("test.db")
+        build_db(self.db_fp)
+
+    def tearDown(self):
+        dispose_engines()
+        self.tmp_direc.cleanup()
+
+    def test_cache(self):
+        self.assertIs(get_engine(self.db_fp), get_engine(str(self.db_fp)))
+        self.assertIsNot(get_engine(self.db_fp), get_engine(self.db_fp, profile="write"))
+        self.assertIsNot(get_engine(self.db_fp), get_engine(self.db_fp, mmap_size=0))
+
+        con = get_connection(self.db_fp)
+        dbapi_con = con.connection.dbapi_connection
+        con.close()
+        con = get_connection(self.db_fp)
+        self.assertIs(con.connection.dbapi_connection, dbapi_con)  # reused from the pool
+        con.close()
+
+    def test_pragmas(self):
+        with get_connection(self.db_fp) as con:
+            self.assertEqual(con.execute(text("PRAGMA query_only;")).scalar(), 1)
+            self.assertEqual(con.execute(text("PRAGMA temp_store;")).scalar(), 2)  # MEMORY
+            with self.assertRaises(Exception):
+                con.execute(text("INSERT INTO projects VALUES (1, 'project');"))
+        with get_connection(self.db_fp, profile="write") as con:
+            self.assertEqual(con.execute(text("PRAGMA query_only;")).scalar(), 0)
+            self.assertEqual(con.execute(text("PRAGMA synchronous;")).scalar(), 0)
+            con.execute(text("INSERT INTO projects VALUES (1, 'project');"))
+            con.commit()
+        with get_connection(self.db_fp) as con:
+            self.assertEqual(con.execute(text("SELECT COUNT(*) FROM projects;")).scalar(), 1)
+
+
+def reserve_ids(db_fp):
+    manager = IDManager("cdss", fp=db_fp, block_size=7)
+    return [manager.new() for _ in range(50)]
+
+
+class TestIDManager(unittest.TestCase):
+    def setUp(self):
+        self.tmp_direc = tempfile.TemporaryDirectory()
+        self.db_fp = pathlib.Path(self.tmp_direc.name).joinpath("test.db")
+        build_db(self.db_fp)
+        con = sqlite3.connect(str(self.db_fp))
+        con.execute("INSERT INTO projects VALUES (41, 'project');")
+        con.commit()
+        con.close()
+
+    def tearDown(self):
+        self.tmp_direc.cleanup()
+
+    def test_reserve(self):
+        manager = IDManager("projects", fp=self.db_fp)
+        self.assertEqual(manager.reserve(3), range(42, 45))  # seeded from MAX(project_id)
+        self.assertEqual(IDManager("projects", fp=self.db_fp).reserve(2), range(45, 47))
+        self.assertEqual(IDManager("genomes", fp=self.db_fp).reserve(2), range(1, 3))
+
+    def test_new(self):
+        manager = IDManager("projects", fp=self.db_fp, block_size=2)
+        self.assertEqual(manager.get(), 0)
+        self.assertEqual([manager.new() for _ in range(3)], [42, 43, 44])
+        self.assertEqual(manager.get(), 44)
+        self.assertEqual(IDManager("projects", fp=self.db_fp).new(), 46)  # 45 is kept by the second block
+
+    def test_new_low_volume(self):
+        self.assertEqual([IDManager("genomes", fp=self.db_fp).new() for _ in range(3)], [1, 2, 3])  # without holes
+        self.assertEqual(IDManager("cdss", fp=self.db_fp).block_size, IDManager.BLOCK_SIZE)
+
+    def test_concurrent(self):
+        with multiprocessing.Pool(4) as pool:
+            id_lsts = pool.map(reserve_ids, [self.db_fp] * 4)
+        ids = [id_ for id_lst in id_lsts for id_ in id_lst]
+        self.assertEqual(len(set(ids)), len(ids))
+        for id_lst in id_lsts:
+            self.assertEqual(id_lst, sorted(id_lst))
+
+
+class TestNameIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_direc = tempfile.TemporaryDirectory()
+        self.db_fp = pathlib.Path(self.tmp_direc.name).joinpath("test.db")
+        build_db(self.db_fp)
+        self.insert_refseqs([(refseq_id, "WP_{:06d}.1".format(refseq_id)) for refseq_id in range(1, 1001)])
+
+    def tearDown(self):
+        dispose_engines()
+        self.tmp_direc.cleanup()
+
+    def insert_refseqs(self, records):
+        con = sqlite3.connect(str(self.db_fp))
+        con.executemany("INSERT INTO refseqs (refseq_id, refseq_name) VALUES (?, ?);", records)
+        con.commit()
+        con.close()
+
+    def test_lookup(self):
+        index = NameIndex.load("refseqs", fp=self.db_fp)
+        self.assertEqual(len(index), 1000)
+        self.assertIsInstance(index.hashes, np.memmap)
+        names = pd.Series(["WP_000010.1", "missing", "WP_001000.1", "WP_000001.1"])
+        self.assertEqual(index.lookup(names).tolist(), [10, -1, 1000, 1])
+        self.assertEqual(index.lookup([]).tolist(), [])
+
+    def test_rebuild(self):
+        npy_fp = NameIndex.build_filepath("refseqs", fp=self.db_fp)
+        NameIndex.load("refseqs", fp=self.db_fp)
+        mtime = npy_fp.stat().st_mtime_ns
+        NameIndex.load("refseqs", fp=self.db_fp)
+        self.assertEqual(npy_fp.stat().st_mtime_ns, mtime)  # reused
+
+        self.insert_refseqs([(1001, "new")])
+        index = NameIndex.load("refseqs", fp=self.db_fp)
+        self.assertEqual(index.lookup(["new", "WP_000002.1"]).tolist(), [1001, 2])
+
+        con = sqlite3.connect(str(self.db_fp))
+        con.execute("DELETE FROM refseqs WHERE refseq_id = 1001;")
+        con.commit()
+        con.close()
+        index = NameIndex.load("refseqs", fp=self.db_fp)
+        self.assertEqual(index.lookup(["new", "WP_001000.1"]).tolist(), [-1, 1000])
+
+        mtime = npy_fp.stat().st_mtime_ns
+        reloaded_id, = IDManager("refseqs", fp=self.db_fp).reserve(1)  # reserved by a loader, not inserted yet
+        self.insert_refseqs([(reloaded_id, "reloaded")])
+        con = sqlite3.connect(str(self.db_fp))
+        con.execute("UPDATE refseqs SET refseq_name = 'renamed' WHERE refseq_id = 1000;")  # not detected by itself
+        con.commit()
+        con.close()
+        index = NameIndex.load("refseqs", fp=self.db_fp)
+        self.assertNotEqual(npy_fp.stat().st_mtime_ns, mtime)
+        self.assertEqual(index.lookup(["reloaded", "renamed"]).tolist(), [reloaded_id, 1000])
+
+        mtime = npy_fp.stat().st_mtime_ns
+        IDManager("refseqs", fp=self.db_fp).reserve(1)  # same MAX(rowid), new next_id
+        NameIndex.load("refseqs", fp=self.db_fp)
+        self.assertNotEqual(npy_fp.stat().st_mtime_ns, mtime)
+        self.assertEqual(sorted(path.name for path in npy_fp.parent.iterdir()), ["refseqs.npy"])
+
+    def test_empty(self):
+        con = sqlite3.connect(str(self.db_fp))
+        con.execute("DELETE FROM refseqs;")
+        con.commit()
+        con.close()
+        self.assertEqual(NameIndex.load("refseqs", fp=self.db_fp).lookup(["WP_000001.1"]).tolist(), [-1])
+
+    def test_collision(self):
+        name2hash = {"WP_000001.1": 7, "WP_000002.1": 7, "other": 7}  # fake 64-bit collisions
+        hash_names = NameIndex.hash_names
+        with mock.patch.object(NameIndex, "hash_names", staticmethod(
+                lambda names: np.array([name2hash.get(name, hash_names([name])[0]) for name in names],
+                                       dtype=np.uint64))):
+            index = NameIndex.load("refseqs", fp=self.db_fp)
+            self.assertEqual(index.collisions, {"WP_000001.1": 1, "WP_000002.1": 2})
+            self.assertEqual(index.lookup(["WP_000002.1", "WP_000001.1", "other", "WP_000003.1"]).tolist(),
+                             [2, 1, -1, 3])
+
+
+class TestLoadCdsDf(unittest.TestCase):
+    cdss = build_cdss(seed=4, genome_count=5)
+
+    def test_load(self):
+        with tempfile.TemporaryDirectory() as direc:
+            db_fp = pathlib.Path(direc).joinpath("test.db")
+            build_db(db_fp)
+            con = sqlite3.connect(str(db_fp))
+            con.executemany("INSERT INTO genomes VALUES (?, ?, ?);",
+                            [(genome_id, 0, "genome{}".format(genome_id)) for genome_id in range(5)])
+            con.executemany("INSERT INTO cdss VALUES (?, ?, ?, ?, ?, ?, ?, ?);",
+                            [(cds.cds_id, cds.genome_id, cds.scaffold_id, cds.cds_name, cds.start, cds.end,
+                              cds.length, cds.strand) for cds in reversed(self.cdss)])
+            con.commit()
+            con.close()
+
+            con = get_connection(db_fp)
+            cds_df = load_cds_df_by_genome_names(["genome4", "genome1", "genome3"], con=con, chunk_size=2)
+            expected_cdss = [cds for cds in self.cdss if cds.genome_id in (1, 3, 4)]
+            self.assertEqual(cds_df["cds_id"].tolist(), [cds.cds_id for cds in expected_cdss])
+            self.assertEqual(cds_df["cds_name"].tolist(), [cds.cds_name for cds in expected_cdss])
+            self.assertEqual(cds_df["strand"].tolist(), [cds.strand for cds in expected_cdss])
+            self.assertEqual(len(load_cds_df_by_genome_names([], con=con)), 0)
+            with self.assertRaises(KeyError):
+                load_cds_df_by_genome_names(["genome1", "genome5"], con=con)
+            con.close()
+            dispose_engines()
+
+            ortho_fp = pathlib.Path(direc).joinpath("test.ortho")
+            pd.DataFrame([(cds.cds_name, cds.gene_name) for cds in expected_cdss if cds.gene_name is not None],
+                         columns=["cds_name", "gene_name"]).to_csv(str(ortho_fp), sep='\t', index=False)
+            cdsDAO = ColumnarCdsDAO(set_gene_name_to_cds_df(cds_df, ortho_fp))
+            self.assertEqual([cdsDAO.get_cds_by_idx(idx).gene_name for idx in range(len(cdsDAO))],
+                             [cds.gene_name for cds in expected_cdss])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import pathlib
+import random
+import sys
+import tempfile
+import unittest
+
+from Bio import SeqIO
+
+ROOT_PATH = pathlib.Path().joinpath('../../').resolve()
+sys.path.append(str(ROOT_PATH))
+sys.path.append(str(ROOT_PATH.joinpath("DB/init")))
+from mylib.fasta import iter_fasta_lengths
+
+
+def build_fasta(seed=0, record_count=30):
+    rand = random.Random(seed)
+    lines = []
+    for i in range(record_count):
+        lines.append(">scaffold_{} length={} desc".format(i, i) if i % 2 else ">scaffold_{}".format(i))
+        seq = "".join(rand.choice("ACGTN") for _ in range(rand.choice([0, 1, 59, 60, 61, 1000])))
+        width = rand.choice([60, 80, 1000])
+        lines.extend(seq[start:start + width] for start in range(0, len(seq), width))
+        if rand.random() < 0.2:
+            lines.append("")
+    return lines
+
+
+class TestFasta(unittest.TestCase):
+    def assert_same_as_seqio(self, text, **kwargs):
+        with tempfile.TemporaryDirectory() as direc:
+            fasta_fp = str(pathlib.Path(direc).joinpath("test.fna"))
+            with open(fasta_fp, 'w', newline='') as f:
+                f.write(text)
+            expected = [(record.id, len(record)) for record in SeqIO.parse(fasta_fp, 'fasta')]
+            lengths = list(iter_fasta_lengths(fasta_fp, **kwargs))
+            self.assertEqual(lengths, expected)
+            self.assertTrue(all(type(length) is int for _, length in lengths))
+
+    def test_lengths(self):
+        lines = build_fasta()
+        self.assert_same_as_seqio('\n'.join(lines) + '\n')
+        self.assert_same_as_seqio('\n'.join(lines))  # no newline at the end
+        self.assert_same_as_seqio('\r\n'.join(lines) + '\r\n')
+        for chunk_size in (1, 2, 7, 61, 4096):  # headers and newlines on chunk boundaries
+            self.assert_same_as_seqio('\r\n'.join(lines) + '\r\n', chunk_size=chunk_size)
+
+    def test_edge(self):
+        self.assert_same_as_seqio("")
+        self.assert_same_as_seqio(">empty\n>header_only")
+        self.assert_same_as_seqio(">a\nAC GT\n\n>b\nA\n")
+        self.assert_same_as_seqio(">a\tdesc  x \r\nACGT \r\n>b desc\r\nA")  # whitespace in headers
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import pathlib
+import sys
+import tempfile
+import unittest
+
+ROOT_PATH = pathlib.Path().joinpath('../../').resolve()
+sys.path.append(str(ROOT_PATH))
+sys.path.append(str(ROOT_PATH.joinpath("DB/init")))
+from mylib.gff import GffRecord, find_attribute, iter_gff, parse_gff, read_gff_columns
+
+GFF_LINES = [
+    "##gff-version  3",
+    '# Sequence Data: seqnum=1;seqlen=5000;seqhdr="k141_1 flag=1"',
+    "k141_1\tProdigal_v2.6.3\tCDS\t3\t302\t48.2\t+\t0\tID=1_1;partial=00;cds_name=k141_1_1;",
+    "k141_1\tProdigal_v2.6.3\tCDS\t400\t690\t7\t-\t0\tID=1_2;partial=10;cds_name=k141_1_2;",
+    "",
+    "k141_1\tbarrnap\trRNA\t900\t2400\t.\t+\t.\tName=16S_rRNA;product=16S ribosomal RNA",
+    "k141_2\tProdigal_v2.6.3\tCDS\t10\t300\t3.5\t+\t0\tID=2_1;partial=01"
+]
+
+
+class TestGff(unittest.TestCase):
+    def setUp(self):
+        self.tmp_direc = tempfile.TemporaryDirectory()
+        self.gff_fp = str(pathlib.Path(self.tmp_direc.name).joinpath("test.gff"))
+        with open(self.gff_fp, 'w') as f:
+            f.write("\n".join(GFF_LINES) + "\n")
+
+    def tearDown(self):
+        self.tmp_direc.cleanup()
+
+    def test_record(self):
+        record = GffRecord(GFF_LINES[2])
+        self.assertFalse(hasattr(record, "__dict__"))
+        self.assertIsNone(record._attributes)  # decoded lazily
+        self.assertEqual((record.seqid, record.start, record.end, record.strand), ("k141_1", 3, 302, '+'))
+        self.assertEqual(record.score, 48.2)
+        self.assertEqual(record.get_attribute("cds_name"), "k141_1_1")
+        self.assertEqual(record.get_attribute("name", "-"), "-")
+        self.assertIsNone(record._attributes)
+        record.attributes["note"] = "x"
+        self.assertEqual(str(record), GFF_LINES[2] + "note=x;")
+
+    def test_find_attribute(self):
+        text = "ID=1_1;partial=00;xID=0;cds_name=k141_1_1"
+        self.assertEqual(find_attribute(text, "ID"), "1_1")
+        self.assertEqual(find_attribute(text, "cds_name"), "k141_1_1")
+        self.assertEqual(find_attribute("xID=0;ID=2;", "ID"), "2")
+        self.assertIsNone(find_attribute(text, "D"))
+
+    def test_iter(self):
+        records = parse_gff(self.gff_fp)
+        self.assertEqual([record.type for record in records], ["CDS", "CDS", "rRNA", "CDS"])
+        cdss = list(iter_gff(self.gff_fp, types={"CDS"}))
+        self.assertEqual([(cds.seqid, cds.start) for cds in cdss], [("k141_1", 3), ("k141_1", 400), ("k141_2", 10)])
+
+    def test_columns(self):
+        gff_df = read_gff_columns(self.gff_fp, types={"CDS"}, attributes=["cds_name", "ID"])
+        cdss = list(iter_gff(self.gff_fp, types={"CDS"}))
+        self.assertEqual(list(gff_df.columns), ["seqid", "start", "end", "strand", "cds_name", "ID"])
+        self.assertEqual(gff_df["start"].dtype, "int64")
+        self.assertEqual(list(zip(gff_df["seqid"], gff_df["start"], gff_df["end"], gff_df["strand"], gff_df["ID"])),
+                         [(cds.seqid, cds.start, cds.end, cds.strand, cds.get_attribute("ID")) for cds in cdss])
+        self.assertEqual(gff_df["cds_name"].isna().tolist(), [False, False, True])
+
+        self.assertEqual(len(read_gff_columns(self.gff_fp)), 4)
+        self.assertEqual(len(read_gff_columns(self.gff_fp, types={"tRNA"}, attributes=["ID"])), 0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import pathlib
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+ROOT_PATH = pathlib.Path().joinpath('../../').resolve()
+sys.path.append(str(ROOT_PATH))
+sys.path.append(str(ROOT_PATH.joinpath("DB/init")))
+import load_tables
+from load_tables import connect, load_project
+
+
+def write_genome(genome_direc, genome_name, cds_count=3, faa=False):
+    """
+    write .dnaseq and .gff (and .faa) of a genome with a single scaffold under genome_direc
+    """
+
+    direc = pathlib.Path(genome_direc).joinpath(genome_name)
+    direc.mkdir(exist_ok=True)
+    direc.joinpath(genome_name + ".dnaseq").write_text(">{}_s0\n{}\n".format(genome_name, "A" * 1000))
+    lines = ["{0}_s0\tProdigal\tCDS\t{1}\t{2}\t1.0\t+\t0\tcds_name={0}_{3}".format(genome_name, i * 100 + 1,
+                                                                                  i * 100 + 90, i)
+             for i in range(cds_count)]
+    direc.joinpath(genome_name + ".gff").write_text("\n".join(lines) + "\n")
+    if faa:
+        direc.joinpath(genome_name + ".faa").write_text(
+            "".join(">{}_{}\nMK\n".format(genome_name, i) for i in range(cds_count)))
+
+
+class TestLoadTables(unittest.TestCase):
+    def setUp(self):
+        self.tmp_direc = tempfile.TemporaryDirectory()
+        self.genome_direc = pathlib.Path(self.tmp_direc.name).joinpath("genome")
+        self.genome_direc.mkdir()
+        self.patcher = mock.patch("mylib.path.GENOME_DIREC", str(self.genome_direc))
+        self.patcher.start()
+        for genome_name in ["g0", "g1", "g2"]:
+            write_genome(self.genome_direc, genome_name)
+        self.db_fp = pathlib.Path(self.tmp_direc.name).joinpath("test.db")
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.tmp_direc.cleanup()
+
+    def count_rows(self, con):
+        return dict((table_name, con.execute("SELECT COUNT(*) FROM {};".format(table_name)).fetchone()[0])
+                    for table_name in ("projects", "genomes", "scaffolds", "cdss"))
+
+    def test_load(self):
+        con = connect(self.db_fp)
+        self.assertEqual(con.execute("PRAGMA journal_mode;").fetchone()[0], "memory")  # new DB
+        counts = load_project(con, "p0", ["g0", "g1"], commit_genomes=1)
+        self.assertEqual(counts, {"projects": 1, "genomes": 2, "scaffolds": 2, "cdss": 6})
+        con.close()
+
+        con = connect(self.db_fp)
+        self.assertEqual(con.execute("PRAGMA journal_mode;").fetchone()[0], "delete")  # DB with genomes
+        counts = load_project(con, "p0", ["g0", "g1"])
+        self.assertEqual(counts, {"projects": 0, "genomes": 0, "scaffolds": 0, "cdss": 0})  # re-run
+        counts = load_project(con, "p1", ["g1", "g2"])
+        self.assertEqual(counts, {"projects": 1, "genomes": 1, "scaffolds": 1, "cdss": 3})  # only g2
+        self.assertEqual(self.count_rows(con), {"projects": 2, "genomes": 3, "scaffolds": 3, "cdss": 9})
+        self.assertEqual(con.execute("SELECT genome_name, project_name FROM genomes JOIN projects USING (project_id) "
+                                     "ORDER BY genome_id;").fetchall(), [("g0", "p0"), ("g1", "p0"), ("g2", "p1")])
+        con.close()
+
+    def test_lock(self):
+        con = connect(self.db_fp)
+        iter_parsed_genomes = load_tables.iter_parsed_genomes
+
+        def iter_unlocked(genome_names, workers=1):
+            for parsed in iter_parsed_genomes(genome_names, workers):
+                self.assertFalse(con.in_transaction)  # genomes are parsed without the write lock
+                yield parsed
+
+        with mock.patch.object(load_tables, "iter_parsed_genomes", iter_unlocked):
+            load_project(con, "p0", ["g0", "g1", "g2"], commit_genomes=2)
+        self.assertEqual(self.count_rows(con)["cdss"], 9)
+        con.close()
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
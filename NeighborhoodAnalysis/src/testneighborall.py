@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import pathlib
+import sys
+import unittest
+
+from ete3 import PhyloTree
+
+ROOT_PATH = pathlib.Path().joinpath('../../').resolve()
+sys.path.append(str(ROOT_PATH))
+sys.path.append(str(ROOT_PATH.joinpath("DB/init")))
+from mylib.db import CdsDAO
+from mylib.profiler import Profiler
+from neighborlib import ArrayNeighborhoodMatrix, NeighborTable, BlsEngine, BlsCache
+from scorelib import score_batch
+from neighbor_all import THRESH, BOUND_EPS, COLUMNS, prune_candidates, iter_edges_all, get_sweep_columns, \
+    records_to_tsv
+from testneighborlib import build_cdss
+
+
+class TestPrune(unittest.TestCase):
+    cdsDAO = CdsDAO(build_cdss(seed=5, genome_count=10, gene_count=8))
+
+    def test_prune(self):
+        for score_method in ("naive", "independent"):
+            pruned_count = 0
+            for origin_gene_name in self.cdsDAO.gene_names:
+                neighbor_matrix = ArrayNeighborhoodMatrix(origin_gene_name, self.cdsDAO)
+                candidate_gene_names = sorted(neighbor_matrix.get_neighbor_gene_names())
+                neighbor_gene_names = prune_candidates(neighbor_matrix, candidate_gene_names, score_method)
+                scores = score_batch(neighbor_matrix.to_indicator_tensor(candidate_gene_names), score_method)
+                expected = [gene_name for gene_name, score in zip(candidate_gene_names, scores)
+                            if score >= THRESH["SCORE"] - BOUND_EPS]  # bounds are exact for both
+                self.assertEqual(neighbor_gene_names, expected)
+                pruned_count += len(candidate_gene_names) - len(neighbor_gene_names)
+            self.assertGreater(pruned_count, 0, score_method)
+
+
+class TestIterEdgesAll(unittest.TestCase):
+    cdsDAO = CdsDAO(build_cdss(seed=6, genome_count=8, gene_count=4))
+    tree = PhyloTree("(" + ",".join("g{}:{}".format(genome_id, genome_id + 1) for genome_id in range(8)) + ");",
+                     format=1)
+
+    def run_edges(self, score_method, workers, sweep_dist=None):
+        neighbor_table = NeighborTable(self.cdsDAO, dist=sweep_dist if sweep_dist else ArrayNeighborhoodMatrix.DIST)
+        profiler = Profiler()
+        columns = get_sweep_columns(sweep_dist) if sweep_dist else COLUMNS
+        edges_iter = iter_edges_all(self.cdsDAO.gene_names, score_method, self.cdsDAO, neighbor_table,
+                                    BlsCache(BlsEngine(self.tree)), workers=workers, sweep_dist=sweep_dist,
+                                    profiler=profiler)
+        return "".join(records_to_tsv(records, columns) for records in edges_iter), profiler.counters
+
+    def test_workers(self):
+        for sweep_dist in (None, 3):
+            record_count = 0
+            for score_method in ("naive", "independent", "conditional"):
+                expected_tsv, expected_counters = self.run_edges(score_method, 1, sweep_dist)
+                tsv, counters = self.run_edges(score_method, 3, sweep_dist)
+                self.assertEqual(tsv, expected_tsv, (score_method, sweep_dist))
+                self.assertEqual(counters, expected_counters)
+                record_count += expected_counters["records"]
+            self.assertGreater(record_count, 0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+import pathlib
+import random
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from ete3 import PhyloTree
+
+ROOT_PATH = pathlib.Path().joinpath('../../').resolve()
+sys.path.append(str(ROOT_PATH))
+sys.path.append(str(ROOT_PATH.joinpath("DB/init")))
+from mylib.db import Cds, CdsDAO, ColumnarCdsDAO
+from neighborlib import NeighborhoodMatrix, ArrayNeighborhoodMatrix, NeighborTable, BlsEngine, BlsCache, calc_bls, \
+    load_segment_ids
+
+
+def build_cdss(seed=0, genome_count=3, scaffold_count=4, gene_count=6):
+    """
+    build random cdss with gene_name, where cds_id is contiguous within a scaffold
+    """
+
+    rand = random.Random(seed)
+    cdss = []
+    cds_id = 0
+    scaffold_id = 0
+    for genome_id in range(genome_count):
+        for _ in range(scaffold_count):
+            scaffold_id += 1
+            for k in range(rand.randint(1, 15)):
+                cds_id += 1
+                cds = Cds(cds_id=cds_id, genome_id=genome_id, scaffold_id=scaffold_id,
+                          cds_name="g{}-s{}_{}".format(genome_id, scaffold_id, k),
+                          start=k * 100, end=k * 100 + 90, length=91, strand=rand.choice("+-"))
+                cds.gene_name = rand.choice(["OG{}".format(i) for i in range(gene_count)] + [None])
+                cdss.append(cds)
+        cds_id += 10  # gap between genomes
+    return cdss
+
+
+class TestColumnarCdsDAO(unittest.TestCase):
+    cdss = build_cdss(seed=3)
+
+    def build_cds_df(self):
+        return pd.DataFrame([(cds.cds_id, cds.genome_id, cds.scaffold_id, cds.cds_name, cds.start, cds.end,
+                              cds.length, cds.strand, cds.gene_name) for cds in self.cdss],
+                            columns=["cds_id", "genome_id", "scaffold_id", "cds_name", "start", "end", "length",
+                                     "strand", "gene_name"])
+
+    @staticmethod
+    def to_tuple(cds):
+        if cds is None:
+            return None
+        return (cds.cds_id, cds.genome_id, cds.scaffold_id, cds.cds_name, cds.start, cds.end, cds.length, cds.strand,
+                cds.gene_name)
+
+    def find_neighbor_cds(self, origin_cds, offset):
+        neighbor_cds_id = origin_cds.cds_id + offset if origin_cds.strand == '+' else origin_cds.cds_id - offset
+        for cds in self.cdss:
+            if cds.cds_id == neighbor_cds_id and cds.scaffold_id == origin_cds.scaffold_id:
+                return cds
+        return None
+
+    def test_lookup(self):
+        for cdsDAO in (ColumnarCdsDAO(self.build_cds_df()), CdsDAO(self.cdss)):
+            self.assertEqual(cdsDAO.gene_names, sorted(set(cds.gene_name for cds in self.cdss) - {None}))
+            for idx, cds in enumerate(self.cdss):
+                for actual in (cdsDAO.get_cds_by_idx(idx), cdsDAO.get_cds_by_cds_id(cds.cds_id),
+                               cdsDAO.get_cds_by_cds_name(cds.cds_name)):
+                    self.assertEqual(self.to_tuple(actual), self.to_tuple(cds))
+            for gene_name in cdsDAO.gene_names + [None]:
+                expected_idxs = [idx for idx, cds in enumerate(self.cdss) if cds.gene_name == gene_name]
+                self.assertEqual(cdsDAO.get_idxs_by_gene_name(gene_name).tolist(), expected_idxs)
+                self.assertEqual([cds.cds_id for cds in cdsDAO.get_cdss_by_gene_name(gene_name)],
+                                 [self.cdss[idx].cds_id for idx in expected_idxs])
+            self.assertEqual(len(cdsDAO.get_idxs_by_gene_name("unknown")), 0)
+            self.assertIsNone(cdsDAO.get_cds_by_cds_id(-1))
+            self.assertIsNone(cdsDAO.get_cds_by_cds_name("unknown"))
+            self.assertIsNone(cdsDAO.get_cds_by_idx(len(self.cdss)))
+
+    def test_duplicated_name(self):
+        cds_df = self.build_cds_df()
+        cds_df.loc[[3, 9], "cds_name"] = "k141_1_1"  # cds_name can repeat across genomes
+        cdss = [Cds(**row) for row in cds_df.drop(columns="gene_name").to_dict("records")]
+        for cdsDAO in (ColumnarCdsDAO(cds_df), CdsDAO(cdss)):
+            self.assertEqual(cdsDAO.get_cds_by_cds_name("k141_1_1").cds_id, cds_df["cds_id"][9])
+            self.assertEqual(cdsDAO.get_cds_by_cds_name(self.cdss[4].cds_name).cds_id, self.cdss[4].cds_id)
+
+    def test_neighbor(self):
+        for cdsDAO in (ColumnarCdsDAO(self.build_cds_df()), CdsDAO(self.cdss)):
+            idxs = np.arange(len(self.cdss))
+            for offset in range(-3, 4):
+                neighbor_idxs = cdsDAO.get_neighbor_idxs(idxs, offset)
+                for idx, neighbor_idx in zip(idxs, neighbor_idxs):
+                    expected = self.find_neighbor_cds(self.cdss[idx], offset)
+                    actual = cdsDAO.get_neighbor_cds(self.cdss[idx], offset)
+                    self.assertEqual(self.to_tuple(actual), self.to_tuple(expected))
+                    self.assertEqual(neighbor_idx, -1 if expected is None else self.cdss.index(expected))
+
+
+class TestArrayNeighborhoodMatrix(unittest.TestCase):
+    cdsDAO = CdsDAO(build_cdss())
+
+    def assertPositionsEqual(self, positions1, positions2):
+        def to_tuple(pos):
+            if pos is None:
+                return None
+            return pos.i, pos.j, pos.offset, pos.is_forward, pos.origin_name, pos.cds_name, pos.gene_name
+
+        self.assertEqual(list(map(to_tuple, positions1)), list(map(to_tuple, positions2)))
+
+    def test_compatibility(self):
+        for origin_gene_name in self.cdsDAO.gene_names:
+            expected = NeighborhoodMatrix(origin_gene_name, self.cdsDAO)
+            actual = ArrayNeighborhoodMatrix(origin_gene_name, self.cdsDAO)
+            self.assertEqual(actual.shape, expected.shape)
+            self.assertEqual(actual.get_neighbor_gene_names(), expected.get_neighbor_gene_names())
+            for offset in range(-actual.DIST, actual.DIST + 1):
+                self.assertEqual(actual.get_count_by_offset(offset), expected.get_count_by_offset(offset))
+                self.assertPositionsEqual(actual.get_positions_by_offset(offset),
+                                          expected.get_positions_by_offset(offset))
+            for gene_name in self.cdsDAO.gene_names + [None, "unknown"]:
+                self.assertPositionsEqual(actual.get_positions_by_gene_name(gene_name),
+                                          expected.get_positions_by_gene_name(gene_name))
+                np.testing.assert_array_equal(actual.to_indicator_matrix(gene_name),
+                                              expected.to_indicator_matrix(gene_name))
+
+    def test_count_genes(self):
+        gene_names = self.cdsDAO.gene_names + ["unknown"]
+        for origin_gene_name in self.cdsDAO.gene_names:
+            neighbor_matrix = ArrayNeighborhoodMatrix(origin_gene_name, self.cdsDAO)
+            indicator_tensor = neighbor_matrix.to_indicator_tensor(gene_names)
+            row_counts, col_counts = neighbor_matrix.count_genes(gene_names)
+            np.testing.assert_array_equal(row_counts, (indicator_tensor == 1).any(axis=2).sum(axis=1))
+            np.testing.assert_array_equal(col_counts, (indicator_tensor == 1).sum(axis=1))
+
+    def test_indicator_tensor(self):
+        gene_names = self.cdsDAO.gene_names + [None, "unknown"]
+        for origin_gene_name in self.cdsDAO.gene_names:
+            neighbor_matrix = ArrayNeighborhoodMatrix(origin_gene_name, self.cdsDAO)
+            indicator_tensor = neighbor_matrix.to_indicator_tensor(gene_names)
+            self.assertEqual(indicator_tensor.shape, (len(gene_names),) + neighbor_matrix.shape)
+            for gene_name, indicator_matrix in zip(gene_names, indicator_tensor):
+                np.testing.assert_array_equal(indicator_matrix, neighbor_matrix.to_indicator_matrix(gene_name))
+
+
+class TestNeighborTable(unittest.TestCase):
+    cdsDAO = CdsDAO(build_cdss(seed=1))
+
+    def test_matrix(self):
+        neighbor_table = NeighborTable(self.cdsDAO)
+        for origin_gene_name in self.cdsDAO.gene_names:
+            expected = ArrayNeighborhoodMatrix(origin_gene_name, self.cdsDAO)
+            actual = ArrayNeighborhoodMatrix(origin_gene_name, self.cdsDAO, neighbor_table)
+            np.testing.assert_array_equal(actual.neighbor_idx_arr, expected.neighbor_idx_arr)
+            np.testing.assert_array_equal(actual.forward_arr, expected.forward_arr)
+            np.testing.assert_array_equal(actual.gene_arr, expected.gene_arr)
+
+    def test_window_slice(self):
+        neighbor_table = NeighborTable(self.cdsDAO, dist=7)
+        for origin_gene_name in self.cdsDAO.gene_names:
+            wide_matrix = ArrayNeighborhoodMatrix(origin_gene_name, self.cdsDAO, neighbor_table, dist=7)
+            for dist in range(0, 8):
+                matrix = ArrayNeighborhoodMatrix(origin_gene_name, self.cdsDAO, dist=dist)
+                tensor = matrix.to_indicator_tensor(self.cdsDAO.gene_names)
+                wide_tensor = wide_matrix.to_indicator_tensor(self.cdsDAO.gene_names)
+                np.testing.assert_array_equal(wide_tensor[:, :, wide_matrix.get_window_slice(dist)], tensor)
+
+    def test_columns(self):
+        neighbor_table = NeighborTable(self.cdsDAO, dist=2)
+        self.assertEqual(neighbor_table.gene_starts[-1], len(neighbor_table))
+        self.assertTrue((np.abs(neighbor_table.offset_arr) <= 2).all())
+        origin_msk = neighbor_table.offset_arr == 0  # origin cds itself
+        self.assertEqual(origin_msk.sum(), (self.cdsDAO.gene_codes >= 0).sum())
+        np.testing.assert_array_equal(neighbor_table.neighbor_gene_arr[origin_msk],
+                                      neighbor_table.origin_gene_arr[origin_msk])
+        self.assertTrue(neighbor_table.forward_arr[origin_msk].all())
+
+    def test_wide_dist(self):
+        cdss = build_cdss(seed=4, genome_count=1, scaffold_count=30)
+        for cds in cdss:
+            cds.scaffold_id = 1  # a scaffold longer than 2 * dist
+        cdsDAO = CdsDAO(cdss)
+        neighbor_table = NeighborTable(cdsDAO, dist=150)
+        self.assertEqual(neighbor_table.offset_arr.max(), 150)
+        for origin_gene_name in cdsDAO.gene_names:
+            expected = ArrayNeighborhoodMatrix(origin_gene_name, cdsDAO, dist=150)
+            actual = ArrayNeighborhoodMatrix(origin_gene_name, cdsDAO, neighbor_table, dist=150)
+            np.testing.assert_array_equal(actual.gene_arr, expected.gene_arr)
+
+
+class TestSegmentation(unittest.TestCase):
+    cdss = build_cdss(seed=2)
+
+    def build_segment_ids(self):
+        """
+        split each scaffold at random points, numbering segments by the order of cdss
+        """
+
+        rand = random.Random(0)
+        segment_ids = []
+        segment_id = 0
+        for k, cds in enumerate(self.cdss):
+            if k > 0 and (cds.scaffold_id != self.cdss[k - 1].scaffold_id or rand.random() < 0.3):
+                segment_id += 1
+            segment_ids.append(segment_id)
+        return segment_ids
+
+    def test_overlay(self):
+        segment_ids = self.build_segment_ids()
+        cdsDAO = CdsDAO(self.cdss, segment_ids)
+        expected_cdss = build_cdss(seed=2)  # cdss of the same content, whose scaffold_id is overwritten
+        for cds, segment_id in zip(expected_cdss, segment_ids):
+            cds.scaffold_id = segment_id
+        expected_cdsDAO = CdsDAO(expected_cdss)
+
+        neighbor_table = NeighborTable(cdsDAO)
+        for origin_gene_name in cdsDAO.gene_names:
+            expected = NeighborhoodMatrix(origin_gene_name, expected_cdsDAO)
+            for actual in (ArrayNeighborhoodMatrix(origin_gene_name, cdsDAO),
+                           ArrayNeighborhoodMatrix(origin_gene_name, cdsDAO, neighbor_table)):
+                for gene_name in cdsDAO.gene_names:
+                    np.testing.assert_array_equal(actual.to_indicator_matrix(gene_name),
+                                                  expected.to_indicator_matrix(gene_name))
+        self.assertEqual([cds.scaffold_id for cds in self.cdss], [cds.scaffold_id for cds in build_cdss(seed=2)])
+
+        cdsDAO.set_segment_ids(None)
+        np.testing.assert_array_equal(NeighborTable(cdsDAO).neighbor_idx_arr,
+                                      NeighborTable(CdsDAO(self.cdss)).neighbor_idx_arr)
+        with self.assertRaises(ValueError):
+            cdsDAO.set_segment_ids(segment_ids[1:])
+
+    def test_load_segment_ids(self):
+        cdsDAO = CdsDAO(self.cdss)
+        segment_ids = self.build_segment_ids()
+        split_df = pd.DataFrame({"cds_id": cdsDAO.cds_ids, "segment_id": segment_ids})[::-1]
+        with tempfile.NamedTemporaryFile(suffix=".map") as f:
+            split_df.to_csv(f.name, sep='\t', index=False)
+            np.testing.assert_array_equal(load_segment_ids(f.name, cdsDAO), segment_ids)
+            split_df[1:].to_csv(f.name, sep='\t', index=False)
+            with self.assertRaises(KeyError):
+                load_segment_ids(f.name, cdsDAO)
+
+
+class TestBlsEngine(unittest.TestCase):
+    tree = PhyloTree("((A:1,B:2)X:3,(C:4,(D:5,E:6)Y:7)Z:8)R:9;", format=1)
+
+    def test_calc_bls(self):
+        bls_engine = BlsEngine(self.tree)
+        self.assertEqual(bls_engine.calc_bls([]), 0)
+        self.assertEqual(bls_engine.calc_bls(["A"]), 0)
+        self.assertEqual(bls_engine.calc_bls(["D", "E"]), 5 + 6)
+        self.assertEqual(bls_engine.calc_bls(["A", "D"]), 1 + 3 + 8 + 7 + 5)
+        self.assertEqual(bls_engine.calc_bls(["A", "B", "C"]), 1 + 2 + 3 + 8 + 4)
+        self.assertEqual(bls_engine.calc_bls(["C", "D", "E", "E"]), 4 + 7 + 5 + 6)
+        with self.assertRaises(ValueError):
+            bls_engine.calc_bls(["A", "F"])
+
+    def test_compatibility(self):
+        rand = random.Random(0)
+        tree = PhyloTree()
+        tree.populate(50, random_branches=True)
+        bls_engine = BlsEngine(tree)
+        leaf_names = tree.get_leaf_names()
+        for _ in range(50):
+            genome_names = rand.sample(leaf_names, rand.randint(1, len(leaf_names)))
+            self.assertAlmostEqual(bls_engine.calc_bls(genome_names), calc_bls(genome_names, tree))
+
+
+class TestBlsCache(unittest.TestCase):
+    tree = PhyloTree("((A:1,B:2)X:3,(C:4,(D:5,E:6)Y:7)Z:8)R:9;", format=1)
+
+    def test_calc_bls(self):
+        bls_cache = BlsCache(BlsEngine(self.tree), maxsize=2)
+        self.assertEqual(bls_cache.calc_bls(["D", "E"]), 11)
+        self.assertEqual(bls_cache.calc_bls(["E", "D"]), 11)
+        self.assertEqual((bls_cache.hits, bls_cache.misses), (1, 1))
+        self.assertEqual(bls_cache.calc_bls(["A", "D"]), 24)
+        self.assertEqual(bls_cache.calc_bls(["C", "D", "E"]), 22)  # evict ["D", "E"]
+        self.assertEqual(len(bls_cache), 2)  # cached entries, not leafs of the tree
+        self.assertNotIn(bls_cache.get_key(["D", "E"]), bls_cache.cache)
+        self.assertEqual((bls_cache.hits, bls_cache.misses), (1, 3))
+        with self.assertRaises(ValueError):
+            bls_cache.calc_bls(["A", "F"])
+
+    def test_persistence(self):
+        bls_cache = BlsCache(BlsEngine(self.tree))
+        bls_cache.calc_bls(["D", "E"])
+        bls_cache.calc_bls(["A", "B", "C"])
+        with tempfile.TemporaryDirectory() as direc:
+            with tempfile.NamedTemporaryFile('w', suffix=".nwk") as f:
+                f.write(self.tree.write(format=1))
+                f.flush()
+                fp = BlsCache.build_filepath(direc, f.name)
+            bls_cache.save(fp)
+            loaded_cache = BlsCache(BlsEngine(self.tree))
+            loaded_cache.load(fp)
+        self.assertEqual(loaded_cache.cache, bls_cache.cache)
+        self.assertEqual(loaded_cache.calc_bls(["A", "B", "C"]), 18)
+        self.assertEqual(loaded_cache.hits, 1)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
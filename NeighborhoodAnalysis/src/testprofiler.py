@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import json
+import pathlib
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT_PATH = pathlib.Path().joinpath('../../').resolve()
+sys.path.append(str(ROOT_PATH))
+sys.path.append(str(ROOT_PATH.joinpath("DB/init")))
+from mylib.profiler import Profiler, NULL_PROFILER
+
+
+class TestProfiler(unittest.TestCase):
+    def test_stage(self):
+        profiler = Profiler()
+        for _ in range(2):
+            with profiler.stage("sleep"):
+                time.sleep(0.01)
+        with profiler.stage("busy"):
+            sum(range(10 ** 5))
+        self.assertEqual(list(profiler.stages), ["sleep", "busy"])
+        self.assertEqual(profiler.stages["sleep"]["count"], 2)
+        self.assertGreaterEqual(profiler.stages["sleep"]["wall"], 0.02)
+        self.assertLess(profiler.stages["sleep"]["cpu"], profiler.stages["sleep"]["wall"])
+        self.assertGreater(profiler.stages["busy"]["peak_rss_mb"], 0)
+
+        with self.assertRaises(KeyError):
+            with profiler.stage("error"):
+                raise KeyError("timed even if raised")
+        self.assertEqual(profiler.stages["error"]["count"], 1)
+
+    def test_count(self):
+        profiler = Profiler()
+        profiler.count("genes")
+        profiler.count("records", 3)
+        profiler.count("records", 4)
+        self.assertEqual(profiler.to_dict()["counters"], {"genes": 1, "records": 7})
+
+        worker_profiler = Profiler()
+        with worker_profiler.stage("scoring"):
+            pass
+        worker_profiler.count("records", 5)
+        for _ in range(2):
+            profiler.merge(worker_profiler.to_dict())
+        self.assertEqual(profiler.stages["scoring"]["count"], 2)
+        self.assertEqual(profiler.counters["records"], 17)
+        worker_profiler.reset()
+        self.assertEqual(worker_profiler.to_dict(), {"stages": {}, "counters": {}})
+
+    def test_disabled(self):
+        with NULL_PROFILER.stage("scoring"):
+            pass
+        NULL_PROFILER.count("records", 3)
+        NULL_PROFILER.merge({"stages": {"scoring": {"count": 1, "wall": 1.0, "cpu": 1.0, "peak_rss_mb": 1.0}},
+                             "counters": {"records": 1}})
+        self.assertEqual(NULL_PROFILER.to_dict(), {"stages": {}, "counters": {}})
+        with tempfile.TemporaryDirectory() as direc:
+            out_fp = pathlib.Path(direc).joinpath("profile.json")
+            NULL_PROFILER.save(str(out_fp))
+            self.assertFalse(out_fp.exists())
+
+    def test_save(self):
+        profiler = Profiler()
+        with profiler.stage("scoring"):
+            pass
+        profiler.count("records", 2)
+        with tempfile.TemporaryDirectory() as direc:
+            out_fp = pathlib.Path(direc).joinpath("profile.json")
+            profiler.save(str(out_fp), script="neighbor_all", args={"workers": 2})
+            report = json.loads(out_fp.read_text())
+        self.assertEqual(list(report)[:2], ["script", "args"])
+        self.assertEqual(report["args"], {"workers": 2})
+        for key in ("wall", "cpu", "children_cpu", "peak_rss_mb"):
+            self.assertGreaterEqual(report[key], 0)
+        self.assertEqual(report["stages"]["scoring"]["count"], 1)
+        self.assertEqual(report["counters"], {"records": 2})
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
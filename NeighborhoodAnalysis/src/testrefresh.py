@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import os
+import pathlib
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+ROOT_PATH = pathlib.Path().joinpath('../../').resolve()
+sys.path.append(str(ROOT_PATH))
+sys.path.append(str(ROOT_PATH.joinpath("DB/init")))
+from load_tables import connect, load_project
+from refresh import refresh
+from testloadtables import write_genome
+
+
+class TestRefresh(unittest.TestCase):
+    def setUp(self):
+        self.tmp_direc = tempfile.TemporaryDirectory()
+        self.genome_direc = pathlib.Path(self.tmp_direc.name).joinpath("genome")
+        self.genome_direc.mkdir()
+        self.patcher = mock.patch("mylib.path.GENOME_DIREC", str(self.genome_direc))
+        self.patcher.start()
+        for genome_name in ["g0", "g1", "g2"]:
+            write_genome(self.genome_direc, genome_name)
+        self.con = connect(pathlib.Path(self.tmp_direc.name).joinpath("test.db"))
+        self.con.executescript(ROOT_PATH.joinpath("DB/sequences/schema.sql").read_text())
+        self.con.executescript(ROOT_PATH.joinpath("DB/hits/schema.sql").read_text())
+        load_project(self.con, "p0", ["g0", "g1", "g2"])
+        self.con.execute("INSERT INTO hits SELECT cds_id, cds_id, 0, 10, 1.0, 1.0 FROM cdss;")
+
+    def tearDown(self):
+        self.con.close()
+        self.patcher.stop()
+        self.tmp_direc.cleanup()
+
+    def select(self, query):
+        return self.con.execute(query).fetchall()
+
+    def test_refresh(self):
+        genome2project = {"g0": "p0", "g1": "p0", "g2": "p0"}
+        plan = refresh(self.con, genome2project)
+        self.assertEqual(plan["touched"], ["g0", "g1", "g2"])  # baseline of genomes loaded before manifests
+        self.assertEqual(self.select("SELECT COUNT(*) FROM manifests;"), [(6,)])
+        self.assertFalse(any(refresh(self.con, genome2project).values()))
+
+        genome2id = dict(self.select("SELECT genome_name, genome_id FROM genomes;"))
+        write_genome(self.genome_direc, "g1", cds_count=2, faa=True)
+        write_genome(self.genome_direc, "g3")
+        gff_fp = self.genome_direc.joinpath("g2", "g2.gff")
+        os.utime(gff_fp, ns=(0, 0))  # mtime only
+        del genome2project["g0"]  # unlisted, but kept with its files
+        genome2project["g3"] = "p0"
+        plan = refresh(self.con, genome2project)
+        self.assertEqual((plan["added"], plan["changed"], plan["removed"], plan["touched"]),
+                         (["g3"], ["g1"], [], ["g2"]))
+
+        self.assertEqual(self.select("SELECT genome_name, genome_id FROM genomes ORDER BY genome_id;"),
+                         [("g0", genome2id["g0"]), ("g1", genome2id["g1"]), ("g2", genome2id["g2"]),
+                          ("g3", genome2id["g2"] + 1)])
+        self.assertEqual(self.select("SELECT cds_name FROM cdss JOIN sequences USING (cds_id);"),
+                         [("g1_0",), ("g1_1",)])
+        self.assertEqual(self.select("SELECT COUNT(*) FROM hits;"), [(6,)])  # hits of g1 are deleted
+        self.assertEqual(self.select("SELECT mtime_ns FROM manifests WHERE genome_id = {} AND extension = 'gff';"
+                                     .format(genome2id["g2"])), [(0,)])
+        self.assertFalse(any(refresh(self.con, genome2project).values()))
+
+        self.genome_direc.joinpath("g0", "g0.gff").unlink()
+        with self.assertLogs("refresh", level="WARNING") as logs:
+            plan = refresh(self.con, genome2project, dry_run=True)
+        self.assertEqual(plan["removed"], ["g0"])
+        self.assertTrue(any("would delete 3 hits" in line for line in logs.output))  # logged before deletion
+        self.assertEqual(self.select("SELECT COUNT(*) FROM hits;"), [(6,)])
+        refresh(self.con, genome2project)
+        self.assertEqual(self.select("SELECT genome_name FROM genomes ORDER BY genome_id;"),
+                         [("g1",), ("g2",), ("g3",)])
+        self.assertEqual(self.select("SELECT COUNT(*) FROM hits;"), [(3,)])  # only hits of g2 are left
+        self.assertEqual(self.select("SELECT COUNT(*) FROM cdss WHERE genome_id = {};".format(genome2id["g0"])), [(0,)])
+
+    def test_remove_unlisted(self):
+        genome2project = {"g1": "p0", "g2": "p0"}
+        plan = refresh(self.con, genome2project, remove_unlisted=True)
+        self.assertEqual((plan["removed"], plan["touched"]), (["g0"], ["g1", "g2"]))
+        self.assertEqual(self.select("SELECT genome_name FROM genomes ORDER BY genome_id;"), [("g1",), ("g2",)])
+        self.assertEqual(self.select("SELECT COUNT(*) FROM hits;"), [(6,)])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -4,6 +4,8 @@ import unittest
 
 import numpy as np
 from scorelib import score_naive, score_independent, score_conditional
+from scorelib import score_naive_batch, score_independent_batch, score_conditional_batch
+from scorelib import bound_naive, bound_independent
 
 
 class TestSegmentManager(unittest.TestCase):
@@ -39,5 +41,49 @@ class TestSegmentManager(unittest.TestCase):
         )
 
 
+class TestBatch(unittest.TestCase):
+    @staticmethod
+    def build_indicator_tensor(seed, gene_count=20, row_count=50, col_count=11):
+        rng = np.random.RandomState(seed)
+        indicator_tensor = (rng.rand(gene_count, row_count, col_count) < 0.2).astype(float)
+        indicator_tensor[:, rng.rand(row_count, col_count) < 0.3] = -1
+        return indicator_tensor
+
+    def assertBatchEqual(self, score_func, score_batch_func):
+        for seed in range(10):
+            indicator_tensor = self.build_indicator_tensor(seed)
+            expected = [score_func(indicator_matrix) for indicator_matrix in indicator_tensor]
+            self.assertEqual(list(score_batch_func(indicator_tensor)), expected)
+            self.assertEqual(list(score_batch_func(indicator_tensor.astype(np.int8))), expected)
+
+    def test_naive(self):
+        self.assertEqual(score_naive_batch(TestSegmentManager.indicator_matrix[np.newaxis])[0], 6 / 10)
+        self.assertBatchEqual(score_naive, score_naive_batch)
+
+    def test_independent(self):
+        self.assertBatchEqual(score_independent, score_independent_batch)
+
+    def test_conditional(self):
+        self.assertEqual(score_conditional_batch(TestSegmentManager.indicator_matrix[np.newaxis])[0],
+                         (1 * 6 + 0 + 1 / 2 + 4 / 7 + 11 / 14) / 10)
+        self.assertBatchEqual(score_conditional, score_conditional_batch)
+
+
+class TestBound(unittest.TestCase):
+    def test_bound(self):
+        for seed in range(10):
+            indicator_tensor = TestBatch.build_indicator_tensor(seed)
+            row_counts = (indicator_tensor == 1).any(axis=2).sum(axis=1)
+            col_counts = (indicator_tensor == 1).sum(axis=1)
+            total_arr = (indicator_tensor[0] >= 0).sum(axis=0)
+            self.assertEqual(list(bound_naive(row_counts, indicator_tensor.shape[1])),
+                             list(score_naive_batch(indicator_tensor)))
+            np.testing.assert_allclose(bound_independent(col_counts, total_arr),
+                                       score_independent_batch(indicator_tensor))
+            narrow_tensor = indicator_tensor[:, :, 1:-1]
+            self.assertTrue((bound_independent(col_counts, total_arr) + 1e-12 >=
+                             score_independent_batch(narrow_tensor)).all())
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
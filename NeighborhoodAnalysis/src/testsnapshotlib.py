@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+import os
+import pathlib
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+ROOT_PATH = pathlib.Path().joinpath('../../').resolve()
+sys.path.append(str(ROOT_PATH))
+sys.path.append(str(ROOT_PATH.joinpath("DB/init")))
+from mylib.db import ColumnarCdsDAO, dispose_engines
+from mylib.profiler import Profiler
+from snapshotlib import SnapshotCache, load_clade_cds_df
+from testdb import build_db
+from testneighborlib import build_cdss
+
+
+class TestSnapshotCache(unittest.TestCase):
+    cdss = build_cdss(seed=5, genome_count=4)
+
+    def setUp(self):
+        self.tmp_direc = tempfile.TemporaryDirectory()
+        direc = pathlib.Path(self.tmp_direc.name)
+        self.db_fp = direc.joinpath("test.db")
+        self.snapshot_direc = direc.joinpath("snapshot")
+        build_db(self.db_fp)
+        con = sqlite3.connect(str(self.db_fp))
+        con.executemany("INSERT INTO genomes VALUES (?, ?, ?);",
+                        [(genome_id, 0, "genome{}".format(genome_id)) for genome_id in range(4)])
+        con.executemany("INSERT INTO clades VALUES (?, ?, ?);",
+                        [(genome_id, "clade", "genome{}".format(genome_id)) for genome_id in (0, 2, 3)])
+        con.executemany("INSERT INTO cdss VALUES (?, ?, ?, ?, ?, ?, ?, ?);",
+                        [(cds.cds_id, cds.genome_id, cds.scaffold_id, cds.cds_name, cds.start, cds.end,
+                          cds.length, cds.strand) for cds in self.cdss])
+        con.commit()
+        con.close()
+
+        self.ortho_fp = direc.joinpath("clade.ortho")
+        self.write_ortho(self.cdss)
+
+    def tearDown(self):
+        dispose_engines()
+        self.tmp_direc.cleanup()
+
+    def write_ortho(self, cdss):
+        pd.DataFrame([(cds.cds_name, cds.gene_name) for cds in cdss if cds.gene_name is not None],
+                     columns=["cds_name", "gene_name"]).to_csv(str(self.ortho_fp), sep='\t', index=False)
+
+    def load(self, budget=SnapshotCache.BUDGET, profiler=None):
+        return load_clade_cds_df("clade", self.ortho_fp, budget=budget, snapshot_direc=self.snapshot_direc,
+                                 db_fp=self.db_fp, profiler=profiler if profiler else Profiler(enabled=False))
+
+    def test_load(self):
+        expected_df, expected_gene_names = self.load(budget=0)
+        self.assertFalse(self.snapshot_direc.exists())
+        self.assertEqual(expected_gene_names, sorted(set(cds.gene_name for cds in self.cdss) - {None}))
+
+        self.load()
+        self.assertEqual(len(list(self.snapshot_direc.iterdir())), 1)
+        cds_df, gene_names = self.load()  # from snapshot
+        self.assertEqual(gene_names, expected_gene_names)
+        self.assertEqual(list(cds_df.columns), list(expected_df.columns))
+        cdsDAO, expected_DAO = ColumnarCdsDAO(cds_df), ColumnarCdsDAO(expected_df)
+        for attr in ("cds_ids", "genome_ids", "scaffold_ids", "starts", "ends", "lengths", "plus_msk", "gene_codes"):
+            np.testing.assert_array_equal(getattr(cdsDAO, attr), getattr(expected_DAO, attr))
+        self.assertEqual(cdsDAO.cds_names.tolist(), expected_DAO.cds_names.tolist())
+        self.assertEqual(cdsDAO.gene_names, expected_DAO.gene_names)
+
+    def test_profile(self):
+        profiler = Profiler()
+        self.load(profiler=profiler)
+        self.assertEqual(list(profiler.stages), ["db_load", "ortho_join"])
+        self.assertEqual(profiler.stages["db_load"]["count"], 2)  # DB query and snapshot save
+        self.assertEqual(profiler.stages["ortho_join"]["count"], 1)
+
+        profiler = Profiler()
+        self.load(profiler=profiler)  # from snapshot, already joined
+        self.assertEqual(list(profiler.stages), ["db_load"])
+
+    def test_invalidate(self):
+        key = SnapshotCache.build_key("clade", self.db_fp, self.ortho_fp)
+        self.load()
+        self.assertEqual(SnapshotCache.build_key("clade", self.db_fp, self.ortho_fp), key)
+
+        self.write_ortho(self.cdss[:10])
+        self.assertNotEqual(SnapshotCache.build_key("clade", self.db_fp, self.ortho_fp), key)
+        cds_df, gene_names = self.load()
+        self.assertEqual(cds_df["gene_name"].notna().sum(), sum(1 for cds in self.cdss[:10]
+                                                                if cds.gene_name is not None and cds.genome_id != 1))
+
+        key = SnapshotCache.build_key("clade", self.db_fp, self.ortho_fp)
+        con = sqlite3.connect(str(self.db_fp))
+        con.execute("DELETE FROM cdss WHERE genome_id = 0;")
+        con.commit()
+        con.close()
+        self.assertNotEqual(SnapshotCache.build_key("clade", self.db_fp, self.ortho_fp), key)
+        cds_df, _ = self.load()
+        self.assertNotIn(0, set(cds_df["genome_id"]))
+
+    def test_evict(self):
+        cache = SnapshotCache(self.snapshot_direc)
+        cds_df, gene_names = self.load(budget=0)
+        for i, key in enumerate(["a", "b", "c"]):
+            cache.save(key, cds_df, gene_names)
+            meta_fp = self.snapshot_direc.joinpath(key, SnapshotCache.META_NAME)
+            os.utime(str(meta_fp), ns=(i * 10 ** 9, i * 10 ** 9))
+        cache.load("a")  # a is now the most recently used
+        cache.budget = cache.get_size("a") * 2
+        cache.save("d", cds_df, gene_names)
+        self.assertEqual(sorted(path.name for path in self.snapshot_direc.iterdir()), ["a", "d"])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
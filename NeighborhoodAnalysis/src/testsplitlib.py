@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 
+import tempfile
 import unittest
 
-from splitlib import SegmentManager, Wcf
+import numpy as np
+
+from splitlib import SegmentManager, Wcf, save_replicates, load_replicate
 
 
 class TestSegmentManager(unittest.TestCase):
@@ -46,6 +49,83 @@ class TestSegmentManager(unittest.TestCase):
         self.assertEqual(segment_manager.get_members_by_id(child_id1), member[:idx])
         self.assertEqual(segment_manager.get_members_by_id(child_id2), member[idx:])
 
+        for idx in (-1, 0, 5, 7):
+            grandchild_id1, grandchild_id2 = segment_manager.split(child_id2, idx)
+            self.assertEqual(segment_manager.get_members_by_id(grandchild_id1), member[2:][:idx])
+            self.assertEqual(segment_manager.get_members_by_id(grandchild_id2), member[2:][idx:])
+            segment_manager.delete(grandchild_id1)
+            segment_manager.delete(grandchild_id2)
+            child_id2 = segment_manager.add(member[2:])
+        with self.assertRaises(KeyError):
+            segment_manager.split(grandchild_id1, 1)
+
+    def test_split_all(self):
+        expected = SegmentManager()
+        actual = SegmentManager()
+        for k in range(6):
+            members = list(range(10 * k, 10 * k + k + 2))
+            expected.add(members)
+            actual.add(members)
+        segment_ids = [4, 1, 5, 2]
+        idxs = [3, 0, 7, 1]
+        for segment_id, idx in zip(segment_ids, idxs):
+            expected.split(segment_id, idx)
+        segment_ids1, segment_ids2 = actual.split_all(segment_ids, idxs)
+        self.assertEqual(segment_ids1.tolist(), [6, 7, 8, 9])
+        self.assertEqual(segment_ids2.tolist(), [10, 11, 12, 13])
+        self.assertEqual(actual.get_segment_count(), expected.get_segment_count())
+        self.assertEqual(actual.get_member_count(), expected.get_member_count())
+        self.assertEqual(sorted(actual.to_df().groupby("segment_id")["member"].apply(list).tolist()),
+                         sorted(expected.to_df().groupby("segment_id")["member"].apply(list).tolist()))
+        for size in range(10):
+            self.assertEqual(len(actual.get_segments_by_size(size)), len(expected.get_segments_by_size(size)))
+        with self.assertRaises(KeyError):
+            actual.split_all([4], [1])
+        with self.assertRaises(ValueError):
+            actual.split_all([6, 6], [1, 1])
+
+    def test_to_df(self):
+        segment_manager = SegmentManager()
+        segment_id1 = segment_manager.add([1, 2, 3, 4, 5])
+        segment_manager.add([6, 7])
+        segment_manager.split(segment_id1, 2)
+        df = segment_manager.to_df()
+        self.assertEqual(df["segment_id"].tolist(), [1, 1, 2, 2, 3, 3, 3])
+        self.assertEqual(df["member"].tolist(), [6, 7, 1, 2, 3, 4, 5])
+
+    def test_to_wcf(self):
+        segment_manager = SegmentManager()
+        for members in ([1], [2], [3], [4], [5, 6], [7, 8, 9, 10]):
+            segment_manager.add(members)
+        wcf = segment_manager.to_wcf()
+        expected = Wcf([1, 2, 4], [4, 1, 1])
+        self.assertEqual(wcf.to_array().tolist(), expected.to_array().tolist())
+
+    def test_replicates(self):
+        members_lst = [[10, 11, 12, 13, 14, 15], [20, 21], [30, 31, 32]]
+        boundaries_lst = []
+        expected_dfs = []
+        for idxs in ([], [2], [1, 3]):
+            segment_manager = SegmentManager()
+            segment_ids = [segment_manager.add(members) for members in members_lst]
+            for idx in idxs:
+                segment_ids = segment_manager.split(segment_ids[-1], idx)
+            boundaries_lst.append(segment_manager.get_boundaries())
+            expected_dfs.append(segment_manager.to_df().sort_values("member"))
+        scaffold_ids = [1] * 6 + [2] * 2 + [3] * 3
+        with tempfile.NamedTemporaryFile(suffix=".npz") as f:
+            save_replicates(f.name, segment_manager.member_buf, scaffold_ids, boundaries_lst)
+            for replicate, expected_df in enumerate(expected_dfs):
+                df = load_replicate(f.name, replicate)
+                self.assertEqual(df["cds_id"].tolist(), expected_df["member"].tolist())
+                self.assertEqual(df["scaffold_id"].tolist(), scaffold_ids)
+                self.assertEqual(df.groupby("segment_id")["cds_id"].apply(list).tolist(),
+                                 expected_df.groupby("segment_id")["member"].apply(list).sort_values().tolist())
+            with self.assertRaises(IndexError):
+                load_replicate(f.name, 3)
+        with self.assertRaises(ValueError):
+            save_replicates("00.map", segment_manager.member_buf, scaffold_ids, boundaries_lst)  # would be 00.map.npz
+
 
 class TestCwf(unittest.TestCase):
     def test_cwf(self):
@@ -59,6 +139,16 @@ class TestCwf(unittest.TestCase):
         self.assertEqual(wcf[4], 1.0)
         self.assertEqual(wcf[5], 1.0)
 
+    def test_long_tail(self):
+        x = [1, 10 ** 6]
+        y = [10 ** 6, 1]
+        wcf = Wcf(x, y)
+        self.assertEqual(len(wcf), 10 ** 6 + 1)
+        self.assertEqual(wcf[1], 0.5)
+        self.assertEqual(wcf[10 ** 6 - 1], 0.5)
+        self.assertEqual(wcf[10 ** 6], 1.0)
+        np.testing.assert_array_equal(Wcf(np.array(x), np.array(y)).to_array(), wcf.to_array())
+
 
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import os
 import sys
 import pathlib
 import logging
@@ -16,25 +17,33 @@ add cds_name attribute to Prodigal generated gff
 
 
 def main(in_fp, out_fp):
+    """
+    stream records to a temporary file, which replaces out_fp after cds_names are checked to be unique
+    :raise ValueError: if a record is not CDS, or generated cds_names are not unique
+    """
+
     LOGGER.info("load {}".format(in_fp))
-    cds_names = []
-    lines = []
-    with open(in_fp, "r") as f:
-        for line in f:
-            if line[0] == '#':
-                lines.append(line.strip())
-            else:
-                record = GffRecord(line)
-                assert record.type == "CDS"
-                cds_name = "{}_{}".format(record.seqid, record.attributes["ID"].split('_')[1])
-                record.attributes["cds_name"] = cds_name  # add cds_name to attribute
-                lines.append(str(record))
-                cds_names.append(cds_name)
-    assert len(set(cds_names)) == len(cds_names)  # check if generated cds_names are unique
-
-    with open(out_fp, 'w') as f:
-        for line in lines:
-            f.write("{}\n".format(line))
+    cds_names = set()
+    tmp_fp = "{}.tmp".format(out_fp)
+    try:
+        with open(in_fp, "r") as f, open(tmp_fp, 'w') as out_f:
+            for line in f:
+                if line[0] == '#':
+                    out_f.write("{}\n".format(line.strip()))
+                else:
+                    record = GffRecord(line)
+                    if record.type != "CDS":
+                        raise ValueError("unexpected type {} in {}".format(record.type, in_fp))
+                    cds_name = "{}_{}".format(record.seqid, record.attributes["ID"].split('_')[1])
+                    if cds_name in cds_names:
+                        raise ValueError("duplicated cds_name {} in {}".format(cds_name, in_fp))
+                    record.attributes["cds_name"] = cds_name  # add cds_name to attribute
+                    out_f.write("{}\n".format(record))
+                    cds_names.add(cds_name)
+    except BaseException:  # including KeyboardInterrupt, not to leave a partial file behind
+        pathlib.Path(tmp_fp).unlink(missing_ok=True)
+        raise
+    os.replace(tmp_fp, out_fp)
     LOGGER.info("output gff records with cds_name attribute to {}".format(out_fp))
 
 
@@ -3,3 +3,5 @@ from . import db
 from . import ncbi
 from . import gff
 from . import df
+from . import profiler
+from . import fasta
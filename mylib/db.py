@@ -1,92 +1,311 @@
+import json
+import os
+import pathlib
+import sqlite3
 import sys
-from collections import defaultdict
+import time
+from collections import defaultdict, namedtuple
+from logging import getLogger
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+import numpy as np
 import pandas as pd
 
 from . import path
 sys.path.append(path.DB_LIB_DIREC)
 from myschema import Project, Genome, Scaffold, Cds
 DB_PATH = path.DB_PATH
+IN_CHUNK_SIZE = 900  # number of bound parameters per query, under SQLITE_MAX_VARIABLE_NUMBER = 999 of old SQLite
+LOGGER = getLogger(__name__)
+PRAGMA_PROFILES = {
+    "read": {  # analysis scripts, which never write to DB
+        "mmap_size": 2 ** 34,
+        "cache_size": -2 ** 20,  # in KiB
+        "temp_store": "MEMORY",
+        "query_only": 1
+    },
+    "write": {  # bulk loaders building a new DB, same as DB/GURatio/calc.sql. A crash can corrupt the DB
+        "journal_mode": "MEMORY",
+        "synchronous": 0,
+        "cache_size": 500000,
+        "temp_store": "MEMORY"
+    },
+    "update": {  # loaders modifying a DB in place, whose transactions survive a crash
+        "journal_mode": "DELETE",
+        "synchronous": 1,
+        "cache_size": 500000,
+        "temp_store": "MEMORY"
+    }
+}
+ENGINES = dict()  # key: (fp, profile, pragmas), val: engine
+
+
+def get_engine(fp=None, profile="read", **pragmas):
+    """
+    engine cached per DB path and profile, so that repeated helper calls reuse pooled connections.
+    pragmas of the profile (see PRAGMA_PROFILES) are set on each new connection.
+    :param pragmas: pragmas to override the profile, e.g. mmap_size=0
+    """
+
+    fp = str(pathlib.Path(fp if fp else DB_PATH).resolve())
+    pragmas = dict(PRAGMA_PROFILES[profile], **pragmas)
+    key = (fp, profile, tuple(sorted(pragmas.items())))
+    if key not in ENGINES:
+        engine = create_engine('sqlite:///{}'.format(fp), poolclass=QueuePool)
+
+        @event.listens_for(engine, "connect")
+        def set_pragmas(dbapi_con, con_record):
+            cursor = dbapi_con.cursor()
+            for name, value in pragmas.items():
+                cursor.execute("PRAGMA {}={};".format(name, value))
+            cursor.close()
+
+        ENGINES[key] = engine
+        LOGGER.debug("created {} engine of {} with {}".format(profile, fp, pragmas))
+    return ENGINES[key]
+
+
+def dispose_engines():
+    """
+    close pooled connections of all engines, e.g. before the DB file is replaced
+    """
+
+    for engine in ENGINES.values():
+        engine.dispose()
+    ENGINES.clear()
 
 
-def get_session(fp=None):
-    engine = create_engine('sqlite:///{}'.format(fp if fp else DB_PATH))
-    Session = sessionmaker(bind=engine)
+def get_session(fp=None, profile="read"):
+    Session = sessionmaker(bind=get_engine(fp, profile))
     return Session()
 
 
-def get_connection(fp=None):
-    engine = create_engine('sqlite:///{}'.format(fp if fp else DB_PATH))
-    return engine.connect()
+def get_connection(fp=None, profile="read"):
+    return get_engine(fp, profile).connect()
 
 
 class IDManager:
     """
-    SQLITE3 ID Management utility class
+    SQLITE3 ID Management utility class.
+    IDs are reserved in contiguous blocks through id_sequences table, so that loaders running at once never hand out
+    the same ID, even for records written to TSV but not yet imported.
     """
 
-    def __init__(self, table_name):
+    BLOCK_SIZE = 1000  # number of IDs reserved at once by new()
+    LOW_VOLUME_TABLES = ("projects", "genomes")  # new() reserves one ID at a time, not to leave unused IDs of a block
+    LOCK_TIMEOUT = 600  # seconds to wait for other loaders to release the DB
+
+    def __init__(self, table_name, fp=None, block_size=None):
         assert table_name in ("projects", "genomes", "scaffolds", "cdss", "hits", "refseqs")
-        self.con = get_connection()
+        self.fp = str(fp if fp else DB_PATH)
         self.table_name = table_name
-        self.current_id = self._query_max_id()
-
-    def __del__(self):
-        self.con.close()
+        if block_size is None:
+            block_size = 1 if table_name in self.LOW_VOLUME_TABLES else self.BLOCK_SIZE
+        self.block_size = block_size
+        self.has_sequence_table = False  # id_sequences is created at most once per instance
+        self.current_id = 0  # last ID given by new()
+        self.block = range(0)  # IDs reserved but not given by new() yet
 
     def get(self):
         return self.current_id
 
     def new(self):
-        self.current_id += 1
+        if len(self.block) == 0:
+            self.block = self.reserve(self.block_size)
+        self.current_id = self.block[0]
+        self.block = self.block[1:]
         return self.current_id
 
-    def _query_max_id(self):
-        query = "SELECT MAX({}_id) from {};".format(self.table_name[:-1], self.table_name)
-        max_id = self.con.execute(query).fetchone()[0]
-        max_id = max_id if max_id else 0  # for cases when table has no record
-        return max_id
-
-
-class CdsDAO:
+    def reserve(self, n, con=None):
+        """
+        atomically reserve n contiguous IDs, which are larger than any ID in the table or reserved before.
+        e.g. reserve all cds_ids of a genome at once to keep cds_id contiguous within a scaffold.
+        :param con: sqlite3 connection of a loader which already holds the write lock (BEGIN IMMEDIATE), whose
+                    transaction then also covers the reservation. A new connection is used by default.
+        :return: range of reserved IDs
+        """
+
+        if con is not None:
+            return self.reserve_in_transaction(n, con)
+
+        con = sqlite3.connect(self.fp, timeout=self.LOCK_TIMEOUT, isolation_level=None)
+        try:
+            if not self.has_sequence_table:  # for DB created before id_sequences
+                con.execute("CREATE TABLE IF NOT EXISTS id_sequences ("
+                            "table_name TEXT NOT NULL, next_id INTEGER NOT NULL, PRIMARY KEY (table_name));")
+                self.has_sequence_table = True
+            con.execute("BEGIN IMMEDIATE;")  # lock DB for writing until COMMIT
+            ids = self.reserve_in_transaction(n, con)
+            con.execute("COMMIT;")
+        finally:
+            if con.in_transaction:
+                con.execute("ROLLBACK;")
+            con.close()
+        return ids
+
+    def reserve_in_transaction(self, n, con):
+        col_id = "{}_id".format(self.table_name[:-1])
+        max_id = con.execute("SELECT MAX({}) FROM {};".format(col_id, self.table_name)).fetchone()[0]
+        row = con.execute("SELECT next_id FROM id_sequences WHERE table_name = ?;", (self.table_name,)).fetchone()
+        start_id = max(row[0] if row else 1, (max_id if max_id else 0) + 1)
+        con.execute("INSERT OR REPLACE INTO id_sequences VALUES (?, ?);", (self.table_name, start_id + n))
+        return range(start_id, start_id + n)
+
+
+CdsRecord = namedtuple("CdsRecord", ["cds_id", "genome_id", "scaffold_id", "cds_name", "start", "end", "length",
+                                     "strand", "gene_name"])
+
+
+class ColumnarCdsDAO:
     """
-    Data Access Object class to get cdss by various attributes (cds_id, cds_name, gene_name).
-    ToDo: update to throw exception when failed to find target cdss
+    Data Access Object class to get cdss by various attributes (cds_id, cds_name, gene_name), backed by numpy arrays
+    aligned to idx instead of Cds objects and dict indexes.
+    gene_names are encoded to integer gene codes (index of sorted gene_names, -1 for no gene).
+    Neighbors are searched within each segment, which is the scaffold unless a virtual segmentation is overlaid.
+    Object-returning methods create a lightweight CdsRecord on demand, and vectorized methods work on arrays of idx.
     """
 
-    def __init__(self, cdss):
-        self.cdss = cdss
-        self.id2idx = defaultdict(lambda: None)
-        self.name2idx = defaultdict(lambda: None)
-        self.gene2idxs = defaultdict(list)
-        for idx, cds in enumerate(self.cdss):
-            self.id2idx[cds.cds_id] = idx
-            self.name2idx[cds.cds_name] = idx
-            if hasattr(cds, "gene_name"):
-                self.gene2idxs[cds.gene_name].append(idx)
+    def __init__(self, cds_df, segment_ids=None):
+        """
+        :param cds_df: DataFrame with columns of cdss table, and optionally gene_name
+        :param segment_ids: see set_segment_ids()
+        """
+
+        self.cds_ids = cds_df["cds_id"].to_numpy(dtype=np.int64)
+        self.genome_ids = cds_df["genome_id"].to_numpy(dtype=np.int64)
+        self.scaffold_ids = cds_df["scaffold_id"].to_numpy(dtype=np.int64)
+        self.starts = cds_df["start"].to_numpy(dtype=np.int64)
+        self.ends = cds_df["end"].to_numpy(dtype=np.int64)
+        self.lengths = cds_df["length"].to_numpy(dtype=np.int64)
+        self.cds_names = cds_df["cds_name"].to_numpy(dtype=object)
+        self.strand_codes, self.strands = pd.factorize(cds_df["strand"].astype(object))
+        self.plus_msk = (cds_df["strand"] == '+').to_numpy(dtype=bool)
+        gene_name_col = cds_df["gene_name"] if "gene_name" in cds_df.columns else pd.Series(None, index=cds_df.index)
+        gene_codes, gene_names = pd.factorize(gene_name_col.astype(object), sort=True)
+        self.gene_codes = gene_codes.astype(np.int32)
+        self.gene_names = list(gene_names)
+        self.gene2code = dict((gene_name, code) for code, gene_name in enumerate(self.gene_names))
+
+        self.id_order = np.argsort(self.cds_ids, kind="stable")
+        self.sorted_ids = self.cds_ids[self.id_order]
+        self.gene_order = np.argsort(self.gene_codes, kind="stable")  # idxs grouped by gene code, -1 first
+        self.gene_starts = np.searchsorted(self.gene_codes[self.gene_order], np.arange(-1, len(self.gene_names) + 1))
+        name_msk = ~pd.Index(self.cds_names).duplicated(keep="last")  # last cds of a repeated cds_name, as CdsDAO
+        self.name_index = pd.Index(self.cds_names[name_msk])
+        self.name_idxs = np.flatnonzero(name_msk)
+        self.set_segment_ids(segment_ids)
+
+    def __len__(self):
+        return len(self.cds_ids)
+
+    def set_segment_ids(self, segment_ids=None):
+        """
+        overlay a virtual segmentation (e.g. simulated fragmentation) without modifying cdss.
+        :param segment_ids: array of segment id aligned to idx, or None to use scaffold_ids
+        """
+
+        if segment_ids is None:
+            self.segment_ids = self.scaffold_ids
+        else:
+            segment_ids = np.asarray(segment_ids, dtype=np.int64)
+            if segment_ids.shape != self.scaffold_ids.shape:
+                raise ValueError("segment_ids of shape {} are not aligned to {} cdss".format(
+                    segment_ids.shape, len(self)))
+            self.segment_ids = segment_ids
 
     def get_cds_by_idx(self, idx):
-        if isinstance(idx, int) and 0 <= idx < len(self.cdss):
-            return self.cdss[idx]
+        if isinstance(idx, (int, np.integer)) and 0 <= idx < len(self):
+            code = self.gene_codes[idx]
+            return CdsRecord(int(self.cds_ids[idx]), int(self.genome_ids[idx]), int(self.scaffold_ids[idx]),
+                             self.cds_names[idx], int(self.starts[idx]), int(self.ends[idx]), int(self.lengths[idx]),
+                             self.strands[self.strand_codes[idx]], self.get_gene_name_by_code(code))
         else:
             return None
 
+    def get_idxs_by_cds_ids(self, cds_ids):
+        """
+        :return: array of idx of each cds_id, -1 for cds_ids not found
+        """
+
+        cds_ids = np.asarray(cds_ids, dtype=np.int64)
+        if len(self) == 0:
+            return -np.ones(cds_ids.shape, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.sorted_ids, cds_ids), len(self) - 1)
+        return np.where(self.sorted_ids[positions] == cds_ids, self.id_order[positions], -1)
+
+    def get_idx_by_cds_id(self, cds_id):
+        idx = int(self.get_idxs_by_cds_ids([cds_id])[0])
+        return idx if idx >= 0 else None
+
+    def get_idx_by_cds_name(self, cds_name):
+        pos = int(self.name_index.get_indexer([cds_name])[0])
+        return int(self.name_idxs[pos]) if pos >= 0 else None
+
+    def get_idxs_by_gene_name(self, gene_name):
+        """
+        :return: array of idx of cdss of the gene in the order of idx, or of cdss without gene if gene_name is None
+        """
+
+        code = self.get_code_by_gene_name(gene_name)
+        if code < 0 and gene_name is not None:
+            return np.zeros(0, dtype=np.int64)
+        return self.gene_order[self.gene_starts[code + 1]:self.gene_starts[code + 2]]
+
     def get_cds_by_cds_id(self, cds_id):
-        return self.get_cds_by_idx(self.id2idx[cds_id])
+        return self.get_cds_by_idx(self.get_idx_by_cds_id(cds_id))
 
     def get_cds_by_cds_name(self, cds_name):
-        return self.get_cds_by_idx(self.name2idx[cds_name])
+        return self.get_cds_by_idx(self.get_idx_by_cds_name(cds_name))
 
     def get_cdss_by_gene_name(self, gene_name):
-        return list(map(lambda idx: self.get_cds_by_idx(idx), self.gene2idxs[gene_name]))
+        return list(map(lambda idx: self.get_cds_by_idx(idx), self.get_idxs_by_gene_name(gene_name).tolist()))
+
+    def get_code_by_gene_name(self, gene_name):
+        return self.gene2code.get(gene_name, -1)
+
+    def get_gene_name_by_code(self, code):
+        return self.gene_names[code] if code >= 0 else None
+
+    def get_neighbor_idxs(self, idxs, offset):
+        """
+        the neighbor is the cds with cds_id +/- offset (depending on the strand of the origin) in the same segment.
+        :param idxs: array of idx of origin cdss
+        :return: array of idx of neighbor cdss, -1 for missing
+        """
+
+        idxs = np.asarray(idxs, dtype=np.int64)
+        target_ids = self.cds_ids[idxs] + np.where(self.plus_msk[idxs], offset, -offset)
+        neighbor_idxs = self.get_idxs_by_cds_ids(target_ids)
+        found_msk = neighbor_idxs >= 0
+        found_msk[found_msk] = self.segment_ids[neighbor_idxs[found_msk]] == self.segment_ids[idxs[found_msk]]
+        return np.where(found_msk, neighbor_idxs, -1)
 
     def get_neighbor_cds(self, origin_cds, offset):
-        neighbor_cds_id = origin_cds.cds_id + offset if origin_cds.strand == '+' else origin_cds.cds_id - offset
-        neighbor_cds = self.get_cds_by_cds_id(neighbor_cds_id)
-        if neighbor_cds is not None and neighbor_cds.scaffold_id == origin_cds.scaffold_id:
-            return neighbor_cds
+        origin_idx = self.get_idx_by_cds_id(origin_cds.cds_id)
+        if origin_idx is None:
+            return None
+        neighbor_idx = int(self.get_neighbor_idxs([origin_idx], offset)[0])
+        return self.get_cds_by_idx(neighbor_idx) if neighbor_idx >= 0 else None
+
+
+class CdsDAO(ColumnarCdsDAO):
+    """
+    ColumnarCdsDAO of Cds objects, where object-returning methods give the original Cds objects.
+    ToDo: update to throw exception when failed to find target cdss
+    """
+
+    def __init__(self, cdss, segment_ids=None):
+        self.cdss = cdss
+        cds_df = pd.DataFrame(
+            [(cds.cds_id, cds.genome_id, cds.scaffold_id, cds.cds_name, cds.start, cds.end, cds.length, cds.strand,
+              getattr(cds, "gene_name", None)) for cds in self.cdss], columns=CdsRecord._fields)
+        super().__init__(cds_df, segment_ids)
+
+    def get_cds_by_idx(self, idx):
+        if isinstance(idx, (int, np.integer)) and 0 <= idx < len(self.cdss):
+            return self.cdss[idx]
         else:
             return None
 
@@ -110,6 +329,167 @@ def load_name2id(table_name, default=-1, con=None):
     return name2id
 
 
+class NameIndex:
+    """
+    Compact name -> id index of a table, kept on disk next to DB as sorted 64-bit name hashes (pd.util.hash_array) and
+    the parallel ids, which are stored as the 2 rows of a single .npy and memory-mapped instead of loaded into a dict.
+    The index is rebuilt when MAX(rowid) of the table or its next_id in id_sequences changes, both of which are O(1),
+    i.e. when rows are inserted, or reloaded with new IDs reserved by IDManager. Rows deleted without reserving new IDs
+    are not detected, and their names still resolve to the deleted ids.
+    Names of colliding hashes are resolved through a small dict saved in the meta JSON after the array. A missing name
+    could still hit the hash of another name, with probability of (table size) / 2^64 per lookup.
+
+    usage:
+        cds_index = NameIndex.load("cdss")
+        mmseqs_df["cds_id"] = cds_index.lookup(mmseqs_df["qname"])
+    """
+
+    CHUNK_SIZE = 10 ** 6  # number of rows hashed at once while building
+
+    def __init__(self, hashes, ids, collisions=None):
+        """
+        :param hashes: sorted array of uint64 name hashes
+        :param ids: array of int64 ids aligned to hashes
+        :param collisions: dict of name -> id, whose hash is shared with other names
+        """
+
+        self.hashes = hashes
+        self.ids = ids
+        self.collisions = collisions if collisions else dict()
+        self.collision_hashes = np.unique(self.hash_names(list(self.collisions)))
+
+    def __len__(self):
+        return len(self.hashes)
+
+    @staticmethod
+    def hash_names(names):
+        return pd.util.hash_array(np.asarray(names, dtype=object))
+
+    @staticmethod
+    def build_filepath(table_name, fp=None, index_direc=None):
+        if index_direc is None:
+            index_direc = pathlib.Path(fp if fp else DB_PATH).resolve().with_suffix(".index")
+        return pathlib.Path(index_direc).joinpath("{}.npy".format(table_name))
+
+    @classmethod
+    def load(cls, table_name, fp=None, index_direc=None, con=None):
+        """
+        memory-map the index of the table, after building it if missing or outdated
+        :param index_direc: directory of index files, <DB_PATH without suffix>.index by default
+        """
+
+        assert table_name in ("projects", "genomes", "scaffolds", "cdss", "refseqs")
+        npy_fp = cls.build_filepath(table_name, fp, index_direc)
+        create_tmp_con = con is None
+        if create_tmp_con:
+            con = get_connection(fp)
+
+        signature = cls.build_signature(table_name, con)
+        arr, meta = cls.read_file(npy_fp) if npy_fp.exists() else (None, None)
+        if meta is None or meta["signature"] != signature:
+            LOGGER.info("building name index of {} to {}".format(table_name, npy_fp))
+            cls.build(table_name, con).save(npy_fp, signature=signature)
+            arr, meta = cls.read_file(npy_fp)
+        if create_tmp_con:
+            con.close()
+        return cls(arr[0], arr[1].view(np.int64), meta["collisions"])
+
+    @staticmethod
+    def build_signature(table_name, con):
+        """
+        :return: [MAX(rowid), next_id in id_sequences (0 if missing)] of the table, without scanning the table
+        """
+
+        max_id = pd.read_sql_query("SELECT MAX(rowid) FROM {};".format(table_name), con).iloc[0, 0]
+        next_id = 0
+        query = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'id_sequences';"
+        if pd.read_sql_query(query, con).iloc[0, 0] > 0:
+            next_df = pd.read_sql_query("SELECT next_id FROM id_sequences WHERE table_name = '{}';".format(table_name),
+                                        con)
+            next_id = next_df.iloc[0, 0] if len(next_df) > 0 else 0
+        return [int(max_id) if pd.notna(max_id) else 0, int(next_id)]
+
+    @staticmethod
+    def read_file(npy_fp):
+        """
+        the index file is a .npy of the (2 x N) array of hashes and ids, followed by meta JSON (signature and
+        collisions). Both are read through one file handle, so that they come from the same file even if it is
+        replaced by another process meanwhile.
+        :return: memory-mapped array, dict of meta. (None, None) for an index file without meta, to be rebuilt
+        """
+
+        with open(str(npy_fp), 'rb') as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            offset = f.tell()
+            f.seek(offset + int(np.prod(shape)) * dtype.itemsize)
+            meta_text = f.read().decode()
+            if len(meta_text) == 0:
+                return None, None
+            meta = json.loads(meta_text)
+            if shape[1] == 0:
+                return np.empty(shape, dtype=dtype), meta
+            arr = np.memmap(f, dtype=dtype, mode='r', offset=offset, shape=shape)
+        return arr, meta
+
+    @classmethod
+    def build(cls, table_name, con):
+        col_id = "{}_id".format(table_name[:-1])
+        col_name = "{}_name".format(table_name[:-1])
+        query = "SELECT {}, {} FROM {};".format(col_id, col_name, table_name)
+        hash_lst, id_lst = [np.empty(0, dtype=np.uint64)], [np.empty(0, dtype=np.int64)]
+        for df in pd.read_sql_query(query, con, chunksize=cls.CHUNK_SIZE):
+            hash_lst.append(cls.hash_names(df[col_name]))
+            id_lst.append(df[col_id].to_numpy(dtype=np.int64))
+        hashes, ids = np.concatenate(hash_lst), np.concatenate(id_lst)
+        order = np.argsort(hashes, kind="stable")
+        hashes, ids = hashes[order], ids[order]
+
+        collisions = dict()
+        dup_msk = np.zeros(len(hashes), dtype=bool)
+        dup_msk[1:] = hashes[1:] == hashes[:-1]
+        dup_msk[:-1] |= dup_msk[1:]
+        if dup_msk.any():
+            dup_hashes = np.unique(hashes[dup_msk])
+            for df in pd.read_sql_query(query, con, chunksize=cls.CHUNK_SIZE):
+                hit_msk = np.isin(cls.hash_names(df[col_name]), dup_hashes)
+                collisions.update(zip(df[col_name][hit_msk].tolist(), df[col_id][hit_msk].tolist()))
+            LOGGER.warning("found {} names sharing hashes in {}".format(len(collisions), table_name))
+        return cls(hashes, ids, collisions)
+
+    def save(self, npy_fp, **meta):
+        """
+        write to a temporary file first and replace the index file at once, so that readers never see a half-written
+        index, nor the array of one build with meta of another
+        """
+
+        npy_fp.parent.mkdir(parents=True, exist_ok=True)
+        meta["collisions"] = self.collisions
+        tmp_fp = npy_fp.with_name("{}.{}.tmp".format(npy_fp.name, os.getpid()))
+        with open(str(tmp_fp), 'wb') as f:
+            np.save(f, np.stack([self.hashes, self.ids.view(np.uint64)]))
+            f.write(json.dumps(meta).encode())
+        os.replace(str(tmp_fp), str(npy_fp))
+
+    def lookup(self, names, default=-1):
+        """
+        :param names: array-like of names, e.g. a column of DataFrame
+        :return: array of ids, default for missing names
+        """
+
+        names = np.asarray(names, dtype=object)
+        hashes = self.hash_names(names)
+        pos = np.minimum(np.searchsorted(self.hashes, hashes), len(self.hashes) - 1)
+        found_msk = np.zeros(len(names), dtype=bool) if len(self.hashes) == 0 else self.hashes[pos] == hashes
+        ids = np.where(found_msk, self.ids[pos] if len(self.hashes) else 0, default).astype(np.int64)
+        for i in np.flatnonzero(found_msk & np.isin(hashes, self.collision_hashes)).tolist():
+            ids[i] = self.collisions.get(names[i], default)
+        return ids
+
+
 def load_genome_names_by_clade_name(clade_name, con=None):
     create_tmp_con = con is None
     if create_tmp_con:
@@ -137,6 +517,52 @@ def load_genomes_by_genome_names(genome_names, session=None):
     return genomes
 
 
+def read_sql_in_chunks(query, values, con, chunk_size=IN_CHUNK_SIZE):
+    """
+    run query with a long IN list, split into chunks of bound parameters
+    :param query: query with "{}" in place of the IN list, e.g. "SELECT * FROM cdss WHERE genome_id IN ({})"
+    :return: DataFrame of concatenated results
+    """
+
+    values = list(values)
+    chunks = [values[start:start + chunk_size] for start in range(0, len(values), chunk_size)]
+    dfs = []
+    for chunk in chunks if len(chunks) > 0 else [[]]:
+        chunk_query = query.format(", ".join(["?"] * len(chunk)))
+        dfs.append(pd.read_sql_query(chunk_query, con, params=tuple(chunk)))
+    return pd.concat(dfs, ignore_index=True)
+
+
+def load_cds_df_by_genome_names(genome_names, con=None, chunk_size=IN_CHUNK_SIZE):
+    """
+    ORM-free version of load_cdss_by_genome_names(), to be used with ColumnarCdsDAO.
+    :return: DataFrame of cdss table in the order of cds_id, with categorical strand
+    """
+
+    create_tmp_con = con is None
+    if create_tmp_con:
+        con = get_connection()
+
+    start_time = time.perf_counter()
+    genome_df = read_sql_in_chunks("SELECT genome_id, genome_name FROM genomes WHERE genome_name IN ({});",
+                                   genome_names, con, chunk_size)
+    missing_names = set(genome_names) - set(genome_df["genome_name"])
+    if len(missing_names) > 0:
+        raise KeyError("{} genomes are not found, e.g. {}".format(len(missing_names), sorted(missing_names)[0]))
+    query = "SELECT cds_id, genome_id, scaffold_id, cds_name, start, end, length, strand FROM cdss " \
+            "WHERE genome_id IN ({}) ORDER BY cds_id;"
+    cds_df = read_sql_in_chunks(query, genome_df["genome_id"], con, chunk_size)
+    cds_df = cds_df.sort_values("cds_id", kind="mergesort").reset_index(drop=True)  # merge sorted chunks
+    cds_df["strand"] = cds_df["strand"].astype("category")
+    elapsed = time.perf_counter() - start_time
+    LOGGER.info("loaded {} cdss of {} genomes in {:.1f} sec ({:.0f} rows/s)".format(
+        len(cds_df), len(genome_df), elapsed, len(cds_df) / elapsed if elapsed > 0 else 0))
+
+    if create_tmp_con:
+        con.close()
+    return cds_df
+
+
 def load_cdss_by_genome_names(genome_names, session=None):
     create_tmp_session = session is None
     if create_tmp_session:
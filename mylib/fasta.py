@@ -0,0 +1,80 @@
+import mmap
+from logging import getLogger
+
+import numpy as np
+
+logger = getLogger(__name__)
+CHUNK_SIZE = 2 ** 24  # bytes compared at once, to keep the reused mask small for multi-GB files
+NEWLINE = ord('\n')
+SKIP_BELOW = ord('!')  # newlines, carriage returns and spaces, which SeqIO drops from sequences
+SKIP_BYTES = bytes(range(SKIP_BELOW))
+
+
+def iter_headers(buf, start, end):
+    """
+    yield offsets of '>' at the beginning of a line in [start, end)
+    """
+
+    pos = buf.find(b'>', start, end)  # single-byte find is memchr, faster than numpy nonzero for sparse headers
+    while pos >= 0:
+        if pos == 0 or buf[pos - 1] == NEWLINE:
+            yield pos
+        pos = buf.find(b'>', pos + 1, end)
+
+
+def scan_headers(buf, arr, chunk_size=CHUNK_SIZE):
+    """
+    locate headers and count skipped bytes (below '!') before each of them, comparing each chunk of the file once
+    into a reused mask and counting it per segment between headers
+    :param buf: mmap of the FASTA file
+    :param arr: uint8 array sharing memory with buf
+    :return: list of header offsets, list of skipped bytes before each header, number of skipped bytes in the file
+    """
+
+    mask = np.empty(min(chunk_size, len(arr)), dtype=bool)
+    header_starts, skips = [], []
+    skip_total = 0
+    for chunk_start in range(0, len(arr), chunk_size):
+        chunk_end = min(chunk_start + chunk_size, len(arr))
+        skip_msk = mask[:chunk_end - chunk_start]
+        np.less(arr[chunk_start:chunk_end], SKIP_BELOW, out=skip_msk)
+        segment_start = 0
+        for header_start in iter_headers(buf, chunk_start, chunk_end):
+            skip_total += int(np.count_nonzero(skip_msk[segment_start:header_start - chunk_start]))
+            header_starts.append(header_start)
+            skips.append(skip_total)
+            segment_start = header_start - chunk_start
+        skip_total += int(np.count_nonzero(skip_msk[segment_start:]))
+    return header_starts, skips, skip_total
+
+
+def iter_fasta_lengths(fasta_fp, chunk_size=CHUNK_SIZE):
+    """
+    memory-map a FASTA file and yield (name, length) of each record, counting residue bytes between headers without
+    building sequence strings. name is the first word of the header, same as record.id of Bio.SeqIO.
+    Bytes below '!' are not counted as residues, i.e. tabs and control characters in sequences are dropped as well.
+    """
+
+    with open(fasta_fp, 'rb') as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file cannot be mapped
+            return
+    arr = np.frombuffer(buf, dtype=np.uint8)
+    try:
+        header_starts, skips, skip_total = scan_headers(buf, arr, chunk_size)
+        next_starts = header_starts[1:] + [len(buf)]
+        next_skips = skips[1:] + [skip_total]
+        for header_start, skip, next_start, next_skip in zip(header_starts, skips, next_starts, next_skips):
+            header_end = buf.find(b'\n', header_start, next_start)
+            if header_end < 0:
+                header_end = next_start
+            header = buf[header_start + 1:header_end]
+            words = header.split(None, 1)
+            name = words[0].decode() if len(words) > 0 else ""
+            header_skip = len(header) - len(header.translate(None, SKIP_BYTES))
+            # bytes from the newline of the header to the next header, other than skipped bytes
+            yield name, (next_start - header_end) - (next_skip - skip - header_skip)
+    finally:
+        del arr  # release the buffer before closing mmap
+        buf.close()
@@ -1,23 +1,58 @@
 from logging import getLogger
 
+import numpy as np
+import pandas as pd
+
 logger = getLogger(__name__)
+COLUMNS = ["seqid", "source", "type", "start", "end", "score", "strand", "phase", "attributes"]
 
 
 class GffRecord:
+    """
+    A line of GFF. score and attributes are decoded on first access, so that records only read for a few fields
+    (e.g. seqid, start, end, strand) stay cheap.
+    """
+
+    __slots__ = ("seqid", "source", "type", "start", "end", "strand", "phase", "score_text", "attribute_text",
+                 "_attributes")
+
     def __init__(self, line):
-        line = line.strip()
-        line_split = line.split('\t')
-        assert len(line_split) == 9
-
-        self.seqid = line_split[0]
-        self.source = line_split[1]
-        self.type = line_split[2]
-        self.start = int(line_split[3])
-        self.end = int(line_split[4])
-        self.score = float(line_split[5])
-        self.strand = line_split[6]
-        self.phase = line_split[7]
-        self.attributes = self.decode_attributes(line_split[8])
+        self.set_fields(line.strip().split('\t'))
+
+    @classmethod
+    def from_fields(cls, fields):
+        record = cls.__new__(cls)
+        record.set_fields(fields)
+        return record
+
+    def set_fields(self, fields):
+        assert len(fields) == 9
+
+        self.seqid = fields[0]
+        self.source = fields[1]
+        self.type = fields[2]
+        self.start = int(fields[3])
+        self.end = int(fields[4])
+        self.score_text = fields[5]
+        self.strand = fields[6]
+        self.phase = fields[7]
+        self.attribute_text = fields[8]
+        self._attributes = None
+
+    @property
+    def score(self):
+        return float(self.score_text)
+
+    @property
+    def attributes(self):
+        if self._attributes is None:
+            self._attributes = self.decode_attributes(self.attribute_text)
+        return self._attributes
+
+    def get_attribute(self, key, default=None):
+        if self._attributes is None:
+            return find_attribute(self.attribute_text, key, default)  # without decoding all attributes
+        return self._attributes.get(key, default)
 
     def __str__(self):
         return "\t".join([self.seqid, self.source, self.type, str(self.start), str(self.end), str(self.score),
@@ -46,10 +81,64 @@ class GffRecord:
         return text
 
 
-def parse_gff(gff_fp):
-    records = []
+def find_attribute(text, key, default=None):
+    """
+    value of key in the attribute column, without decoding the other attributes
+    """
+
+    needle = "{}=".format(key)
+    pos = text.find(needle)
+    while pos > 0 and text[pos - 1] != ';':
+        pos = text.find(needle, pos + 1)
+    if pos < 0:
+        return default
+    pos += len(needle)
+    end = text.find(';', pos)
+    return text[pos:end] if end >= 0 else text[pos:]
+
+
+def iter_gff(gff_fp, types=None):
+    """
+    stream records line by line, so that memory is flat regardless of file size
+    :param types: feature types to yield (e.g. {"CDS"}), all types by default. Lines of other types are skipped
+                  before creating GffRecord.
+    """
+
     with open(gff_fp, 'r') as f:
         for line in f:
+            line = line.strip()
             if len(line) > 0 and line[0] != '#':
-                records.append(GffRecord(line))
-    return records
+                fields = line.split('\t')
+                if types is None or fields[2] in types:
+                    yield GffRecord.from_fields(fields)
+
+
+def parse_gff(gff_fp):
+    return list(iter_gff(gff_fp))
+
+
+def read_gff_columns(gff_fp, types=None, attributes=()):
+    """
+    bulk version of iter_gff(), which fills columns without creating GffRecord
+    :param attributes: attribute keys to extract as columns, None for records without the key
+    :return: DataFrame of seqid, start, end, strand and attributes
+    """
+
+    columns = dict((column, []) for column in ["seqid", "start", "end", "strand"] + list(attributes))
+    seqids, starts, ends, strands = columns["seqid"], columns["start"], columns["end"], columns["strand"]
+    with open(gff_fp, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0 or line[0] == '#':
+                continue
+            seqid, _, type_, start, end, _, strand, _, attribute_text = line.split('\t')
+            if types is None or type_ in types:
+                seqids.append(seqid)
+                starts.append(start)
+                ends.append(end)
+                strands.append(strand)
+                for key in attributes:
+                    columns[key].append(find_attribute(attribute_text, key))
+    columns["start"] = np.array(starts, dtype=np.int64)
+    columns["end"] = np.array(ends, dtype=np.int64)
+    return pd.DataFrame(columns)
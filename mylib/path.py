@@ -1,3 +1,4 @@
+import hashlib
 from logging import getLogger
 
 LOGGER = getLogger(__name__)
@@ -20,6 +21,14 @@ def build_local_filepath(genome_name, extension=None):
         return "{0}/{1}.{2}".format(local_direc, genome_name, extension)
 
 
+def hash_file(fp, block_size=2 ** 20):
+    sha1 = hashlib.sha1()
+    with open(str(fp), 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
 def build_clade_filepath(clade_name):
     local_direc = "{0}/{1}".format(CLADE_DIREC, clade_name)
     return local_direc
@@ -0,0 +1,114 @@
+import json
+import resource
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import nullcontext
+from logging import getLogger
+
+logger = getLogger(__name__)
+NULL_STAGE = nullcontext()  # reusable no-op context returned by a disabled Profiler
+
+
+def get_peak_rss_mb():
+    """
+    peak resident set size of this process and its finished children (ru_maxrss is in KB on Linux)
+    """
+
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(self_rss, children_rss) / 1024
+
+
+class Stage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.add(self.name, time.perf_counter() - self.start_wall, time.process_time() - self.start_cpu)
+        return False
+
+
+class Profiler:
+    """
+    Record wall time, cpu time, peak rss and counters of named stages, and dump them as a JSON report.
+    A disabled Profiler returns a shared no-op context, so that stages can stay in per-gene loops.
+
+    usage:
+        with profiler.stage("scoring"):
+            ...
+        profiler.count("records", len(records))
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.reset()
+
+    def reset(self):
+        self.stages = OrderedDict()  # key: stage name, val: dict of count, wall, cpu, peak_rss_mb
+        self.counters = defaultdict(int)
+
+    def stage(self, name):
+        if self.enabled:
+            return Stage(self, name)
+        else:
+            return NULL_STAGE
+
+    def add(self, name, wall, cpu, count=1, peak_rss_mb=None):
+        if name not in self.stages:
+            self.stages[name] = {"count": 0, "wall": 0.0, "cpu": 0.0, "peak_rss_mb": 0.0}
+        stat = self.stages[name]
+        stat["count"] += count
+        stat["wall"] += wall
+        stat["cpu"] += cpu
+        stat["peak_rss_mb"] = max(stat["peak_rss_mb"], peak_rss_mb if peak_rss_mb else get_peak_rss_mb())
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] += value
+
+    def to_dict(self):
+        return {
+            "stages": self.stages,
+            "counters": dict(self.counters)
+        }
+
+    def merge(self, profile):
+        """
+        merge to_dict() of another Profiler, e.g. the one of a worker process.
+        cpu time of workers is added up, so that the total cpu time can exceed the wall time.
+        """
+
+        if not self.enabled or profile is None:
+            return
+        for name, stat in profile["stages"].items():
+            self.add(name, stat["wall"], stat["cpu"], count=stat["count"], peak_rss_mb=stat["peak_rss_mb"])
+        for name, value in profile["counters"].items():
+            self.counters[name] += value
+
+    def save(self, fp, **meta):
+        """
+        dump the report as JSON with additional meta information (e.g. script name, arguments)
+        """
+
+        if not self.enabled:
+            return
+        report = OrderedDict(meta)
+        report["wall"] = time.perf_counter() - self.start_wall
+        report["cpu"] = time.process_time() - self.start_cpu
+        report["children_cpu"] = sum(resource.getrusage(resource.RUSAGE_CHILDREN)[:2])
+        report["peak_rss_mb"] = get_peak_rss_mb()
+        report.update(self.to_dict())
+        with open(fp, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info("saved profile to {}".format(fp))
+
+
+NULL_PROFILER = Profiler(enabled=False)